@@ -0,0 +1,85 @@
+"""
+Compares the vectorized voucher aggregation in etl._transform with the previous
+groupby/apply implementation on synthetic data.
+
+Usage, from the root of the project: python -m benchmarks.transform_benchmark [orders] [barcodes_per_order]
+"""
+import sys
+import time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.etl import _transform
+
+
+def _legacy_transform(
+    df_orders: pd.DataFrame,
+    df_barcodes: pd.DataFrame,
+    allow_useless_vouchers: bool = True,
+) -> pd.DataFrame:
+    df_vouchers: pd.DataFrame = df_orders.merge(
+        df_barcodes, on=["order_id"], how="left"
+    ).astype({"barcode": pd.Int64Dtype()})
+
+    if not allow_useless_vouchers:
+        df_vouchers = df_vouchers.dropna(subset=["barcode"])
+
+    return (
+        df_vouchers.sort_values(by=["customer_id", "order_id"], kind="mergesort")
+        .groupby(["customer_id", "order_id"])
+        .apply(lambda df_group: df_group["barcode"].dropna().tolist())
+        .reset_index()
+        .rename(columns={0: "barcodes"})
+    )
+
+
+def _generate(orders: int, barcodes_per_order: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    df_orders = pd.DataFrame(
+        {
+            "customer_id": rng.integers(0, max(orders // 4, 1), orders),
+            "order_id": np.arange(orders),
+        }
+    )
+    total_barcodes = orders * barcodes_per_order
+    df_barcodes = pd.DataFrame(
+        {
+            "barcode": np.arange(total_barcodes),
+            # roughly 10% of the orders do not get any barcode
+            "order_id": rng.integers(0, int(orders * 1.1), total_barcodes),
+        }
+    ).astype({"barcode": pd.Int64Dtype()})
+
+    return df_orders, df_barcodes
+
+
+def _measure(fn: Callable, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def main(orders: int = 200_000, barcodes_per_order: int = 3) -> None:
+    df_orders, df_barcodes = _generate(orders, barcodes_per_order)
+
+    for allow_useless in (True, False):
+        legacy, legacy_time = _measure(
+            _legacy_transform, df_orders, df_barcodes, allow_useless
+        )
+        current, current_time = _measure(
+            _transform, df_orders, df_barcodes, allow_useless
+        )
+
+        assert legacy.to_csv(index=False) == current.to_csv(index=False)
+
+        print(
+            f"allow_useless_vouchers={allow_useless}: "
+            f"legacy {legacy_time:.3f}s, vectorized {current_time:.3f}s, "
+            f"speedup x{legacy_time / current_time:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(it) for it in sys.argv[1:3]])
@@ -0,0 +1,242 @@
+import json
+import os
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.etl import extract
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.schema import BARCODES
+from etl_vouchers.utils import sanitize_path
+
+INDEX_VERSION: int = 1
+
+_META: str = "meta.json"
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    tmp_path: str = f"{path}.tmp"
+
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+
+    os.replace(tmp_path, path)
+
+
+def build_index(
+    barcodes_filepath: str, index_path: str, engine: str = "c"
+) -> "BarcodeIndex":
+    """
+    Builds the barcode index of a barcodes file, an existing index in the folder is replaced.
+
+    Rows without a barcode can not be looked up and are left out, they are only counted.
+    Duplicated barcodes are kept, lookups return the first of them in the file order.
+
+    :param barcodes_filepath: path to the barcodes file.
+    :param index_path: folder of the index.
+    :param engine: csv engine, c or pyarrow.
+    :return: opened BarcodeIndex
+    """
+    folder: str = sanitize_path(index_path)
+    os.makedirs(folder, exist_ok=True)
+    stat: os.stat_result = os.stat(barcodes_filepath)
+
+    df: pd.DataFrame = extract(barcodes_filepath, BARCODES, engine=engine)
+    has_barcode: np.ndarray = df["barcode"].notna().to_numpy()
+    barcodes: np.ndarray = df["barcode"].to_numpy(dtype=np.int64, na_value=0)[
+        has_barcode
+    ]
+    order_ids: pd.Series = df["order_id"][has_barcode]
+    del df
+
+    order: np.ndarray = np.argsort(barcodes, kind="stable")
+    unused: np.ndarray = order_ids.isna().to_numpy()[order]
+
+    # the meta file is written last, an index without it is incomplete
+    if os.path.exists(f"{folder}{_META}"):
+        os.unlink(f"{folder}{_META}")
+
+    _save_array(f"{folder}barcodes.npy", barcodes[order])
+    _save_array(
+        f"{folder}order_ids.npy",
+        order_ids.to_numpy(dtype=np.int64, na_value=0)[order],
+    )
+    _save_array(f"{folder}unused.npy", np.packbits(unused))
+
+    meta: Dict = {
+        "version": INDEX_VERSION,
+        "source": os.path.abspath(barcodes_filepath),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "rows": int(len(order)),
+        "unused": int(unused.sum()),
+        "without_barcode": int((~has_barcode).sum()),
+        "created_at": time.time(),
+    }
+
+    with open(f"{folder}{_META}.tmp", "w") as f:
+        json.dump(meta, f, indent=2)
+
+    os.replace(f"{folder}{_META}.tmp", f"{folder}{_META}")
+
+    return BarcodeIndex(folder)
+
+
+class BarcodeIndex:
+    """
+    Persistent index of a barcodes file for lookups without parsing the file again.
+
+    The folder holds the barcodes sorted ascending, the order id of every barcode
+    and a bitmap of the unused ones (barcodes without an order) as .npy files.
+    They are memory-mapped, so opening the index does not read them
+    and a query only touches the pages it needs.
+
+    Usage:
+        index = ensure_index("barcodes.csv", "./.barcode_index")
+        index.lookup(11111111111)
+        index.between(11111111111, 11111111200)
+        index.unused()
+
+    :param index_path - folder of the index, see build_index.
+    """
+
+    def __init__(self, index_path: str):
+        self.path: str = sanitize_path(index_path)
+
+        try:
+            with open(f"{self.path}{_META}") as f:
+                self.meta: Dict = json.load(f)
+
+            if self.meta.get("version") != INDEX_VERSION:
+                raise ValueError(f"unsupported version {self.meta.get('version')}")
+
+            self.barcodes: np.ndarray = np.load(
+                f"{self.path}barcodes.npy", mmap_mode="r"
+            )
+            self.order_ids: np.ndarray = np.load(
+                f"{self.path}order_ids.npy", mmap_mode="r"
+            )
+            self._unused_bits: np.ndarray = np.load(
+                f"{self.path}unused.npy", mmap_mode="r"
+            )
+        except (OSError, ValueError, KeyError) as e:
+            raise ETLVouchersException(
+                f"Can not open barcode index {self.path}: {str(e)}"
+            )
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    def is_fresh(self, barcodes_filepath: str) -> bool:
+        """
+        :return: True if the index was built from the file as it is now (same path, size and mtime).
+        """
+        try:
+            stat: os.stat_result = os.stat(barcodes_filepath)
+        except OSError:
+            return False
+
+        return (
+            self.meta["source"] == os.path.abspath(barcodes_filepath)
+            and self.meta["size"] == stat.st_size
+            and self.meta["mtime_ns"] == stat.st_mtime_ns
+        )
+
+    def _is_unused(self, positions: np.ndarray) -> np.ndarray:
+        positions = np.asarray(positions, dtype=np.int64)
+
+        return (self._unused_bits[positions >> 3] >> (7 - (positions & 7))) & 1 == 1
+
+    def lookup(self, barcode: int) -> Optional[int]:
+        """
+        :return: order id of the barcode, None if the barcode is unknown or unused.
+        """
+        order_id = self.lookup_many([barcode]).iloc[0]
+
+        return None if order_id is pd.NA else int(order_id)
+
+    def lookup_many(self, barcodes: Sequence[int]) -> pd.Series:
+        """
+        :param barcodes: barcodes to look up.
+        :return: pd.Series (Int64) indexed by the barcodes with their order ids, <NA> for unknown and unused barcodes.
+        """
+        wanted: np.ndarray = np.asarray(barcodes, dtype=np.int64)
+        order_ids: pd.Series = pd.Series(pd.NA, index=wanted, dtype="Int64")
+
+        if not len(self):
+            return order_ids
+
+        positions: np.ndarray = np.minimum(
+            np.searchsorted(self.barcodes, wanted), len(self) - 1
+        )
+        found: np.ndarray = (self.barcodes[positions] == wanted) & ~self._is_unused(
+            positions
+        )
+        order_ids.iloc[found] = self.order_ids[positions[found]]
+
+        return order_ids
+
+    def between(
+        self, low: Optional[int] = None, high: Optional[int] = None
+    ) -> pd.DataFrame:
+        """
+        :param low: lowest barcode, inclusive, unbounded if None.
+        :param high: highest barcode, inclusive, unbounded if None.
+        :return: pd.DataFrame with barcode and order_id (<NA> if unused) of the barcodes in the range, ascending.
+        """
+        start: int = (
+            0 if low is None else int(np.searchsorted(self.barcodes, low, side="left"))
+        )
+        stop: int = (
+            len(self)
+            if high is None
+            else int(np.searchsorted(self.barcodes, high, side="right"))
+        )
+
+        return self._frame(np.arange(start, stop))
+
+    def _frame(self, positions: np.ndarray) -> pd.DataFrame:
+        order_ids: pd.Series = pd.Series(self.order_ids[positions], dtype="Int64")
+        order_ids[self._is_unused(positions)] = pd.NA
+
+        return pd.DataFrame(
+            {
+                "barcode": pd.Series(self.barcodes[positions], dtype="Int64"),
+                "order_id": order_ids,
+            }
+        )
+
+    @property
+    def unused_count(self) -> int:
+        return self.meta["unused"]
+
+    def unused(self, limit: Optional[int] = None) -> np.ndarray:
+        """
+        :param limit: if supplied, only the limit lowest unused barcodes are returned.
+        :return: np.ndarray with the unused barcodes, ascending.
+        """
+        bits: np.ndarray = np.unpackbits(self._unused_bits, count=len(self))
+        positions: np.ndarray = np.flatnonzero(bits)
+
+        return np.asarray(self.barcodes[positions[:limit]])
+
+
+def ensure_index(
+    barcodes_filepath: str, index_path: str, engine: str = "c"
+) -> BarcodeIndex:
+    """
+    Opens the index of the barcodes file, it is (re)built if it is missing or the file has changed since.
+
+    :return: BarcodeIndex
+    """
+    try:
+        index: BarcodeIndex = BarcodeIndex(index_path)
+
+        if index.is_fresh(barcodes_filepath):
+            return index
+    except ETLVouchersException:
+        pass
+
+    return build_index(barcodes_filepath, index_path, engine=engine)
@@ -0,0 +1,324 @@
+import importlib
+import json
+import os
+import re
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.formats import FORMATS
+
+ORDERS_DROP: str = "orders"
+BARCODES_DROP: str = "barcodes"
+
+DONE: str = "done"
+FAILED: str = "failed"
+
+# orders.<ts>.csv, barcodes.<ts>.parquet, ...
+_DROP_NAME = re.compile(r"^(?P<kind>orders|barcodes)\.(?P<ts>\d+)(?P<extension>\..+)$")
+
+
+@dataclass(frozen=True)
+class Drop:
+    """
+    Input file named <kind>.<timestamp>.<extension>.
+    """
+
+    kind: str
+    ts: int
+    filepath: str
+
+
+@dataclass(frozen=True)
+class DropPair:
+    """
+    Orders and barcodes drops that are processed together.
+    """
+
+    orders: str
+    barcodes: str
+
+
+def scan_drops(
+    input_path: str, settle_seconds: float = 0.0, now: Optional[float] = None
+) -> Dict[str, List[Drop]]:
+    """
+    :param input_path: folder with the drops.
+    :param settle_seconds: files modified more recently are skipped, they may still be being written.
+    :param now: current time, time.time() by default.
+    :return: dict with orders and barcodes drops, sorted by timestamp.
+    """
+    now = time.time() if now is None else now
+    drops: Dict[str, List[Drop]] = {ORDERS_DROP: [], BARCODES_DROP: []}
+
+    try:
+        # absolute paths keep the ledger valid when the batch runs from another folder
+        entries = list(os.scandir(os.path.abspath(input_path)))
+    except OSError as e:
+        raise ETLVouchersException(f"Can not scan {input_path}: {str(e)}")
+
+    for entry in entries:
+        match = _DROP_NAME.match(entry.name)
+
+        if (
+            match is None
+            or match.group("extension").lower() not in FORMATS
+            or not entry.is_file()
+            or now - entry.stat().st_mtime < settle_seconds
+        ):
+            continue
+
+        drops[match.group("kind")].append(
+            Drop(match.group("kind"), int(match.group("ts")), entry.path)
+        )
+
+    for it in drops.values():
+        it.sort(key=lambda drop: (drop.ts, drop.filepath))
+
+    return drops
+
+
+def pair_drops(
+    orders: List[Drop], barcodes: List[Drop], max_skew: int = 60
+) -> List[DropPair]:
+    """
+    Pairs every orders drop with the barcodes drop of the nearest timestamp,
+    the closest pairs are matched first and every drop is used once.
+
+    :param max_skew: max difference of the timestamps in seconds, drops without a partner that close stay unpaired.
+    :return: list of DropPairs sorted by the orders timestamp.
+    """
+    candidates = sorted(
+        (abs(o.ts - b.ts), o.ts, b.ts, o.filepath, b.filepath)
+        for o in orders
+        for b in barcodes
+        if abs(o.ts - b.ts) <= max_skew
+    )
+    used: Set[str] = set()
+    pairs: List[DropPair] = []
+
+    for _, _, _, orders_filepath, barcodes_filepath in candidates:
+        if orders_filepath in used or barcodes_filepath in used:
+            continue
+
+        used.update((orders_filepath, barcodes_filepath))
+        pairs.append(DropPair(orders_filepath, barcodes_filepath))
+
+    return sorted(pairs, key=lambda it: it.orders)
+
+
+class Ledger:
+    """
+    Append-only json lines file with the result of every processed pair,
+    a pair, and every drop of it, is processed only once.
+
+    :param path - path to the ledger file.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.entries: List[Dict] = []
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self.entries.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            raise ETLVouchersException(f"Can not read ledger {path}: {str(e)}")
+
+    def used_drops(self, retry_failed: bool = False) -> Set[str]:
+        """
+        :return: paths of the drops that were processed, failed ones are left out if retry_failed.
+        """
+        used: Set[str] = set()
+
+        for it in self.entries:
+            if it["status"] == DONE or not retry_failed:
+                used.update((it["orders"], it["barcodes"]))
+
+        return used
+
+    def record(self, pair: DropPair, status: str, **fields) -> Dict:
+        entry: Dict = {
+            "orders": pair.orders,
+            "barcodes": pair.barcodes,
+            "status": status,
+            **fields,
+            "finished_at": time.time(),
+        }
+
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.entries.append(entry)
+
+        return entry
+
+
+def _warm_up() -> None:
+    # Ctrl+C stops the batch in the main process, the workers finish the pairs they run
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # pandas and the pipeline are imported once per worker process, not once per pair
+    importlib.import_module("etl_vouchers.etl")
+
+
+def _run_pair(args) -> Dict:
+    from etl_vouchers.etl import PipelineResponse, pipeline
+    from etl_vouchers.preflight import PREFLIGHT_SAMPLE_ROWS
+
+    pair, dest_path, kwargs = args
+    started: float = time.perf_counter()
+
+    try:
+        # a malformed drop fails on its header instead of after the full parse
+        resp: PipelineResponse = pipeline(
+            pair.orders,
+            pair.barcodes,
+            dest_path,
+            summary_only=True,
+            **{"preflight_rows": PREFLIGHT_SAMPLE_ROWS, **kwargs},
+        )
+    except ETLVouchersException as e:
+        return {"status": FAILED, "error": str(e)}
+
+    return {
+        "status": DONE,
+        "output": resp.output_filepath,
+        "orders_rows": resp.summary.orders,
+        "barcodes_rows": resp.summary.barcodes,
+        "vouchers": resp.summary.vouchers,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def run_batch(
+    input_path: str,
+    dest_path: str,
+    ledger_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    max_pending: Optional[int] = None,
+    watch: bool = False,
+    interval: float = 5.0,
+    max_skew: int = 60,
+    settle_seconds: float = 1.0,
+    retry_failed: bool = False,
+    on_result: Optional[Callable[[Dict], None]] = None,
+    stop: Optional[threading.Event] = None,
+    **pipeline_kwargs,
+) -> List[Dict]:
+    """
+    Runs the pipeline for every pending pair of drops in the input folder on a process pool.
+
+    Worker processes live for the whole batch, so the imports are paid once per worker.
+    At most max_pending pairs are submitted at once, the rest waits until a worker is free,
+    so a large backlog of drops does not pile up in memory. Every finished pair is appended
+    to the ledger before the next one is submitted, so pairs in the ledger never run again.
+
+    :param input_path: folder with orders.<ts>.csv and barcodes.<ts>.csv drops.
+    :param dest_path: folder the outputs are stored to.
+    :param ledger_path: path to the ledger, <dest_path>/ledger.jsonl by default.
+    :param workers: amount of worker processes, amount of CPUs by default.
+    :param max_pending: max amount of pairs submitted to the pool at once, 2 * workers by default.
+    :param watch: bool, if true, the folder is scanned again every interval seconds until stop is set.
+    :param interval: seconds between the scans in the watch mode.
+    :param max_skew: max difference of the timestamps of a pair in seconds.
+    :param settle_seconds: files modified more recently are left for the next scan.
+    :param retry_failed: bool, if true, pairs that failed before are run again.
+    :param on_result: called with the ledger entry of every finished pair.
+    :param stop: threading.Event that ends the watch mode (as does Ctrl+C), the submitted pairs are finished first.
+    :param pipeline_kwargs: passed to etl.pipeline, e.g. allow_useless_vouchers or output_format.
+    :return: ledger entries of the pairs processed by this call.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    stop = stop or threading.Event()
+    ledger: Ledger = Ledger(ledger_path or os.path.join(dest_path, "ledger.jsonl"))
+    pipeline_kwargs.setdefault("silent", True)
+
+    queued: Deque[DropPair] = deque()
+    running: Dict[Future, DropPair] = {}
+    results: List[Dict] = []
+
+    def scan() -> None:
+        drops: Dict[str, List[Drop]] = scan_drops(input_path, settle_seconds)
+        # drops of pairs that are finished, queued or running are not paired again
+        used: Set[str] = ledger.used_drops(retry_failed)
+
+        for pair in [*queued, *running.values()]:
+            used.update((pair.orders, pair.barcodes))
+
+        queued.extend(
+            pair_drops(
+                [it for it in drops[ORDERS_DROP] if it.filepath not in used],
+                [it for it in drops[BARCODES_DROP] if it.filepath not in used],
+                max_skew,
+            )
+        )
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_warm_up) as executor:
+        scan()
+
+        while queued or running or (watch and not stop.is_set()):
+            if stop.is_set():
+                # only the pairs that already run are finished
+                queued.clear()
+
+            while queued and len(running) < max_pending:
+                pair: DropPair = queued.popleft()
+                running[
+                    executor.submit(_run_pair, (pair, dest_path, pipeline_kwargs))
+                ] = pair
+
+            try:
+                done, _ = wait(
+                    list(running),
+                    timeout=interval if watch else None,
+                    return_when=FIRST_COMPLETED,
+                )
+            except KeyboardInterrupt:
+                stop.set()
+                continue
+
+            for future in done:
+                pair = running.pop(future)
+
+                try:
+                    result: Dict = future.result()
+                except Exception as e:
+                    result = {"status": FAILED, "error": repr(e)}
+
+                entry: Dict = ledger.record(pair, **result)
+                results.append(entry)
+
+                if on_result is not None:
+                    on_result(entry)
+
+            if watch and not stop.is_set() and not queued:
+                if not running:
+                    try:
+                        stop.wait(interval)
+                    except KeyboardInterrupt:
+                        stop.set()
+                        continue
+
+                scan()
+
+    return results
@@ -0,0 +1,238 @@
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from etl_vouchers.etl import _load, _transform, extract
+from etl_vouchers.metrics import PeakRSS
+from etl_vouchers.schema import BARCODES, ORDERS
+from etl_vouchers.statistic import VoucherStatistic
+from etl_vouchers.validator import BarcodesValidator, OrdersValidator
+
+STAGES: List[str] = [
+    "extract_orders",
+    "extract_barcodes",
+    "validate_orders",
+    "validate_barcodes",
+    "transform",
+    "load",
+    "top_customers",
+    "unused_barcodes",
+]
+
+
+@dataclass
+class StageResult:
+    """
+    Measurements of a single stage, the best wall time of all the repeats is kept.
+
+    :param stage - name of the stage.
+    :param rows - amount of input rows of the stage.
+    :param seconds - wall time.
+    :param peak_rss - peak resident set size of the process while the stage ran, in bytes.
+    :param rows_per_second - rows / seconds.
+    """
+
+    stage: str
+    rows: int
+    seconds: float
+    peak_rss: int
+    rows_per_second: float
+
+
+@dataclass
+class BenchmarkResult:
+    """
+    Results of a benchmark run together with the environment it ran in.
+    """
+
+    orders_filepath: str
+    barcodes_filepath: str
+    stages: List[StageResult]
+    commit: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    environment: Dict[str, str] = field(default_factory=dict)
+
+    def to_json(self, filepath: str) -> str:
+        with open(filepath, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+
+        return filepath
+
+    @classmethod
+    def from_json(cls, filepath: str) -> "BenchmarkResult":
+        with open(filepath) as f:
+            data: Dict = json.load(f)
+
+        data["stages"] = [StageResult(**it) for it in data["stages"]]
+
+        return cls(**data)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpus": str(os.cpu_count()),
+    }
+
+
+def measure(stage: str, rows: int, fn: Callable, repeat: int = 1):
+    """
+    Runs fn `repeat` times.
+
+    :return: result of the last call and StageResult with the best wall time and the highest peak RSS.
+    """
+    seconds: float = float("inf")
+    peak: int = 0
+    result = None
+
+    for _ in range(max(repeat, 1)):
+        with PeakRSS() as rss:
+            started: float = time.perf_counter()
+            result = fn()
+            seconds = min(seconds, time.perf_counter() - started)
+
+        # 0 where the platform reports no RSS
+        peak = max(peak, rss.peak or 0)
+
+    return result, StageResult(
+        stage=stage,
+        rows=rows,
+        seconds=seconds,
+        peak_rss=peak,
+        rows_per_second=rows / seconds if seconds > 0 else 0.0,
+    )
+
+
+def run_benchmark(
+    orders_filepath: str,
+    barcodes_filepath: str,
+    repeat: int = 1,
+    dest_path: Optional[str] = None,
+) -> BenchmarkResult:
+    """
+    Measures every stage of the pipeline and of VoucherStatistic against the supplied files.
+
+    :param orders_filepath: path to the orders file, e.g. generated by synthetic.generate_dataset.
+    :param barcodes_filepath: path to the barcodes file.
+    :param repeat: amount of runs of every stage, the best wall time is reported.
+    :param dest_path: folder the load stage writes into, a temporary folder by default.
+    :return: BenchmarkResult
+    """
+    stages: List[StageResult] = []
+
+    def run(stage: str, rows: int, fn: Callable):
+        result, stage_result = measure(stage, rows, fn, repeat)
+        stages.append(stage_result)
+
+        return result
+
+    df_orders: pd.DataFrame = run(
+        "extract_orders", 0, lambda: extract(orders_filepath, ORDERS)
+    )
+    df_barcodes: pd.DataFrame = run(
+        "extract_barcodes", 0, lambda: extract(barcodes_filepath, BARCODES)
+    )
+    # extract only knows the amount of rows once it is done
+    stages[0].rows, stages[1].rows = len(df_orders), len(df_barcodes)
+
+    for it in stages:
+        it.rows_per_second = it.rows / it.seconds if it.seconds > 0 else 0.0
+
+    df_orders = run(
+        "validate_orders",
+        len(df_orders),
+        lambda: OrdersValidator(df_orders.copy(), silent=True)(),
+    )
+    df_barcodes = run(
+        "validate_barcodes",
+        len(df_barcodes),
+        lambda: BarcodesValidator(df_barcodes.copy(), silent=True)(),
+    )
+    df_vouchers: pd.DataFrame = run(
+        "transform",
+        len(df_orders) + len(df_barcodes),
+        lambda: _transform(df_orders, df_barcodes),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run("load", len(df_vouchers), lambda: _load(df_vouchers, dest_path or tmp))
+
+    # every run gets a fresh statistic, so the inputs are extracted again instead of served from its cache,
+    # the printed reports are discarded as the unused barcodes alone may be millions of lines
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        run(
+            "top_customers",
+            len(df_orders),
+            lambda: VoucherStatistic(
+                orders_filepath, barcodes_filepath
+            ).top_customers(),
+        )
+        run(
+            "unused_barcodes",
+            stages[1].rows,
+            lambda: VoucherStatistic(
+                orders_filepath, barcodes_filepath
+            ).unused_barcodes(),
+        )
+
+    return BenchmarkResult(
+        orders_filepath=orders_filepath,
+        barcodes_filepath=barcodes_filepath,
+        stages=stages,
+        commit=_git_commit(),
+        environment=_environment(),
+    )
+
+
+def compare(
+    baseline: BenchmarkResult, current: BenchmarkResult, threshold: float = 0.1
+) -> List[str]:
+    """
+    Compares two benchmark runs stage by stage.
+
+    :param baseline: BenchmarkResult of the reference commit.
+    :param current: BenchmarkResult of the commit under test.
+    :param threshold: relative slowdown or peak RSS growth that is reported, 0.1 - 10%.
+    :return: list of human readable regressions, empty if there are none.
+    """
+    before: Dict[str, StageResult] = {it.stage: it for it in baseline.stages}
+    regressions: List[str] = []
+
+    for it in current.stages:
+        reference: Optional[StageResult] = before.get(it.stage)
+
+        if reference is None:
+            continue
+
+        for metric in ("seconds", "peak_rss"):
+            old, new = getattr(reference, metric), getattr(it, metric)
+
+            if old > 0 and new > old * (1 + threshold):
+                regressions.append(
+                    f"{it.stage}: {metric} {old:.4g} -> {new:.4g} (+{(new / old - 1):.0%})"
+                )
+
+    return regressions
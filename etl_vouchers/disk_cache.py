@@ -0,0 +1,237 @@
+import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from etl_vouchers.etl import InputCache
+from etl_vouchers.formats import _apply_schema
+from etl_vouchers.incremental import fingerprint
+from etl_vouchers.schema import Schema
+from etl_vouchers.utils import parse_size, sanitize_path
+
+CACHE_DIR_ENV: str = "ETL_VOUCHERS_CACHE_DIR"
+CACHE_SIZE_ENV: str = "ETL_VOUCHERS_CACHE_SIZE"
+
+DEFAULT_MAX_BYTES: int = 2 * 1024**3
+
+_INDEX: str = "index.json"
+
+
+def default_cache_dir() -> str:
+    """
+    :return: $ETL_VOUCHERS_CACHE_DIR, ~/.cache/etl_vouchers by default.
+    """
+    return os.environ.get(CACHE_DIR_ENV) or os.path.join(
+        os.path.expanduser("~"), ".cache", "etl_vouchers"
+    )
+
+
+def _atomic_write_json(path: str, data: Dict) -> None:
+    folder: str = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=".index.", suffix=".tmp", dir=folder)
+
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+
+    os.replace(tmp_path, path)
+
+
+class DiskCache:
+    """
+    On-disk cache of parsed and validated input frames, shared by all the runs on a machine.
+
+    Frames are stored as uncompressed Feather (Arrow IPC) files and loaded memory-mapped.
+    An entry is keyed by the sha256 of the input content together with the schema, validator,
+    validation backend and csv engine that produced it. The sha256 of a file is computed once
+    and reused as long as its path, size and mtime stay the same.
+    When the cache outgrows max_bytes, the least recently used entries are evicted.
+
+    The entries are found by listing the folder and their mtime is the time of their last use,
+    so runs that share the folder never lose each other's entries. The index only remembers
+    the sha256 of the inputs, a run that loses an update of it hashes the file again.
+    Reads and writes of an instance are serialized, so it can be shared by threads.
+
+    :param folder - folder of the cache, see default_cache_dir.
+    :param max_bytes - size limit of all the entries, $ETL_VOUCHERS_CACHE_SIZE or 2GB by default.
+    """
+
+    def __init__(self, folder: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.folder: str = sanitize_path(folder or default_cache_dir())
+        self.max_bytes: int = (
+            max_bytes
+            if max_bytes is not None
+            else parse_size(os.environ.get(CACHE_SIZE_ENV) or DEFAULT_MAX_BYTES)
+        )
+        os.makedirs(self.folder, exist_ok=True)
+        # the index is read, updated and written back by every get and put
+        self._lock: threading.RLock = threading.RLock()
+
+    @staticmethod
+    def available() -> bool:
+        """
+        :return: True if pyarrow, required to store the frames, is installed.
+        """
+        return importlib.util.find_spec("pyarrow") is not None
+
+    def _read_index(self) -> Dict:
+        try:
+            with open(f"{self.folder}{_INDEX}") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"files": {}}
+
+    def _write_index(self, index: Dict) -> None:
+        _atomic_write_json(f"{self.folder}{_INDEX}", index)
+
+    def _content_hash(self, filepath: str, index: Dict) -> str:
+        path: str = os.path.abspath(filepath)
+        stat: os.stat_result = os.stat(path)
+        known: Optional[Dict] = index["files"].get(path)
+
+        if (
+            known is not None
+            and known["size"] == stat.st_size
+            and known["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return known["sha256"]
+
+        sha256: str = fingerprint(path)["sha256"]
+        index["files"][path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+        }
+        self._write_index(index)
+
+        return sha256
+
+    def key(self, filepath: str, parts: Tuple, index: Optional[Dict] = None) -> str:
+        """
+        :param filepath: path to the input file.
+        :param parts: everything else the cached frame depends on, e.g. schema and validator.
+        :return: str, key of the cache entry.
+        """
+        index = index if index is not None else self._read_index()
+        content: str = self._content_hash(filepath, index)
+
+        return hashlib.sha256(repr((content, *parts)).encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return f"{self.folder}{key}.feather"
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        """
+        :return: path, bytes and time of the last use of every entry in the folder, least recently used first.
+        """
+        entries: List[Tuple[str, int, float]] = []
+
+        for it in os.scandir(self.folder):
+            if it.name.startswith(".") or not it.name.endswith(".feather"):
+                continue
+
+            try:
+                stat: os.stat_result = it.stat()
+            except FileNotFoundError:
+                continue
+
+            entries.append((it.path, stat.st_size, stat.st_mtime))
+
+        return sorted(entries, key=lambda it: it[2])
+
+    def get(
+        self, filepath: str, parts: Tuple, schema: Optional[Schema] = None
+    ) -> Optional[pd.DataFrame]:
+        """
+        :return: cached frame of the file, None on a cache miss.
+        """
+        with self._lock:
+            return self._get(filepath, parts, schema)
+
+    def _get(
+        self, filepath: str, parts: Tuple, schema: Optional[Schema]
+    ) -> Optional[pd.DataFrame]:
+        import pyarrow.feather as feather
+
+        path: str = self._entry_path(self.key(filepath, parts))
+
+        try:
+            # the entry of a concurrent run can be evicted at any time
+            table = feather.read_table(path, memory_map=True)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return _apply_schema(table.to_pandas(), schema)
+
+    def put(self, filepath: str, parts: Tuple, df: pd.DataFrame) -> None:
+        """
+        Stores the frame of the file and evicts the least recently used entries over max_bytes.
+        """
+        with self._lock:
+            self._put(filepath, parts, df)
+
+    def _put(self, filepath: str, parts: Tuple, df: pd.DataFrame) -> None:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        key: str = self.key(filepath, parts)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".entry.", suffix=".tmp", dir=self.folder
+        )
+        os.close(fd)
+
+        feather.write_feather(
+            pa.Table.from_pandas(df, preserve_index=False),
+            tmp_path,
+            compression="uncompressed",
+        )
+        os.replace(tmp_path, self._entry_path(key))
+        self._evict()
+
+    def _evict(self) -> None:
+        entries: List[Tuple[str, int, float]] = self._entries()
+        total: int = sum(size for _, size, _ in entries)
+
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+
+            total -= size
+
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def size(self) -> int:
+        """
+        :return: int, amount of bytes all the entries take.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self) -> None:
+        for path, _, _ in self._entries():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+        self._write_index({"files": {}})
+
+
+def input_cache(use_disk: bool = False, folder: Optional[str] = None) -> InputCache:
+    """
+    :param use_disk: bool, if true, the frames are also stored in the disk cache, if pyarrow is installed.
+    :param folder: folder of the DiskCache, see default_cache_dir.
+    :return: InputCache, backed by a DiskCache if use_disk.
+    """
+    if not use_disk or not DiskCache.available():
+        return InputCache()
+
+    return InputCache(store=DiskCache(folder))
@@ -1,22 +1,81 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, Iterator, List, Optional, Tuple, Type, Union
 
 import pandas as pd
 
-from etl_vouchers.utils import current_time, sanitize_path
-from etl_vouchers.exceptions import InvalidSourceFile
-from etl_vouchers.validator import BarcodesValidator, OrdersValidator
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.expectations import NATIVE_BACKEND
+from etl_vouchers.formats import (
+    CSV,
+    detect_format,
+    iter_frames,
+    read_frame,
+)
+from etl_vouchers.metrics import Metrics, span
+from etl_vouchers.schema import BARCODES, CSV_ENGINES, ORDERS, Schema
+from etl_vouchers.utils import pretty_print
+from etl_vouchers.validator import BarcodesValidator, OrdersValidator, Validator
+from etl_vouchers.vouchers import Vouchers
 
+LOAD_BATCH_SIZE: int = 500_000
 
-def extract(filepath: str) -> pd.DataFrame:
+# the in-memory pipeline, the sql engines are listed in etl_vouchers.sql_engine.SQL_ENGINES
+PANDAS_ENGINE: str = "pandas"
+
+
+def extract(
+    filepath: str,
+    schema: Optional[Schema] = None,
+    engine: str = "c",
+    fmt: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Extracts data from csv, parquet or feather filepath.
+
+    :param filepath: path to a csv, parquet or feather file.
+    :param schema: Schema, if supplied only its columns are parsed, straight into its dtypes.
+    :param engine: csv parser, "c" or "pyarrow".
+    :param fmt: csv, parquet or feather, detected by the file extension by default.
+    :param columns: columns to read, overrides the schema columns.
+    :return: pandas DataFrame that contains data from the supplied file.
+    """
+    if engine not in CSV_ENGINES:
+        raise ETLVouchersException(f"Unknown csv engine {engine}")
+
+    fmt = detect_format(filepath, fmt)
+
+    try:
+        return read_frame(filepath, schema, fmt=fmt, columns=columns, engine=engine)
+    except ETLVouchersException:
+        raise
+    except Exception as e:
+        raise InvalidSourceFile(f"Can not read file {filepath}: {str(e)}")
+
+
+def extract_chunks(
+    filepath: str,
+    chunksize: int,
+    schema: Optional[Schema] = None,
+    fmt: Optional[str] = None,
+) -> Iterator[pd.DataFrame]:
     """
-    Extracts data from csv filepath.
+    Extracts data from csv, parquet or feather filepath chunk by chunk, csv is always parsed with the C engine.
 
-    :param filepath: path to a csv file.
-    :return: pandas DataFrame that contains data from the supplied csv.
+    :param filepath: path to a csv, parquet or feather file.
+    :param chunksize: max amount of rows in every chunk.
+    :param schema: Schema, if supplied only its columns are parsed, straight into its dtypes.
+    :param fmt: csv, parquet or feather, detected by the file extension by default.
+    :return: iterator over pandas DataFrames that contain data from the supplied file.
     """
+    fmt = detect_format(filepath, fmt)
+
     try:
-        return pd.read_csv(filepath)
+        yield from iter_frames(filepath, chunksize, schema, fmt=fmt)
+    except ETLVouchersException:
+        raise
     except Exception as e:
         raise InvalidSourceFile(f"Can not read file {filepath}: {str(e)}")
 
@@ -25,6 +84,7 @@ def _transform(
     df_orders: pd.DataFrame,
     df_barcodes: pd.DataFrame,
     allow_useless_vouchers: bool = True,
+    metrics: Optional[Metrics] = None,
 ) -> pd.DataFrame:
     """
     Main place responsible for data transformation.
@@ -32,42 +92,338 @@ def _transform(
     :param df_orders: pd.DataFrame with orders data
     :param df_barcodes: pd.DataFrame with barcodes data
     :param allow_useless_vouchers: bool, if false all the vouchers without any barcodes will be ignored.
+    :param metrics: Metrics, if supplied the merge and the aggregation are recorded as sub-steps.
     :return: pd.DataFrame of merged and transformed data
     """
-    df_vouchers: pd.DataFrame = df_orders.merge(
-        df_barcodes, on=["order_id"], how="left"
-    ).astype({"barcode": pd.Int64Dtype()})
+    return _transform_vouchers(
+        df_orders, df_barcodes, allow_useless_vouchers, metrics
+    ).to_frame()
 
-    if not allow_useless_vouchers:
-        df_vouchers = df_vouchers.dropna(subset=["barcode"])
 
-    return (
-        df_vouchers.sort_values(by=["customer_id", "order_id"])
-        .groupby(["customer_id", "order_id"])
-        .apply(lambda df_group: df_group["barcode"].dropna().tolist())
-        .reset_index()
-        .rename(columns={0: "barcodes"})
-    )
+def _transform_vouchers(
+    df_orders: pd.DataFrame,
+    df_barcodes: pd.DataFrame,
+    allow_useless_vouchers: bool = True,
+    metrics: Optional[Metrics] = None,
+) -> Vouchers:
+    """
+    Same as _transform, but the vouchers are kept in the compact Vouchers layout.
+    """
+    with span(metrics, "merge", rows_in=len(df_orders) + len(df_barcodes)) as it:
+        # unused barcodes never match an order, and nullable keys with missing values
+        # can not be joined with the non-nullable order ids
+        df_vouchers: pd.DataFrame = df_orders.merge(
+            df_barcodes[df_barcodes["order_id"].notna()], on=["order_id"], how="left"
+        )
+
+        if not allow_useless_vouchers:
+            df_vouchers = df_vouchers.dropna(subset=["barcode"])
 
+        it.rows_out = len(df_vouchers)
 
-def _load(df_vouchers: pd.DataFrame, dest_path: str) -> str:
+    with span(metrics, "aggregate", rows_in=len(df_vouchers)) as it:
+        vouchers: Vouchers = Vouchers.from_merged(df_vouchers)
+        it.rows_out = len(vouchers)
+
+    return vouchers
+
+
+def _aggregate_barcodes(df_vouchers: pd.DataFrame) -> pd.DataFrame:
     """
-    Loads data to a csv file and stores it under dest_path.
+    Collapses merged (customer_id, order_id, barcode) rows into one voucher per order.
 
-    :param df_vouchers: pd.DataFrame with vouchers data.
+    :param df_vouchers: pd.DataFrame with customer_id, order_id and barcode columns.
+    :return: pd.DataFrame with customer_id, order_id and barcodes (list of ints) columns.
+    """
+    return Vouchers.from_merged(df_vouchers).to_frame()
+
+
+def _load(
+    df_vouchers: Union[pd.DataFrame, Vouchers],
+    dest_path: str,
+    fmt: str = CSV,
+    compression: Optional[str] = None,
+    prefix: str = "vouchers",
+    batch_size: int = LOAD_BATCH_SIZE,
+) -> str:
+    """
+    Loads data to a csv, parquet or feather file and stores it under dest_path.
+
+    Rows are written in batches into a temporary file that is published under a collision-free
+    name once it is complete, together with a manifest, see etl_vouchers.writer.VouchersWriter.
+
+    :param df_vouchers: pd.DataFrame or Vouchers with vouchers data.
     :param dest_path: str, path to the desired output folder.
+    :param fmt: str, csv, parquet or feather.
+    :param compression: str, compression codec supported by the format, None - default one.
+    :param prefix: str, name of the output file before the timestamp.
+    :param batch_size: int, amount of rows written at once.
     :return: str, path to the output file.
     """
-    if dest_path is None:
-        dest_path = "./"
-    else:
-        dest_path = sanitize_path(dest_path)
+    from etl_vouchers.writer import VouchersWriter
+
+    with VouchersWriter(
+        dest_path,
+        fmt=fmt,
+        compression=compression,
+        prefix=prefix,
+    ) as writer:
+        slice_rows = (
+            df_vouchers.slice
+            if isinstance(df_vouchers, Vouchers)
+            else lambda start, stop: df_vouchers.iloc[start:stop]
+        )
+
+        for start in range(0, len(df_vouchers), batch_size):
+            writer.write(slice_rows(start, start + batch_size))
+
+        if not len(df_vouchers):
+            # the output still gets the header of the frame
+            writer.write(slice_rows(0, 0))
+
+    return writer.output_filepath
+
+
+class InputCache:
+    """
+    In-process cache of extracted and validated inputs.
+
+    Lets several pipeline() runs and statistics over the same files share a single parse
+    and validation of every file. Cached frames must not be modified in place.
+
+    :param store - etl_vouchers.disk_cache.DiskCache, if supplied the frames are also looked up in
+    and saved to it, so they are shared by separate runs. The frames it returns have a default index,
+    and their validation messages are not printed again.
+    """
+
+    def __init__(self, store=None):
+        self.frames: Dict[Tuple, pd.DataFrame] = {}
+        self.store = store
+
+    def _stored(
+        self,
+        filepath: str,
+        parts: Tuple,
+        schema: Optional[Schema],
+        load,
+        metrics: Optional[Metrics] = None,
+    ) -> pd.DataFrame:
+        if self.store is None:
+            return load()
 
-    file_path: str = f"{dest_path}vouchers.{current_time()}.csv"
+        with span(metrics, f"cache.{getattr(schema, 'name', 'input')}") as it:
+            df: Optional[pd.DataFrame] = self.store.get(filepath, parts, schema)
+            it.rows_out = None if df is None else len(df)
 
-    df_vouchers.to_csv(file_path, index=False)
+        if df is None:
+            df = load()
+            self.store.put(filepath, parts, df)
 
-    return file_path
+        return df
+
+    def extract(
+        self, filepath: str, schema: Optional[Schema] = None, engine: str = "c"
+    ) -> pd.DataFrame:
+        key: Tuple = ("extract", os.path.abspath(filepath), schema, engine)
+
+        if key not in self.frames:
+            self.frames[key] = self._stored(
+                filepath,
+                ("extract", schema, engine),
+                schema,
+                lambda: extract(filepath, schema, engine=engine),
+            )
+
+        return self.frames[key]
+
+    def validated(
+        self,
+        filepath: str,
+        schema: Schema,
+        validator: Type[Validator],
+        silent: bool = False,
+        backend: str = NATIVE_BACKEND,
+        engine: str = "c",
+        metrics: Optional[Metrics] = None,
+    ) -> pd.DataFrame:
+        """
+        Extracts and validates the file on the first call, later calls return the cached frame
+        and record no extract or validate spans, a hit of the store records a cache span instead.
+        """
+        key: Tuple = (
+            "validated",
+            os.path.abspath(filepath),
+            schema,
+            validator.__name__,
+            backend,
+            engine,
+        )
+
+        if key not in self.frames:
+            self.frames[key] = self._stored(
+                filepath,
+                ("validated", schema, validator.__name__, backend, engine),
+                schema,
+                lambda: self._validate(
+                    filepath, schema, validator, silent, backend, engine, metrics
+                ),
+                metrics,
+            )
+
+        return self.frames[key]
+
+    def _validate(
+        self,
+        filepath: str,
+        schema: Schema,
+        validator: Type[Validator],
+        silent: bool,
+        backend: str,
+        engine: str,
+        metrics: Optional[Metrics],
+    ) -> pd.DataFrame:
+        extract_key: Tuple = ("extract", os.path.abspath(filepath), schema, engine)
+
+        # the raw frame is kept in memory only, the store gets the validated one
+        if extract_key not in self.frames:
+            self.frames[extract_key] = _extract_measured(
+                filepath, schema, engine, metrics
+            )
+
+        return _validate_measured(
+            self.frames[extract_key], schema, validator, silent, backend, metrics
+        )
+
+    def clear(self) -> None:
+        self.frames.clear()
+
+
+def _extract_validated(
+    filepath: str,
+    schema: Schema,
+    validator: Type[Validator],
+    silent: bool,
+    backend: str,
+    engine: str,
+    cache: Optional[InputCache],
+    metrics: Optional[Metrics] = None,
+) -> pd.DataFrame:
+    if cache is not None:
+        return cache.validated(
+            filepath, schema, validator, silent, backend, engine, metrics
+        )
+
+    return _validate_measured(
+        _extract_measured(filepath, schema, engine, metrics),
+        schema,
+        validator,
+        silent,
+        backend,
+        metrics,
+    )
+
+
+def _extract_measured(
+    filepath: str, schema: Schema, engine: str, metrics: Optional[Metrics]
+) -> pd.DataFrame:
+    with span(metrics, f"extract.{schema.name}") as it:
+        df: pd.DataFrame = extract(filepath, schema, engine=engine)
+        it.rows_out = len(df)
+
+    return df
+
+
+def _validate_measured(
+    df: pd.DataFrame,
+    schema: Schema,
+    validator: Type[Validator],
+    silent: bool,
+    backend: str,
+    metrics: Optional[Metrics],
+) -> pd.DataFrame:
+    with span(metrics, f"validate.{schema.name}", rows_in=len(df)) as it:
+        instance: Validator = validator(df, silent=silent, backend=backend)
+        df_valid: pd.DataFrame = instance()
+        it.rows_out = len(df_valid)
+        it.dropped = instance.dropped
+
+    return df_valid
+
+
+def _extract_inputs(
+    orders_filepath: str,
+    barcodes_filepath: str,
+    silent: bool,
+    backend: str,
+    engine: str,
+    cache: Optional[InputCache],
+    metrics: Optional[Metrics] = None,
+    concurrent: bool = True,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Extracts and validates both inputs, by default on two threads at once.
+
+    The reads are independent and spend most of the time parsing and waiting on storage,
+    which the csv and arrow readers do without holding the GIL, so the pair takes about as long
+    as the larger file. Their extract and validate spans overlap in the metrics.
+
+    :param concurrent: bool, if false, the barcodes are read once the orders are done.
+    :return: validated orders and barcodes frames.
+    """
+    inputs: List[Tuple[str, Schema, Type[Validator]]] = [
+        (orders_filepath, ORDERS, OrdersValidator),
+        (barcodes_filepath, BARCODES, BarcodesValidator),
+    ]
+
+    if not concurrent:
+        return tuple(
+            _extract_validated(
+                filepath, schema, validator, silent, backend, engine, cache, metrics
+            )
+            for filepath, schema, validator in inputs
+        )
+
+    frames: List[pd.DataFrame] = []
+
+    with ThreadPoolExecutor(
+        max_workers=len(inputs), thread_name_prefix="extract"
+    ) as executor:
+        futures: List[Future] = [
+            executor.submit(
+                _extract_validated,
+                filepath,
+                schema,
+                validator,
+                silent,
+                backend,
+                engine,
+                cache,
+                metrics,
+            )
+            for filepath, schema, validator in inputs
+        ]
+
+        # errors of the orders win, as they would if the files were read one by one
+        for future, (filepath, _, _) in zip(futures, inputs):
+            try:
+                frames.append(future.result())
+            except ETLVouchersException:
+                raise
+            except Exception as e:
+                raise InvalidSourceFile(f"Can not read file {filepath}: {str(e)}")
+
+    return frames[0], frames[1]
+
+
+@dataclass
+class PipelineSummary:
+    """
+    Row counts of the pipeline stages, available even when the frames themselves are not kept.
+    """
+
+    orders: int
+    barcodes: int
+    vouchers: int
 
 
 @dataclass
@@ -76,10 +432,13 @@ class PipelineResponse:
     Convenient response dataclass used to aggregate all the results of the pipeline.
     """
 
-    df_orders: pd.DataFrame
-    df_barcodes: pd.DataFrame
-    df_vouchers: pd.DataFrame
+    df_orders: Optional[pd.DataFrame]
+    df_barcodes: Optional[pd.DataFrame]
+    df_vouchers: Optional[pd.DataFrame]
     output_filepath: Optional[str]
+    summary: Optional[PipelineSummary] = None
+    metrics: Optional[Metrics] = None
+    vouchers: Optional[Vouchers] = None
 
 
 def pipeline(
@@ -89,41 +448,257 @@ def pipeline(
     transform_only: bool = False,
     silent: bool = False,
     allow_useless_vouchers: bool = True,
+    summary_only: bool = False,
+    max_memory: Optional[int] = None,
+    chunksize: Optional[int] = None,
+    validation_backend: str = NATIVE_BACKEND,
+    csv_engine: str = "c",
+    output_format: str = CSV,
+    compression: Optional[str] = None,
+    cache: Optional[InputCache] = None,
+    workers: Optional[int] = None,
+    metrics: Optional[Metrics] = None,
+    engine: str = PANDAS_ENGINE,
+    database: Optional[str] = None,
+    sorted_inputs: bool = False,
+    concurrent_extract: bool = True,
+    shards: Optional[int] = None,
+    sharding: str = "hash",
+    preflight_rows: Optional[int] = None,
 ) -> PipelineResponse:
     """
     Main ETL Pipeline responsible for extraction, transformation and loading of vouchers data.
 
+    When max_memory or chunksize is supplied, the pipeline runs in streaming mode,
+    see etl_vouchers.streaming.stream_pipeline. When more than one worker is requested,
+    partitions are processed on a process pool, see etl_vouchers.parallel.parallel_pipeline.
+    Any engine but pandas runs the pipeline in an embedded database, see etl_vouchers.sql_engine.sql_pipeline,
+    its response holds only the summary and the metrics, as with summary_only.
+    Inputs sorted by order_id are joined in lockstep, see etl_vouchers.sorted_merge.sorted_pipeline,
+    if they turn out not to be sorted, the pipeline falls back to the hash join.
+    With shards, the output is split by customer_id into that many files written on a process pool
+    and output_filepath is the path to their index, see etl_vouchers.sharding.write_shards.
+    With preflight_rows, the header and that many rows of both inputs are checked first, so a wrong
+    file is rejected before it is parsed in full, see etl_vouchers.preflight.preflight.
+
     :param orders_filepath: filepath to the csv with orders.
     :param barcodes_filepath: filepath to the csv with barcodes data.
     :param dest_path: path under which the output file is stored.
     :param transform_only: bool, if true, the output file will not be generated.
     :param silent: bool, if true, all the output to stdout will be suppressed.
     :param allow_useless_vouchers: bool, if true, vouchers without barcodes will be generated as well.
-    :return: PipelineResponse
+    :param summary_only: bool, if true, only row counts are returned, the frames are released.
+    :param max_memory: int, approximate ceiling in bytes for the streaming mode.
+    :param chunksize: int, amount of rows read at once in the streaming mode.
+    :param validation_backend: str, "native" or "great_expectations".
+    :param csv_engine: str, csv parser used by extract, "c" or "pyarrow".
+    :param output_format: str, format of the output file, csv, parquet or feather.
+    :param compression: str, compression codec of the output file, None - format default.
+    :param cache: InputCache, if supplied the inputs are extracted and validated only once per cache.
+    :param workers: int, amount of worker processes, the pipeline runs in the current process by default.
+    :param metrics: Metrics the stage spans are recorded into, a new one by default.
+    :param engine: str, pandas, sql (duckdb when installed, sqlite otherwise), sqlite or duckdb.
+    :param database: str, path to the database file of the sql engines, it is reused by later runs.
+    :param sorted_inputs: bool, if true, both inputs are expected to be sorted by order_id.
+    :param concurrent_extract: bool, if true, both inputs are extracted and validated at once on two threads.
+    :param shards: int, amount of output files, the vouchers are written into a single file by default.
+    :param sharding: str, how the vouchers are split into shards, hash or range of customer_id.
+    :param preflight_rows: int, amount of rows of every input checked before the full parse,
+    0 - only the header, None - no preflight.
+    :return: PipelineResponse, its metrics hold a span per stage and sub-step.
     """
-    df_orders: pd.DataFrame = extract(orders_filepath).pipe(
-        lambda df: OrdersValidator(df, silent=silent)()
-    )
-    df_barcodes: pd.DataFrame = (
-        extract(barcodes_filepath)
-        .astype({"barcode": pd.Int64Dtype()})
-        .pipe(lambda df: BarcodesValidator(df, silent=silent)())
-    )
+    metrics = metrics or Metrics()
+
+    if preflight_rows is not None:
+        from etl_vouchers.preflight import preflight_inputs
+
+        preflight_inputs(orders_filepath, barcodes_filepath, preflight_rows, metrics)
+
+    if shards is not None and (
+        engine != PANDAS_ENGINE
+        or sorted_inputs
+        or max_memory is not None
+        or chunksize is not None
+        or (workers is not None and workers > 1)
+    ):
+        raise ETLVouchersException(
+            "Sharded output is only supported by the in-memory pandas pipeline"
+        )
+
+    if engine != PANDAS_ENGINE and (
+        cache is not None
+        or sorted_inputs
+        or max_memory is not None
+        or chunksize is not None
+        or (workers is not None and workers > 1)
+        or csv_engine != "c"
+    ):
+        raise ETLVouchersException(
+            "Input cache, sorted inputs, streaming, workers and csv engines "
+            "are only supported by the pandas engine"
+        )
+
+    if engine != PANDAS_ENGINE:
+        from etl_vouchers.sql_engine import sql_pipeline
+
+        return sql_pipeline(
+            orders_filepath,
+            barcodes_filepath,
+            dest_path=dest_path,
+            transform_only=transform_only,
+            silent=silent,
+            allow_useless_vouchers=allow_useless_vouchers,
+            engine=engine,
+            database=database,
+            validation_backend=validation_backend,
+            output_format=output_format,
+            compression=compression,
+            metrics=metrics,
+        )
+
+    if sorted_inputs:
+        from etl_vouchers.sorted_merge import NotSorted, sorted_pipeline
+
+        try:
+            resp: PipelineResponse = sorted_pipeline(
+                orders_filepath,
+                barcodes_filepath,
+                dest_path=dest_path,
+                transform_only=transform_only,
+                silent=silent,
+                allow_useless_vouchers=allow_useless_vouchers,
+                chunksize=chunksize,
+                validation_backend=validation_backend,
+                output_format=output_format,
+                compression=compression,
+                metrics=metrics,
+            )
+        except NotSorted as e:
+            # the spans of the sorted attempt stay, the fallback marks where the hash join starts
+            with metrics.span("sorted_merge.fallback"):
+                pass
+
+            if not silent:
+                pretty_print(
+                    "Sorted Merge - Fallback To Hash Join",
+                    [f"{str(e)}, the inputs are joined by hash instead"],
+                )
+        else:
+            if summary_only:
+                return PipelineResponse(
+                    None, None, None, resp.output_filepath, resp.summary, resp.metrics
+                )
 
-    df_vouchers: pd.DataFrame = _transform(
-        df_orders, df_barcodes, allow_useless_vouchers=allow_useless_vouchers
+            return resp
+
+    if max_memory is not None or chunksize is not None:
+        from etl_vouchers.streaming import stream_pipeline
+
+        return stream_pipeline(
+            orders_filepath,
+            barcodes_filepath,
+            dest_path=dest_path,
+            transform_only=transform_only,
+            silent=silent,
+            allow_useless_vouchers=allow_useless_vouchers,
+            max_memory=max_memory,
+            chunksize=chunksize,
+            validation_backend=validation_backend,
+            output_format=output_format,
+            compression=compression,
+            metrics=metrics,
+        )
+
+    if workers is not None and workers > 1:
+        from etl_vouchers.parallel import parallel_pipeline
+
+        resp = parallel_pipeline(
+            orders_filepath,
+            barcodes_filepath,
+            dest_path=dest_path,
+            transform_only=transform_only,
+            silent=silent,
+            allow_useless_vouchers=allow_useless_vouchers,
+            workers=workers,
+            validation_backend=validation_backend,
+            csv_engine=csv_engine,
+            output_format=output_format,
+            compression=compression,
+            metrics=metrics,
+        )
+
+        if summary_only:
+            return PipelineResponse(
+                None, None, None, resp.output_filepath, resp.summary, resp.metrics
+            )
+
+        return resp
+
+    df_orders, df_barcodes = _extract_inputs(
+        orders_filepath,
+        barcodes_filepath,
+        silent,
+        validation_backend,
+        csv_engine,
+        cache,
+        metrics,
+        concurrent=concurrent_extract,
     )
 
+    with metrics.span("transform", rows_in=len(df_orders) + len(df_barcodes)) as it:
+        vouchers: Vouchers = _transform_vouchers(
+            df_orders,
+            df_barcodes,
+            allow_useless_vouchers=allow_useless_vouchers,
+            metrics=metrics,
+        )
+        it.rows_out = len(vouchers)
+
     file_path: Optional[str] = None
 
     if not transform_only:
-        file_path = _load(df_vouchers, dest_path)
+        # the barcode lists are only built batch by batch for the csv output
+        with metrics.span("load", rows_in=len(vouchers)) as it:
+            if shards is not None:
+                from etl_vouchers.sharding import write_shards
+
+                file_path = write_shards(
+                    vouchers,
+                    dest_path,
+                    shards,
+                    sharding=sharding,
+                    fmt=output_format,
+                    compression=compression,
+                )
+            else:
+                file_path = _load(
+                    vouchers, dest_path, fmt=output_format, compression=compression
+                )
+
+            it.rows_out = len(vouchers)
+
+    summary: PipelineSummary = PipelineSummary(
+        orders=len(df_orders), barcodes=len(df_barcodes), vouchers=len(vouchers)
+    )
+
+    if summary_only:
+        return PipelineResponse(
+            df_orders=None,
+            df_barcodes=None,
+            df_vouchers=None,
+            output_filepath=file_path,
+            summary=summary,
+            metrics=metrics,
+        )
 
     return PipelineResponse(
         df_orders=df_orders,
         df_barcodes=df_barcodes,
-        df_vouchers=df_vouchers,
+        df_vouchers=vouchers.to_frame(),
         output_filepath=file_path,
+        summary=summary,
+        metrics=metrics,
+        vouchers=vouchers,
     )
 
 
@@ -0,0 +1,78 @@
+from typing import Dict, Optional
+
+import pandas as pd
+
+from etl_vouchers.exceptions import ETLVouchersException
+
+NATIVE_BACKEND: str = "native"
+GREAT_EXPECTATIONS_BACKEND: str = "great_expectations"
+
+
+class NativeDataset:
+    """
+    Vectorized rule engine that mirrors the subset of great_expectations' PandasDataset used by validators.
+
+    The frame is referenced, never copied. Every expectation makes a single vectorized pass
+    over one column and returns a dict with the "success" key only, so it can be passed to is_valid.
+
+    :param df - pandas DataFrame the expectations are evaluated against.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df: pd.DataFrame = df
+
+    def expect_column_to_exist(
+        self, column: str, column_index: Optional[int] = None, **kwargs
+    ) -> Dict:
+        columns = self.df.columns
+
+        if column_index is None:
+            return {"success": column in columns}
+
+        return {
+            "success": 0 <= column_index < len(columns)
+            and columns[column_index] == column
+        }
+
+    def expect_column_values_to_not_be_null(self, column: str, **kwargs) -> Dict:
+        if column not in self.df.columns:
+            return {"success": False}
+
+        return {"success": not self.df[column].isna().any()}
+
+    def expect_column_values_to_be_unique(self, column: str, **kwargs) -> Dict:
+        if column not in self.df.columns:
+            return {"success": False}
+
+        # same as great_expectations, missing values are not taken into account
+        values: pd.Series = self.df[column]
+
+        return {"success": not values[values.notna()].duplicated().any()}
+
+
+def dataset_for(df: pd.DataFrame, backend: str = NATIVE_BACKEND):
+    """
+    Wraps the frame into a dataset of the requested validation backend.
+
+    Both backends check the columns of the orders and the barcodes and the missing order values.
+    great_expectations also checks the barcodes for duplicates and missing values, the native backend
+    leaves those two rules to the single pass of BarcodesValidator.masks, which finds the rows to drop anyway.
+
+    :param df: pandas DataFrame that has to be validated.
+    :param backend: "native" or "great_expectations".
+    :return: object that provides expect_* methods.
+    """
+    if backend == NATIVE_BACKEND:
+        return NativeDataset(df)
+
+    if backend == GREAT_EXPECTATIONS_BACKEND:
+        try:
+            import great_expectations as ge
+        except ImportError:
+            raise ETLVouchersException(
+                "great_expectations backend requires great-expectations to be installed"
+            )
+
+        return ge.from_pandas(df)
+
+    raise ETLVouchersException(f"Unknown validation backend {backend}")
@@ -0,0 +1,302 @@
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.schema import Schema
+
+CSV: str = "csv"
+PARQUET: str = "parquet"
+FEATHER: str = "feather"
+
+FORMATS: Dict[str, str] = {
+    ".csv": CSV,
+    ".csv.gz": CSV,
+    ".csv.bz2": CSV,
+    ".csv.xz": CSV,
+    ".csv.zip": CSV,
+    ".csv.zst": CSV,
+    ".parquet": PARQUET,
+    ".pq": PARQUET,
+    ".feather": FEATHER,
+    ".arrow": FEATHER,
+}
+
+EXTENSIONS: Dict[str, str] = {CSV: "csv", PARQUET: "parquet", FEATHER: "feather"}
+
+CSV_COMPRESSION_EXTENSIONS: Dict[str, str] = {
+    "gzip": ".gz",
+    "bz2": ".bz2",
+    "xz": ".xz",
+    "zip": ".zip",
+    "zstd": ".zst",
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+
+        return pyarrow
+    except ImportError:
+        raise ETLVouchersException("parquet and feather formats require pyarrow")
+
+
+def detect_format(filepath: str, fmt: Optional[str] = None) -> str:
+    """
+    :param filepath: path to a data file.
+    :param fmt: explicit format, overrides the file extension.
+    :return: csv, parquet or feather.
+    """
+    if fmt is not None:
+        if fmt not in EXTENSIONS:
+            raise ETLVouchersException(f"Unknown format {fmt}")
+
+        return fmt
+
+    for extension, it in sorted(FORMATS.items(), key=lambda kv: -len(kv[0])):
+        if filepath.lower().endswith(extension):
+            return it
+
+    return CSV
+
+
+def file_extension(fmt: str, compression: Optional[str] = None) -> str:
+    """
+    :return: extension of the output files in the format, e.g. "csv.gz" for gzipped csv.
+    """
+    extension: str = EXTENSIONS[detect_format("", fmt)]
+
+    if fmt == CSV and compression is not None:
+        extension += CSV_COMPRESSION_EXTENSIONS.get(compression, "")
+
+    return extension
+
+
+def _columns(schema: Optional[Schema], columns: Optional[List[str]]):
+    if columns is not None:
+        return columns
+
+    return None if schema is None else schema.names
+
+
+def _apply_schema(df: pd.DataFrame, schema: Optional[Schema]) -> pd.DataFrame:
+    """
+    Columnar files already carry types, only the ones that differ from the schema
+    (e.g. int64 columns with missing values that arrow hands over as float64) are converted.
+    """
+    if schema is None:
+        return df
+
+    dtypes: Dict[str, str] = {
+        name: dtype
+        for name, dtype in schema.dtypes.items()
+        if name in df.columns and str(df[name].dtype) != dtype
+    }
+
+    return df.astype(dtypes) if dtypes else df
+
+
+def read_header(filepath: str, fmt: Optional[str] = None) -> List[str]:
+    """
+    :return: names of the columns of a csv, parquet or feather file, only the header is read.
+    """
+    fmt = detect_format(filepath, fmt)
+
+    if fmt == CSV:
+        return list(pd.read_csv(filepath, nrows=0).columns)
+
+    _pyarrow()
+
+    if fmt == PARQUET:
+        import pyarrow.parquet as pq
+
+        return list(pq.read_schema(filepath).names)
+
+    import pyarrow.ipc as ipc
+
+    return list(ipc.open_file(filepath).schema.names)
+
+
+def check_header(filepath: str, columns: List[str], schema: Schema) -> None:
+    """
+    Only the schema columns are parsed, so the header is checked first: the file
+    has to start with them, in their order, any columns after them are ignored.
+
+    :param columns: header of the file, see read_header.
+    :raises InvalidSourceFile: the header does not start with the schema columns.
+    """
+    if columns[: len(schema.names)] != schema.names:
+        raise InvalidSourceFile(
+            f"{schema.name.capitalize()} file {filepath} has to start with "
+            f"{len(schema.names)} columns - {', '.join(schema.names)}, "
+            f"found: {', '.join(map(str, columns)) or 'no header'}"
+        )
+
+
+def _read_csv_kwargs(schema: Optional[Schema], columns: Optional[List[str]]) -> Dict:
+    if schema is None and columns is None:
+        return {}
+
+    kwargs: Dict = {"usecols": _columns(schema, columns)}
+
+    if schema is not None:
+        kwargs["dtype"] = {
+            name: dtype
+            for name, dtype in schema.dtypes.items()
+            if name in kwargs["usecols"]
+        }
+
+    return kwargs
+
+
+def read_frame(
+    filepath: str,
+    schema: Optional[Schema] = None,
+    fmt: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+    engine: str = "c",
+) -> pd.DataFrame:
+    """
+    Reads a csv, parquet or feather file.
+
+    :param filepath: path to the file.
+    :param schema: Schema, if supplied only its columns are read, in its dtypes,
+    the file has to start with them, see check_header.
+    :param fmt: csv, parquet or feather, detected by the file extension by default.
+    :param columns: columns to read, overrides the schema columns.
+    :param engine: csv parser, "c" or "pyarrow".
+    :return: pandas DataFrame.
+    """
+    fmt = detect_format(filepath, fmt)
+
+    if schema is not None and columns is None:
+        check_header(filepath, read_header(filepath, fmt), schema)
+
+    if fmt == CSV:
+        return pd.read_csv(filepath, engine=engine, **_read_csv_kwargs(schema, columns))
+
+    _pyarrow()
+
+    if fmt == PARQUET:
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(filepath, columns=_columns(schema, columns))
+    else:
+        import pyarrow.feather as feather
+
+        table = feather.read_table(
+            filepath, columns=_columns(schema, columns), memory_map=True
+        )
+
+    return _apply_schema(table.to_pandas(), schema)
+
+
+def iter_frames(
+    filepath: str,
+    chunksize: int,
+    schema: Optional[Schema] = None,
+    fmt: Optional[str] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads a csv, parquet or feather file chunk by chunk.
+
+    :param filepath: path to the file.
+    :param chunksize: max amount of rows in every chunk.
+    :param schema: Schema, if supplied only its columns are read, in its dtypes,
+    the file has to start with them, see check_header.
+    :param fmt: csv, parquet or feather, detected by the file extension by default.
+    :return: iterator over pandas DataFrames.
+    """
+    fmt = detect_format(filepath, fmt)
+
+    if schema is not None:
+        check_header(filepath, read_header(filepath, fmt), schema)
+
+    if fmt == CSV:
+        yield from pd.read_csv(
+            filepath, chunksize=chunksize, **_read_csv_kwargs(schema, None)
+        )
+        return
+
+    _pyarrow()
+    columns: Optional[List[str]] = _columns(schema, None)
+
+    if fmt == PARQUET:
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(filepath).iter_batches(
+            batch_size=chunksize, columns=columns
+        )
+    else:
+        batches = _iter_feather_batches(filepath, chunksize)
+
+    for batch in batches:
+        df: pd.DataFrame = batch.to_pandas()
+
+        if columns is not None:
+            df = df[columns]
+
+        yield _apply_schema(df, schema)
+
+
+def _iter_feather_batches(filepath: str, chunksize: int):
+    import pyarrow as pa
+
+    reader = pa.ipc.open_file(pa.memory_map(filepath, "r"))
+
+    for it in range(reader.num_record_batches):
+        batch = reader.get_batch(it)
+
+        for offset in range(0, batch.num_rows, chunksize):
+            yield batch.slice(offset, chunksize)
+
+
+def _arrow_table(df: pd.DataFrame):
+    """
+    :return: pyarrow Table, the barcodes column is typed as list<int64> even if all the lists are empty.
+    """
+    pa = _pyarrow()
+    arrow_schema = pa.Schema.from_pandas(df, preserve_index=False)
+
+    if "barcodes" in df.columns:
+        arrow_schema = arrow_schema.set(
+            arrow_schema.get_field_index("barcodes"),
+            pa.field("barcodes", pa.list_(pa.int64())),
+        )
+
+    return pa.Table.from_pandas(df, schema=arrow_schema, preserve_index=False)
+
+
+def write_frame(
+    df: pd.DataFrame,
+    filepath: str,
+    fmt: Optional[str] = None,
+    compression: Optional[str] = None,
+) -> str:
+    """
+    Writes the frame as csv, parquet or feather.
+
+    :param df: pandas DataFrame.
+    :param filepath: path to the output file.
+    :param fmt: csv, parquet or feather, detected by the file extension by default.
+    :param compression: csv - any pandas compression (gzip, bz2, zstd, ...),
+    parquet - snappy, gzip, zstd, ..., feather - lz4 or zstd.
+    :return: str, path to the output file.
+    """
+    fmt = detect_format(filepath, fmt)
+
+    if fmt == CSV:
+        df.to_csv(filepath, index=False, compression=compression)
+    elif fmt == PARQUET:
+        import pyarrow.parquet as pq
+
+        pq.write_table(_arrow_table(df), filepath, compression=compression or "snappy")
+    else:
+        import pyarrow.feather as feather
+
+        feather.write_feather(
+            _arrow_table(df), filepath, compression=compression or "uncompressed"
+        )
+
+    return filepath
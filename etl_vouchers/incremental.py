@@ -0,0 +1,671 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.etl import (
+    PipelineSummary,
+    _load,
+    _transform_vouchers,
+    extract,
+)
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.schema import BARCODES, ORDERS, Schema
+from etl_vouchers.utils import pretty_print, sanitize_path
+from etl_vouchers.validator import BarcodesValidator, OrdersValidator, sample
+from etl_vouchers.vouchers import Vouchers
+
+STATE_VERSION: int = 2
+
+DELTA_OUTPUT: str = "delta"
+SNAPSHOT_OUTPUT: str = "snapshot"
+
+UNCHANGED: str = "unchanged"
+APPENDED: str = "appended"
+CHANGED: str = "changed"
+NEW: str = "new"
+
+UPSERT: str = "upsert"
+DELETE: str = "delete"
+
+_HASH_BLOCK: int = 1 << 20
+
+
+@dataclass
+class IncrementalResponse:
+    """
+    Results of an incremental run.
+
+    :param inputs - how every input changed since the previous run: new, unchanged, appended or changed.
+    :param affected_orders - amount of orders whose vouchers changed, i.e. the orders in the delta.
+    """
+
+    df_delta: pd.DataFrame
+    output_filepath: Optional[str]
+    summary: PipelineSummary
+    inputs: Dict[str, str]
+    affected_orders: int
+
+
+def fingerprint(filepath: str, prefix_size: Optional[int] = None) -> Dict:
+    """
+    Hashes the file in one pass.
+
+    :param filepath: path to the file.
+    :param prefix_size: if supplied, the hash of the first prefix_size bytes is returned as well,
+    which tells whether the file is an appended version of a file of that size.
+    :return: dict with size, mtime, sha256, ends_with_newline and, optionally, prefix_sha256.
+    """
+    digest = hashlib.sha256()
+    prefix_digest: Optional[str] = None
+    read: int = 0
+    last_byte: bytes = b""
+
+    try:
+        with open(filepath, "rb") as f:
+            while True:
+                block: bytes = f.read(_HASH_BLOCK)
+
+                if not block:
+                    break
+
+                if prefix_size is not None and read <= prefix_size < read + len(block):
+                    digest.update(block[: prefix_size - read])
+                    prefix_digest = digest.copy().hexdigest()
+                    digest.update(block[prefix_size - read :])
+                else:
+                    digest.update(block)
+
+                read += len(block)
+                last_byte = block[-1:]
+
+        stat: os.stat_result = os.stat(filepath)
+    except OSError as e:
+        raise InvalidSourceFile(f"Can not read file {filepath}: {str(e)}")
+
+    if prefix_size is not None and prefix_size == read:
+        prefix_digest = digest.hexdigest()
+
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": digest.hexdigest(),
+        "prefix_sha256": prefix_digest,
+        "ends_with_newline": last_byte == b"\n",
+    }
+
+
+class IncrementalState:
+    """
+    Compact snapshot of the previous run kept in a folder.
+
+    Every run stores its state.npz in its own sub folder: the Vouchers arrays of all the orders,
+    including the ones without barcodes, the valid barcodes no order uses and the barcode values
+    dropped as duplicates. Only numeric arrays are stored, so the state is about the size of the
+    vouchers and loading it never unpickles anything. state.json with the input fingerprints
+    points to the latest run and is replaced atomically, so an interrupted run leaves
+    the previous state intact.
+
+    :param path - folder of the state.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = sanitize_path(path)
+
+    def load(self) -> Optional[Dict]:
+        """
+        :return: state dict with fingerprints, vouchers, df_unused and duplicates,
+        None if there is no usable state.
+        """
+        try:
+            with open(f"{self.path}state.json") as f:
+                state: Dict = json.load(f)
+
+            if state.get("version") != STATE_VERSION:
+                return None
+
+            with np.load(
+                f"{self.path}{state['run']}/state.npz", allow_pickle=False
+            ) as arrays:
+                state["vouchers"] = Vouchers(
+                    customer_ids=arrays["customer_ids"],
+                    order_ids=arrays["order_ids"],
+                    offsets=arrays["offsets"],
+                    barcodes=arrays["barcodes"],
+                )
+                state["df_unused"] = pd.DataFrame(
+                    {
+                        "barcode": pd.array(arrays["unused_barcodes"], dtype="Int64"),
+                        "order_id": pd.arrays.IntegerArray(
+                            arrays["unused_order_ids"], ~arrays["unused_has_order"]
+                        ),
+                    }
+                )
+                state["duplicates"] = arrays["duplicates"]
+        except Exception:
+            # a missing, partial or foreign state only means a full run
+            return None
+
+        return state
+
+    def save(self, state: Dict) -> None:
+        """
+        :param state: dict in the format of load().
+        """
+        run: str = f"run.{time.time_ns()}"
+        os.makedirs(f"{self.path}{run}")
+
+        vouchers: Vouchers = state["vouchers"]
+        df_unused: pd.DataFrame = state["df_unused"]
+        np.savez(
+            f"{self.path}{run}/state.npz",
+            customer_ids=vouchers.customer_ids,
+            order_ids=vouchers.order_ids,
+            offsets=vouchers.offsets,
+            barcodes=vouchers.barcodes,
+            unused_barcodes=df_unused["barcode"].to_numpy(dtype=np.int64),
+            unused_order_ids=df_unused["order_id"].to_numpy(dtype=np.int64, na_value=0),
+            unused_has_order=df_unused["order_id"].notna().to_numpy(),
+            duplicates=state["duplicates"],
+        )
+
+        with open(f"{self.path}state.json.tmp", "w") as f:
+            json.dump(
+                {
+                    "version": STATE_VERSION,
+                    "run": run,
+                    **{
+                        key: state[key]
+                        for key in (
+                            "allow_useless_vouchers",
+                            "fingerprints",
+                            "orders",
+                            "barcodes",
+                            "unique_orders",
+                        )
+                    },
+                },
+                f,
+            )
+
+        os.replace(f"{self.path}state.json.tmp", f"{self.path}state.json")
+
+        for it in os.listdir(self.path):
+            if it.startswith("run.") and it != run:
+                shutil.rmtree(f"{self.path}{it}", ignore_errors=True)
+
+
+def _read_tail(filepath: str, offset: int, schema: Schema) -> pd.DataFrame:
+    """
+    Parses only the rows appended after offset bytes, the column names come from the header line.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            header: bytes = f.readline()
+            f.seek(offset)
+            tail: bytes = f.read()
+
+        if not tail.strip():
+            return _empty(schema)
+
+        return pd.read_csv(
+            io.BytesIO(header + tail), usecols=schema.names, dtype=schema.dtypes
+        )
+    except Exception as e:
+        raise InvalidSourceFile(f"Can not read file {filepath}: {str(e)}")
+
+
+def _empty(schema: Schema) -> pd.DataFrame:
+    return pd.DataFrame(
+        {name: pd.Series(dtype=dtype) for name, dtype in schema.dtypes.items()}
+    )
+
+
+def _change(filepath: str, previous: Optional[Dict]) -> Tuple[Dict, str]:
+    """
+    :return: fingerprint of the input and how it changed since the previous run.
+    """
+    if previous is None:
+        return fingerprint(filepath), NEW
+
+    current: Dict = fingerprint(filepath, prefix_size=previous["size"])
+
+    if current["sha256"] == previous["sha256"]:
+        return current, UNCHANGED
+
+    # rows appended to a file without a trailing newline would extend its last row
+    if current["prefix_sha256"] == previous["sha256"] and previous["ends_with_newline"]:
+        return current, APPENDED
+
+    return current, CHANGED
+
+
+def _full_state(orders_filepath: str, barcodes_filepath: str, silent: bool) -> Dict:
+    """
+    Extracts and validates both inputs and builds the vouchers of all the orders.
+
+    :return: state dict without fingerprints, see IncrementalState.load.
+    """
+    df_orders: pd.DataFrame = OrdersValidator(
+        extract(orders_filepath, ORDERS), silent=silent
+    )()
+    df_barcodes_raw: pd.DataFrame = extract(barcodes_filepath, BARCODES)
+    validator: BarcodesValidator = BarcodesValidator(df_barcodes_raw, silent=silent)
+    df_barcodes: pd.DataFrame = validator()
+
+    duplicates: np.ndarray = np.empty(0, dtype=np.int64)
+
+    if validator.dropped.get("duplicate_barcodes"):
+        barcodes: pd.Series = df_barcodes_raw["barcode"].dropna()
+        duplicates = barcodes[barcodes.duplicated()].unique().to_numpy(dtype=np.int64)
+
+    is_unused: pd.Series = ~df_barcodes["order_id"].isin(df_orders["order_id"])
+
+    return {
+        "vouchers": _transform_vouchers(df_orders, df_barcodes),
+        "df_unused": df_barcodes.loc[is_unused, ["barcode", "order_id"]].reset_index(
+            drop=True
+        ),
+        "duplicates": duplicates,
+        "orders": len(df_orders),
+        "barcodes": len(df_barcodes),
+        "unique_orders": bool(df_orders["order_id"].is_unique),
+    }
+
+
+def _drop_barcodes(vouchers: Vouchers, is_dropped: np.ndarray) -> Vouchers:
+    """
+    :param is_dropped: boolean mask over vouchers.barcodes.
+    :return: the same vouchers without the dropped barcodes.
+    """
+    dropped_before: np.ndarray = np.concatenate(([0], np.cumsum(is_dropped)))
+
+    return Vouchers(
+        customer_ids=vouchers.customer_ids,
+        order_ids=vouchers.order_ids,
+        offsets=vouchers.offsets - dropped_before[vouchers.offsets],
+        barcodes=vouchers.barcodes[~is_dropped],
+    )
+
+
+def _validate_tail(
+    df_tail_raw: pd.DataFrame, state: Dict, silent: bool
+) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Validates appended barcode rows against the previous state: a barcode that occurs
+    in the tail and anywhere before is a duplicate, all its copies are dropped.
+
+    :return: valid tail rows, masks of the previous voucher and unused barcodes that became duplicates
+    and the updated duplicate barcode values.
+    """
+    df_tail: pd.DataFrame = BarcodesValidator(df_tail_raw, silent=silent)()
+    # every copy, also the ones dropped as duplicates within the tail
+    tail_barcodes: pd.Series = df_tail_raw["barcode"].dropna()
+    # hashing the short tail and scanning the previous barcodes against it
+    is_voucher_duplicate: np.ndarray = (
+        pd.Series(state["vouchers"].barcodes).isin(tail_barcodes).to_numpy(dtype=bool)
+    )
+    is_unused_duplicate: np.ndarray = (
+        state["df_unused"]["barcode"].isin(tail_barcodes).to_numpy(dtype=bool)
+    )
+    duplicates: np.ndarray = np.unique(
+        np.concatenate(
+            [
+                state["duplicates"],
+                state["vouchers"].barcodes[is_voucher_duplicate],
+                state["df_unused"]["barcode"][is_unused_duplicate].to_numpy(
+                    dtype=np.int64
+                ),
+                tail_barcodes[tail_barcodes.duplicated()].to_numpy(dtype=np.int64),
+            ]
+        )
+    )
+    is_duplicate: np.ndarray = df_tail["barcode"].isin(duplicates).to_numpy(dtype=bool)
+
+    if is_duplicate.any() and not silent:
+        pretty_print(
+            "Barcodes Validator - No Barcode Duplicates",
+            [
+                "Next appended barcodes duplicate earlier ones",
+                *sample(df_tail["barcode"][is_duplicate]),
+            ],
+        )
+
+    return (
+        df_tail.loc[~is_duplicate],
+        is_voucher_duplicate,
+        is_unused_duplicate,
+        duplicates,
+    )
+
+
+def _append_state(
+    state: Dict,
+    df_orders_tail: pd.DataFrame,
+    df_barcodes_tail: pd.DataFrame,
+    silent: bool,
+) -> Optional[Tuple[Dict, Vouchers, Vouchers]]:
+    """
+    Applies appended rows to the previous state. Only the tails are validated,
+    and only the orders they touch are joined again.
+
+    :return: new state, previous and recomputed vouchers of the touched orders,
+    None if the tails can not be applied, e.g. an appended order id already exists.
+    """
+    df_orders_tail = OrdersValidator(df_orders_tail, silent=silent)()
+    vouchers: Vouchers = state["vouchers"]
+    df_unused: pd.DataFrame = state["df_unused"]
+    order_ids: pd.Series = pd.Series(vouchers.order_ids)
+
+    # with unique order ids every order id has exactly one voucher to recompute
+    if (
+        not state["unique_orders"]
+        or not df_orders_tail["order_id"].is_unique
+        or order_ids.isin(df_orders_tail["order_id"]).any()
+    ):
+        return None
+
+    (
+        df_barcodes_tail,
+        is_voucher_duplicate,
+        is_unused_duplicate,
+        duplicates,
+    ) = _validate_tail(df_barcodes_tail, state, silent)
+
+    if is_voucher_duplicate.any():
+        vouchers = _drop_barcodes(vouchers, is_voucher_duplicate)
+
+    df_unused = df_unused.loc[~is_unused_duplicate]
+
+    # orders that lost a barcode, got a new one or were appended
+    touched: np.ndarray = np.concatenate(
+        [
+            state["vouchers"].order_ids[
+                np.searchsorted(
+                    state["vouchers"].offsets,
+                    np.flatnonzero(is_voucher_duplicate),
+                    "right",
+                )
+                - 1
+            ],
+            df_barcodes_tail["order_id"].dropna().to_numpy(dtype=np.int64),
+        ]
+    )
+    is_affected: np.ndarray = order_ids.isin(touched).to_numpy(dtype=bool)
+
+    if not is_affected.any() and df_orders_tail.empty:
+        empty: Vouchers = vouchers.slice(0, 0)
+
+        return (
+            {
+                **state,
+                "vouchers": vouchers,
+                "df_unused": pd.concat(
+                    [df_unused, df_barcodes_tail[["barcode", "order_id"]]],
+                    ignore_index=True,
+                ),
+                "duplicates": duplicates,
+                "barcodes": state["barcodes"]
+                - int(is_voucher_duplicate.sum())
+                - int(is_unused_duplicate.sum())
+                + len(df_barcodes_tail),
+            },
+            empty,
+            empty,
+        )
+
+    previous: Vouchers = vouchers.take(np.flatnonzero(is_affected))
+    affected_ids: pd.Series = pd.concat(
+        [pd.Series(previous.order_ids), df_orders_tail["order_id"]],
+        ignore_index=True,
+    )
+    is_unused_taken: pd.Series = df_unused["order_id"].isin(df_orders_tail["order_id"])
+    is_tail_used: pd.Series = df_barcodes_tail["order_id"].isin(affected_ids)
+
+    # in the file order: barcodes of the vouchers, earlier unused ones, appended ones
+    recomputed: Vouchers = _transform_vouchers(
+        pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "customer_id": previous.customer_ids,
+                        "order_id": previous.order_ids,
+                    }
+                ),
+                df_orders_tail[["customer_id", "order_id"]],
+            ],
+            ignore_index=True,
+        ),
+        pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "barcode": previous.barcodes,
+                        "order_id": np.repeat(
+                            previous.order_ids, previous.barcode_counts()
+                        ),
+                    }
+                ),
+                df_unused.loc[is_unused_taken, ["barcode", "order_id"]],
+                df_barcodes_tail.loc[is_tail_used, ["barcode", "order_id"]],
+            ],
+            ignore_index=True,
+        ),
+    )
+    merged: Vouchers = Vouchers.concat(
+        [vouchers.take(np.flatnonzero(~is_affected)), recomputed]
+    )
+
+    return (
+        {
+            **state,
+            "vouchers": merged.take(
+                np.lexsort((merged.order_ids, merged.customer_ids))
+            ),
+            "df_unused": pd.concat(
+                [
+                    df_unused.loc[~is_unused_taken],
+                    df_barcodes_tail.loc[~is_tail_used, ["barcode", "order_id"]],
+                ],
+                ignore_index=True,
+            ),
+            "duplicates": duplicates,
+            "orders": state["orders"] + len(df_orders_tail),
+            "barcodes": state["barcodes"]
+            - int(is_voucher_duplicate.sum())
+            - int(is_unused_duplicate.sum())
+            + len(df_barcodes_tail),
+        },
+        state["vouchers"].take(np.flatnonzero(is_affected)),
+        recomputed,
+    )
+
+
+def _visible(vouchers: Vouchers, allow_useless_vouchers: bool) -> Vouchers:
+    """
+    :return: vouchers of the output, without the ones without barcodes unless they are allowed.
+    """
+    if allow_useless_vouchers:
+        return vouchers
+
+    return vouchers.take(np.flatnonzero(vouchers.barcode_counts() > 0))
+
+
+def _delta(previous: Vouchers, current: Vouchers) -> pd.DataFrame:
+    """
+    :return: new and changed vouchers marked as upserts and the vouchers that disappeared marked as deletes.
+    """
+    keys = ["customer_id", "order_id"]
+    # int64 keys, object or mixed width ids make pandas infer the dtype of the join index
+    df_keys: pd.DataFrame = pd.DataFrame(
+        {
+            "customer_id": previous.customer_ids.astype(np.int64, copy=False),
+            "order_id": previous.order_ids.astype(np.int64, copy=False),
+            "previous": np.arange(len(previous)),
+        }
+    ).merge(
+        pd.DataFrame(
+            {
+                "customer_id": current.customer_ids.astype(np.int64, copy=False),
+                "order_id": current.order_ids.astype(np.int64, copy=False),
+                "current": np.arange(len(current)),
+            }
+        ),
+        on=keys,
+        how="outer",
+    )
+    is_both: pd.Series = df_keys["previous"].notna() & df_keys["current"].notna()
+    previous_positions: np.ndarray = df_keys.loc[is_both, "previous"].to_numpy(
+        dtype=np.int64
+    )
+    current_positions: np.ndarray = df_keys.loc[is_both, "current"].to_numpy(
+        dtype=np.int64
+    )
+
+    # vouchers with the same amount of barcodes are compared barcode by barcode
+    counts: np.ndarray = previous.barcode_counts()[previous_positions]
+    is_same_count: np.ndarray = counts == current.barcode_counts()[current_positions]
+    is_different: np.ndarray = (
+        np.bincount(
+            np.repeat(np.arange(is_same_count.sum()), counts[is_same_count]),
+            weights=previous.take(previous_positions[is_same_count]).barcodes
+            != current.take(current_positions[is_same_count]).barcodes,
+            minlength=int(is_same_count.sum()),
+        )
+        > 0
+    )
+    upserts: np.ndarray = np.sort(
+        np.concatenate(
+            [
+                current_positions[~is_same_count],
+                current_positions[is_same_count][is_different],
+                df_keys.loc[df_keys["previous"].isna(), "current"].to_numpy(
+                    dtype=np.int64
+                ),
+            ]
+        )
+    )
+    df_deleted: pd.DataFrame = df_keys.loc[df_keys["current"].isna(), keys]
+    df_deleted["barcodes"] = [[] for _ in range(len(df_deleted))]
+
+    return pd.concat(
+        [
+            current.take(upserts).to_frame().assign(op=UPSERT),
+            df_deleted.assign(op=DELETE),
+        ],
+        ignore_index=True,
+    ).sort_values(by=keys, kind="mergesort", ignore_index=True)
+
+
+def incremental_pipeline(
+    orders_filepath: str,
+    barcodes_filepath: str,
+    state_path: str,
+    dest_path: str = None,
+    output: str = DELTA_OUTPUT,
+    transform_only: bool = False,
+    silent: bool = False,
+    allow_useless_vouchers: bool = True,
+) -> IncrementalResponse:
+    """
+    ETL that recomputes only the vouchers of the orders affected since the previous run.
+
+    Unchanged inputs are not parsed at all. Rows appended to an input are parsed from the previous
+    end of the file, validated against the state - an appended barcode that occurred before
+    drops all its copies - and only the orders they touch are joined again.
+    Any other change, or an appended order id that already exists, is a full run,
+    whose vouchers are compared with the previous ones for the delta.
+
+    :param orders_filepath: filepath to the csv with orders.
+    :param barcodes_filepath: filepath to the csv with barcodes data.
+    :param state_path: folder with the state of the previous run, created if missing.
+    :param dest_path: path under which the output file is stored.
+    :param output: "delta" - only changed vouchers with an op column (upsert/delete),
+    "snapshot" - all the vouchers, same as etl.pipeline output.
+    :param transform_only: bool, if true, the output file will not be generated.
+    :param silent: bool, if true, all the output to stdout will be suppressed.
+    :param allow_useless_vouchers: bool, if true, vouchers without barcodes will be generated as well.
+    :return: IncrementalResponse
+    """
+    if output not in (DELTA_OUTPUT, SNAPSHOT_OUTPUT):
+        raise ETLVouchersException(f"Unknown output {output}")
+
+    state_store: IncrementalState = IncrementalState(state_path)
+    state: Optional[Dict] = state_store.load()
+
+    if state is not None and state["allow_useless_vouchers"] != allow_useless_vouchers:
+        state = None
+
+    previous: Dict[str, Dict] = {} if state is None else state["fingerprints"]
+
+    orders_fp, orders_change = _change(orders_filepath, previous.get("orders"))
+    barcodes_fp, barcodes_change = _change(barcodes_filepath, previous.get("barcodes"))
+
+    applied: Optional[Tuple[Dict, Vouchers, Vouchers]] = None
+
+    if state is not None and {orders_change, barcodes_change} <= {
+        UNCHANGED,
+        APPENDED,
+    }:
+        applied = _append_state(
+            state,
+            _read_tail(orders_filepath, previous["orders"]["size"], ORDERS)
+            if orders_change == APPENDED
+            else _empty(ORDERS),
+            _read_tail(barcodes_filepath, previous["barcodes"]["size"], BARCODES)
+            if barcodes_change == APPENDED
+            else _empty(BARCODES),
+            silent,
+        )
+
+    if applied is not None:
+        new_state, previous_vouchers, recomputed = applied
+        df_delta: pd.DataFrame = _delta(
+            _visible(previous_vouchers, allow_useless_vouchers),
+            _visible(recomputed, allow_useless_vouchers),
+        )
+    else:
+        new_state = _full_state(orders_filepath, barcodes_filepath, silent)
+        previous_vouchers = (
+            new_state["vouchers"].slice(0, 0) if state is None else state["vouchers"]
+        )
+        df_delta = _delta(
+            _visible(previous_vouchers, allow_useless_vouchers),
+            _visible(new_state["vouchers"], allow_useless_vouchers),
+        )
+
+    vouchers: Vouchers = _visible(new_state["vouchers"], allow_useless_vouchers)
+    file_path: Optional[str] = None
+
+    if not transform_only:
+        if output == SNAPSHOT_OUTPUT:
+            file_path = _load(vouchers, dest_path)
+        else:
+            file_path = _load(df_delta, dest_path, prefix="vouchers_delta")
+
+    state_store.save(
+        {
+            **new_state,
+            "allow_useless_vouchers": allow_useless_vouchers,
+            "fingerprints": {"orders": orders_fp, "barcodes": barcodes_fp},
+        }
+    )
+
+    return IncrementalResponse(
+        df_delta=df_delta,
+        output_filepath=file_path,
+        summary=PipelineSummary(
+            orders=new_state["orders"],
+            barcodes=new_state["barcodes"],
+            vouchers=len(vouchers),
+        ),
+        inputs={"orders": orders_change, "barcodes": barcodes_change},
+        affected_orders=int(df_delta["order_id"].nunique()),
+    )
@@ -0,0 +1,288 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from etl_vouchers.exceptions import ETLVouchersException
+
+CPROFILE: str = "cprofile"
+TRACEMALLOC: str = "tracemalloc"
+
+PROFILERS: List[str] = [CPROFILE, TRACEMALLOC]
+
+PROMETHEUS_PREFIX: str = "etl_vouchers"
+
+
+def _current_rss() -> Optional[int]:
+    """
+    :return: resident set size of the process in bytes, None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss() -> Optional[int]:
+    """
+    :return: peak resident set size of the process so far in bytes, None where resource is not available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakRSS:
+    """
+    Context manager that samples the resident set size on a background thread
+    and keeps the peak seen while the block runs.
+    Falls back to the peak RSS of the whole process where /proc is not available,
+    the peak is None where neither is.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval: float = interval
+        self.peak: Optional[int] = 0
+        self._stop: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss() or 0)
+
+    def __enter__(self) -> "PeakRSS":
+        rss: Optional[int] = _current_rss()
+
+        if rss is not None:
+            self.peak = rss
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._thread is None:
+            self.peak = _max_rss()
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss() or 0)
+
+
+@dataclass
+class Span:
+    """
+    Timing of a single pipeline stage or sub-step.
+
+    :param name - dotted name of the stage, sub-steps are prefixed with the name of their stage,
+    e.g. transform.merge.
+    :param started - seconds since the start of the run.
+    :param seconds - wall time.
+    :param rows_in - amount of input rows, if known.
+    :param rows_out - amount of output rows, if known.
+    :param peak_rss - peak resident set size of the process while the stage ran, in bytes.
+    :param dropped - amount of rows dropped by every validation rule of the stage.
+    """
+
+    name: str
+    started: float = 0.0
+    seconds: float = 0.0
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    peak_rss: Optional[int] = None
+    dropped: Dict[str, int] = field(default_factory=dict)
+
+
+class Metrics:
+    """
+    Collects spans of a pipeline run.
+
+    Spans are opened with `with metrics.span("extract.orders") as span:`, nested spans
+    get the name of the enclosing one as a prefix. Rows and dropped rows are set on the
+    yielded Span by the stage itself. Spans can be opened on several threads at once,
+    every thread nests its own spans only.
+
+    :param track_memory - if true, peak RSS is sampled on a background thread for every span,
+    off by default, as only the callers that show or save the spans need it.
+    """
+
+    def __init__(self, track_memory: bool = False):
+        self.track_memory: bool = track_memory
+        self.spans: List[Span] = []
+        self._local: threading.local = threading.local()
+        self._started: float = time.perf_counter()
+
+    @property
+    def _stack(self) -> List[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, rows_in: Optional[int] = None) -> Iterator[Span]:
+        full_name: str = ".".join([*self._stack, name])
+        current: Span = Span(
+            full_name, started=time.perf_counter() - self._started, rows_in=rows_in
+        )
+        self.spans.append(current)
+        self._stack.append(name)
+        rss: Optional[PeakRSS] = PeakRSS() if self.track_memory else None
+
+        try:
+            if rss is not None:
+                with rss:
+                    yield current
+            else:
+                yield current
+        finally:
+            current.seconds = time.perf_counter() - self._started - current.started
+            current.peak_rss = None if rss is None else rss.peak
+            self._stack.pop()
+
+    def get(self, name: str) -> Optional[Span]:
+        """
+        :return: the last span with the name, None if there is none.
+        """
+        for it in reversed(self.spans):
+            if it.name == name:
+                return it
+
+        return None
+
+    def to_dicts(self) -> List[Dict]:
+        return [asdict(it) for it in self.spans]
+
+    def to_json_lines(self) -> str:
+        return "".join(json.dumps(it) + "\n" for it in self.to_dicts())
+
+    def to_prometheus(self) -> str:
+        """
+        :return: spans in the Prometheus text exposition format, one gauge family per measurement.
+        """
+        families: Dict[str, List[str]] = {
+            "stage_seconds": [],
+            "stage_rows_in": [],
+            "stage_rows_out": [],
+            "stage_peak_rss_bytes": [],
+            "stage_rows_dropped": [],
+        }
+
+        for it in self.spans:
+            label: str = f'stage="{it.name}"'
+
+            for family, value in (
+                ("stage_seconds", it.seconds),
+                ("stage_rows_in", it.rows_in),
+                ("stage_rows_out", it.rows_out),
+                ("stage_peak_rss_bytes", it.peak_rss),
+            ):
+                if value is not None:
+                    families[family].append(
+                        f"{PROMETHEUS_PREFIX}_{family}{{{label}}} {value}"
+                    )
+
+            for rule, rows in it.dropped.items():
+                families["stage_rows_dropped"].append(
+                    f'{PROMETHEUS_PREFIX}_stage_rows_dropped{{{label},rule="{rule}"}} {rows}'
+                )
+
+        lines: List[str] = []
+
+        for family, samples in families.items():
+            if samples:
+                lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{family} gauge")
+                lines.extend(samples)
+
+        return "".join(it + "\n" for it in lines)
+
+    def write(self, filepath: str) -> str:
+        """
+        Writes the spans as Prometheus text if the file extension is .prom, as JSON lines otherwise.
+
+        :return: str, path to the written file.
+        """
+        with open(filepath, "w") as f:
+            f.write(
+                self.to_prometheus()
+                if filepath.endswith(".prom")
+                else self.to_json_lines()
+            )
+
+        return filepath
+
+
+@contextmanager
+def profile(profiler: Optional[str], filepath: str) -> Iterator[None]:
+    """
+    Runs the block under cProfile or tracemalloc and saves the results to filepath:
+    pstats dump for cprofile, top allocation sites as text for tracemalloc.
+    Nothing is profiled when profiler is None.
+
+    :param profiler: None, cprofile or tracemalloc.
+    :param filepath: path to the output file.
+    """
+    if profiler is None:
+        yield
+        return
+
+    if profiler not in PROFILERS:
+        raise ETLVouchersException(
+            f"Unknown profiler {profiler}, available: {PROFILERS}"
+        )
+
+    if profiler == CPROFILE:
+        stats: cProfile.Profile = cProfile.Profile()
+        stats.enable()
+
+        try:
+            yield
+        finally:
+            stats.disable()
+            stats.dump_stats(filepath)
+
+        return
+
+    tracemalloc.start()
+
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        with open(filepath, "w") as f:
+            f.write(f"Peak traced memory: {peak} bytes\n")
+
+            for it in snapshot.statistics("lineno")[:50]:
+                f.write(f"{it}\n")
+
+
+@contextmanager
+def span(
+    metrics: Optional[Metrics], name: str, rows_in: Optional[int] = None
+) -> Iterator[Span]:
+    """
+    Same as Metrics.span, but yields a throwaway Span when no metrics are collected.
+    """
+    if metrics is None:
+        yield Span(name, rows_in=rows_in)
+        return
+
+    with metrics.span(name, rows_in) as it:
+        yield it
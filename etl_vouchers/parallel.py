@@ -0,0 +1,457 @@
+import io
+import os
+import tempfile
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.etl import (
+    PipelineResponse,
+    PipelineSummary,
+    _load,
+    _transform_vouchers,
+)
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.expectations import NATIVE_BACKEND
+from etl_vouchers.formats import (
+    CSV,
+    PARQUET,
+    _apply_schema,
+    _pyarrow,
+    _read_csv_kwargs,
+    check_header,
+    detect_format,
+    read_header,
+)
+from etl_vouchers.metrics import Metrics
+from etl_vouchers.schema import BARCODES, CSV_ENGINES, ORDERS, Schema
+from etl_vouchers.streaming import _hash_partition
+from etl_vouchers.utils import pretty_print
+from etl_vouchers.validator import OrdersValidator, sample
+from etl_vouchers.vouchers import Vouchers
+
+
+class _SerialExecutor(Executor):
+    """
+    Runs the partitions one by one in the current process, used for a single worker.
+    """
+
+    def map(self, fn, *iterables, **kwargs):
+        return map(fn, *iterables)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future: Future = Future()
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+        return future
+
+
+def _line_start(f, position: int) -> int:
+    """
+    :return: position of the first line that starts at or after position.
+    """
+    if position == 0:
+        return 0
+
+    # if position - 1 is a newline, readline stops right at position
+    f.seek(position - 1)
+    f.readline()
+
+    return f.tell()
+
+
+def _read_part(
+    filepath: str, schema: Schema, part: int, parts: int, engine: str = "c"
+) -> pd.DataFrame:
+    """
+    Reads one of `parts` contiguous parts of the file: csv files are split into byte ranges
+    at line boundaries, parquet files into row groups and feather files into record batches.
+    The parts of a file together hold every row once, in the file order.
+
+    :return: pandas DataFrame with the schema columns in the schema dtypes.
+    """
+    fmt: str = detect_format(filepath)
+
+    try:
+        if fmt == CSV:
+            size: int = os.path.getsize(filepath)
+
+            with open(filepath, "rb") as f:
+                header: bytes = f.readline()
+                start: int = _line_start(f, max(size * part // parts, len(header)))
+                stop: int = _line_start(f, max(size * (part + 1) // parts, len(header)))
+                f.seek(start)
+                data: bytes = f.read(stop - start)
+
+            if not data.strip():
+                return pd.DataFrame(
+                    {
+                        name: pd.Series(dtype=dtype)
+                        for name, dtype in schema.dtypes.items()
+                    }
+                )
+
+            return pd.read_csv(
+                io.BytesIO(header + data),
+                engine=engine,
+                **_read_csv_kwargs(schema, None),
+            )
+
+        pa = _pyarrow()
+
+        if fmt == PARQUET:
+            import pyarrow.parquet as pq
+
+            parquet_file = pq.ParquetFile(filepath)
+            groups: int = parquet_file.num_row_groups
+            table = parquet_file.read_row_groups(
+                list(range(groups * part // parts, groups * (part + 1) // parts)),
+                columns=schema.names,
+            )
+        else:
+            reader = pa.ipc.open_file(pa.memory_map(filepath, "r"))
+            batches: int = reader.num_record_batches
+            table = pa.Table.from_batches(
+                [
+                    reader.get_batch(it)
+                    for it in range(
+                        batches * part // parts, batches * (part + 1) // parts
+                    )
+                ],
+                schema=reader.schema,
+            ).select(schema.names)
+
+        return _apply_schema(table.to_pandas(), schema)
+    except ETLVouchersException:
+        raise
+    except Exception as e:
+        raise InvalidSourceFile(f"Can not read file {filepath}: {str(e)}")
+
+
+def _save_buckets(
+    folder: str, name: str, buckets: np.ndarray, parts: int, **arrays: np.ndarray
+) -> None:
+    """
+    Saves the arrays grouped by bucket, with the bounds of every bucket, as .npy files,
+    so the worker of a bucket memory-maps only its slice of them.
+    """
+    order: np.ndarray = np.argsort(buckets, kind="stable")
+    np.save(
+        f"{folder}{name}.bounds.npy",
+        np.searchsorted(buckets[order], np.arange(parts + 1)),
+    )
+
+    for key, values in arrays.items():
+        np.save(f"{folder}{name}.{key}.npy", values[order])
+
+
+def _read_bucket(
+    folder: str, name: str, bucket: int, parts: int, *keys: str
+) -> List[np.ndarray]:
+    """
+    :return: for every key, the values of the bucket from all the parts in the part order.
+    """
+    bounds: List[np.ndarray] = [
+        np.load(f"{folder}{name}.{part}.bounds.npy") for part in range(parts)
+    ]
+
+    return [
+        np.concatenate(
+            [
+                np.load(f"{folder}{name}.{part}.{key}.npy", mmap_mode="r")[
+                    bounds[part][bucket] : bounds[part][bucket + 1]
+                ]
+                for part in range(parts)
+            ]
+        )
+        for key in keys
+    ]
+
+
+def _spill_orders(args) -> int:
+    filepath, part, parts, folder, engine, backend = args
+    df: pd.DataFrame = OrdersValidator(
+        _read_part(filepath, ORDERS, part, parts, engine), silent=True, backend=backend
+    )()
+
+    _save_buckets(
+        folder,
+        f"orders.{part}",
+        _hash_partition(df["order_id"], parts),
+        parts,
+        customer_ids=df["customer_id"].to_numpy(),
+        order_ids=df["order_id"].to_numpy(),
+    )
+
+    return len(df)
+
+
+def _spill_barcodes(args) -> Tuple[int, pd.Series]:
+    """
+    Spills the barcodes of a part twice: all of them by barcode hash for the duplicate pass,
+    and the ones with an order id by order_id hash for the join.
+
+    :return: amount of rows with a barcode and order ids of the rows without one.
+    """
+    filepath, part, parts, folder, engine = args
+    df: pd.DataFrame = _read_part(filepath, BARCODES, part, parts, engine)
+    is_null: pd.Series = df["barcode"].isna()
+    null_order_ids: pd.Series = df.loc[is_null, "order_id"].reset_index(drop=True)
+    df = df.loc[~is_null]
+
+    _save_buckets(
+        folder,
+        f"barcodes.{part}",
+        _hash_partition(df["barcode"], parts),
+        parts,
+        barcodes=df["barcode"].to_numpy(dtype=np.int64),
+    )
+
+    df = df.loc[df["order_id"].notna()]
+    _save_buckets(
+        folder,
+        f"links.{part}",
+        _hash_partition(df["order_id"], parts),
+        parts,
+        barcodes=df["barcode"].to_numpy(dtype=np.int64),
+        order_ids=df["order_id"].to_numpy(dtype=np.int64),
+    )
+
+    return len(is_null) - len(null_order_ids), null_order_ids
+
+
+def _find_duplicates(args) -> Tuple[np.ndarray, int]:
+    """
+    Every copy of a barcode is in the same barcode-hash bucket.
+
+    :return: duplicated barcodes of the bucket and the amount of rows they occur in.
+    """
+    folder, bucket, parts = args
+    (barcodes,) = _read_bucket(folder, "barcodes", bucket, parts, "barcodes")
+    codes, uniques = pd.factorize(barcodes)
+    counts: np.ndarray = np.bincount(codes, minlength=len(uniques))
+    is_duplicate: np.ndarray = counts > 1
+
+    return uniques[is_duplicate], int(counts[is_duplicate].sum())
+
+
+def _join_bucket(args) -> Vouchers:
+    folder, bucket, parts, duplicates, allow_useless_vouchers = args
+    customer_ids, order_ids = _read_bucket(
+        folder, "orders", bucket, parts, "customer_ids", "order_ids"
+    )
+    barcodes, barcode_order_ids = _read_bucket(
+        folder, "links", bucket, parts, "barcodes", "order_ids"
+    )
+    is_valid: np.ndarray = ~pd.Series(barcodes).isin(duplicates).to_numpy()
+    no_missing: np.ndarray = np.zeros(int(is_valid.sum()), dtype=bool)
+
+    # nullable like the extracted barcodes, so the left join keeps them int64
+    return _transform_vouchers(
+        pd.DataFrame({"customer_id": customer_ids, "order_id": order_ids}),
+        pd.DataFrame(
+            {
+                "barcode": pd.arrays.IntegerArray(barcodes[is_valid], no_missing),
+                "order_id": pd.arrays.IntegerArray(
+                    barcode_order_ids[is_valid], no_missing
+                ),
+            }
+        ),
+        allow_useless_vouchers=allow_useless_vouchers,
+    )
+
+
+def _report_dropped(
+    duplicates: np.ndarray,
+    duplicate_rows: int,
+    null_order_ids: pd.Series,
+    silent: bool,
+) -> Dict[str, int]:
+    """
+    Reports the rules of the BarcodesValidator that dropped rows, the same way the validator does.
+
+    :return: amount of rows every rule dropped, as BarcodesValidator.dropped.
+    """
+    dropped: Dict[str, int] = {}
+
+    if duplicate_rows:
+        dropped["duplicate_barcodes"] = duplicate_rows
+
+        if not silent:
+            pretty_print(
+                "Barcodes Validator - No Barcode Duplicates",
+                ["Next barcodes are duplicated", *sample(pd.Series(duplicates))],
+            )
+
+    if len(null_order_ids):
+        dropped["orders_without_barcodes"] = len(null_order_ids)
+
+        if not silent:
+            pretty_print(
+                "Barcodes Validator - No Orders Without Barcodes",
+                ["Next orders don't have barcodes", *sample(null_order_ids)],
+            )
+
+    return dropped
+
+
+def parallel_pipeline(
+    orders_filepath: str,
+    barcodes_filepath: str,
+    dest_path: str = None,
+    transform_only: bool = False,
+    silent: bool = False,
+    allow_useless_vouchers: bool = True,
+    workers: Optional[int] = None,
+    validation_backend: str = NATIVE_BACKEND,
+    csv_engine: str = "c",
+    output_format: str = CSV,
+    compression: Optional[str] = None,
+    metrics: Optional[Metrics] = None,
+) -> PipelineResponse:
+    """
+    Version of etl.pipeline that reads, validates and transforms parts of the inputs on a process pool.
+
+    Every worker reads its own part of both files, see _read_part, validates its orders and spills
+    its rows into temporary .npy files bucketed by hash: barcodes by barcode for the duplicate pass,
+    orders and barcodes with an order id by order_id for the join. The worker of a bucket
+    memory-maps its slices of the spills, the duplicate pass returns only the duplicated barcodes,
+    and every join worker returns the Vouchers arrays of its orders, which are concatenated and
+    sorted by customer_id and order_id. No frame is sent between the processes,
+    and the output is identical to the serial one.
+
+    The validated frames are not brought back to the driver, df_orders and df_barcodes
+    of the response are None, the vouchers are in vouchers and df_vouchers.
+
+    :param orders_filepath: filepath to the csv with orders.
+    :param barcodes_filepath: filepath to the csv with barcodes data.
+    :param dest_path: path under which the output file is stored.
+    :param transform_only: bool, if true, the output file will not be generated.
+    :param silent: bool, if true, all the output to stdout will be suppressed.
+    :param allow_useless_vouchers: bool, if true, vouchers without barcodes will be generated as well.
+    :param workers: int, amount of worker processes and of parts, amount of CPUs by default.
+    :param validation_backend: str, "native" or "great_expectations", used for the orders.
+    :param csv_engine: str, csv parser of the parts, "c" or "pyarrow".
+    :param output_format: str, format of the output file, csv, parquet or feather.
+    :param compression: str, compression codec of the output file, None - format default.
+    :param metrics: Metrics the stage spans are recorded into, a new one by default.
+    :return: PipelineResponse
+    """
+    if csv_engine not in CSV_ENGINES:
+        raise ETLVouchersException(f"Unknown csv engine {csv_engine}")
+
+    # the workers read only the schema columns, so the headers are checked once up front
+    for filepath, schema in ((orders_filepath, ORDERS), (barcodes_filepath, BARCODES)):
+        try:
+            columns: List[str] = read_header(filepath)
+        except ETLVouchersException:
+            raise
+        except Exception as e:
+            raise InvalidSourceFile(f"Can not read file {filepath}: {str(e)}")
+
+        check_header(filepath, columns, schema)
+
+    parts: int = workers or os.cpu_count() or 1
+    metrics = metrics or Metrics()
+
+    executor: Executor = (
+        _SerialExecutor() if parts == 1 else ProcessPoolExecutor(max_workers=parts)
+    )
+
+    with tempfile.TemporaryDirectory(prefix="etl_vouchers.") as folder, executor:
+        folder = f"{folder}/"
+
+        with metrics.span("extract") as it:
+            orders_futures: List[Future] = [
+                executor.submit(
+                    _spill_orders,
+                    (
+                        orders_filepath,
+                        part,
+                        parts,
+                        folder,
+                        csv_engine,
+                        validation_backend,
+                    ),
+                )
+                for part in range(parts)
+            ]
+            barcodes_futures: List[Future] = [
+                executor.submit(
+                    _spill_barcodes,
+                    (barcodes_filepath, part, parts, folder, csv_engine),
+                )
+                for part in range(parts)
+            ]
+
+            # errors of the orders win, as they would if the files were read one by one
+            orders: int = sum(future.result() for future in orders_futures)
+            spilled: List[Tuple[int, pd.Series]] = [
+                future.result() for future in barcodes_futures
+            ]
+            barcodes: int = sum(rows for rows, _ in spilled)
+            null_order_ids: pd.Series = pd.concat(
+                [it for _, it in spilled], ignore_index=True
+            )
+            it.rows_out = orders + barcodes + len(null_order_ids)
+
+        with metrics.span(
+            f"validate.{BARCODES.name}", rows_in=barcodes + len(null_order_ids)
+        ) as it:
+            found: List[Tuple[np.ndarray, int]] = list(
+                executor.map(
+                    _find_duplicates,
+                    [(folder, bucket, parts) for bucket in range(parts)],
+                )
+            )
+            duplicates: np.ndarray = np.concatenate([values for values, _ in found])
+            duplicate_rows: int = sum(rows for _, rows in found)
+            barcodes -= duplicate_rows
+            it.rows_out = barcodes
+
+            it.dropped = _report_dropped(
+                duplicates, duplicate_rows, null_order_ids, silent
+            )
+
+        with metrics.span("transform", rows_in=orders + barcodes) as it:
+            parts_vouchers: List[Vouchers] = list(
+                executor.map(
+                    _join_bucket,
+                    [
+                        (folder, bucket, parts, duplicates, allow_useless_vouchers)
+                        for bucket in range(parts)
+                    ],
+                )
+            )
+            vouchers: Vouchers = Vouchers.concat(parts_vouchers)
+            vouchers = vouchers.take(
+                np.lexsort((vouchers.order_ids, vouchers.customer_ids))
+            )
+            it.rows_out = len(vouchers)
+
+    file_path: Optional[str] = None
+
+    if not transform_only:
+        with metrics.span("load", rows_in=len(vouchers)) as it:
+            file_path = _load(
+                vouchers, dest_path, fmt=output_format, compression=compression
+            )
+            it.rows_out = len(vouchers)
+
+    return PipelineResponse(
+        df_orders=None,
+        df_barcodes=None,
+        df_vouchers=vouchers.to_frame(),
+        output_filepath=file_path,
+        summary=PipelineSummary(
+            orders=orders, barcodes=barcodes, vouchers=len(vouchers)
+        ),
+        metrics=metrics,
+        vouchers=vouchers,
+    )
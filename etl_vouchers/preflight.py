@@ -0,0 +1,133 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.formats import (
+    CSV,
+    check_header,
+    detect_format,
+    iter_frames,
+    read_header,
+)
+from etl_vouchers.metrics import Metrics, span
+from etl_vouchers.schema import BARCODES, ORDERS, Schema
+from etl_vouchers.validator import sample
+
+PREFLIGHT_SAMPLE_ROWS: int = 1_000
+
+
+@dataclass
+class PreflightReport:
+    """
+    Result of a successful preflight of an input file.
+
+    :param filepath - path to the file.
+    :param schema - name of the Schema the file was checked against.
+    :param columns - header of the file.
+    :param rows - amount of rows the sample consisted of.
+    """
+
+    filepath: str
+    schema: str
+    columns: List[str]
+    rows: int
+
+
+def _read_sample(filepath: str, fmt: str, sample_rows: int) -> pd.DataFrame:
+    if fmt == CSV:
+        # parsed as text, so a bad value is reported instead of failing the parse
+        return pd.read_csv(filepath, nrows=sample_rows, dtype=str)
+
+    return next(iter_frames(filepath, sample_rows, fmt=fmt), pd.DataFrame())
+
+
+def _check_column(
+    filepath: str, values: pd.Series, name: str, dtype: str, rows: int
+) -> None:
+    numbers: pd.Series = pd.to_numeric(values, errors="coerce")
+    # values that are present but not a number, or a number with a fraction
+    is_invalid: np.ndarray = (values.notna() & numbers.isna()).to_numpy() | (
+        numbers.notna() & (numbers % 1 != 0)
+    ).to_numpy()
+
+    if is_invalid.any():
+        raise InvalidSourceFile(
+            f"{filepath}: column {name} has non-integer values in the first {rows} rows: "
+            f"{sample(values[is_invalid])}"
+        )
+
+    # lowercase numpy dtypes can not hold missing values, e.g. int64 vs nullable Int64
+    if dtype.islower() and values.isna().any():
+        raise InvalidSourceFile(
+            f"{filepath}: column {name} has missing values in the first {rows} rows"
+        )
+
+
+def preflight(
+    filepath: str,
+    schema: Schema,
+    sample_rows: int = PREFLIGHT_SAMPLE_ROWS,
+    fmt: Optional[str] = None,
+) -> PreflightReport:
+    """
+    Checks an input file before it is parsed in full: the header has to start with the schema
+    columns in the schema order, and the first `sample_rows` rows have to hold integers,
+    without missing values in the columns that can not hold them.
+
+    Only the header and the sample are read, so a wrong file is rejected within milliseconds
+    instead of after the full parse. Passing the preflight does not replace the validators,
+    the rest of the file is not looked at.
+
+    :param filepath: path to a csv, parquet or feather file.
+    :param schema: Schema the file is checked against, ORDERS or BARCODES.
+    :param sample_rows: amount of rows checked after the header, 0 - only the header.
+    :param fmt: csv, parquet or feather, detected by the file extension by default.
+    :return: PreflightReport
+    :raises InvalidSourceFile: the header or a sampled row does not match the schema.
+    """
+    fmt = detect_format(filepath, fmt)
+
+    try:
+        columns: List[str] = read_header(filepath, fmt)
+        df_sample: pd.DataFrame = (
+            _read_sample(filepath, fmt, sample_rows) if sample_rows > 0 else None
+        )
+    except ETLVouchersException:
+        raise
+    except Exception as e:
+        raise InvalidSourceFile(f"Can not read file {filepath}: {str(e)}")
+
+    check_header(filepath, columns, schema)
+
+    rows: int = 0 if df_sample is None else len(df_sample)
+
+    if rows:
+        for it in schema.columns:
+            _check_column(filepath, df_sample[it.name], it.name, it.dtype, rows)
+
+    return PreflightReport(filepath, schema.name, columns, rows)
+
+
+def preflight_inputs(
+    orders_filepath: str,
+    barcodes_filepath: str,
+    sample_rows: int = PREFLIGHT_SAMPLE_ROWS,
+    metrics: Optional[Metrics] = None,
+) -> List[PreflightReport]:
+    """
+    Preflight of both pipeline inputs, the orders first.
+
+    :param metrics: Metrics, if supplied the preflight is recorded as the preflight span.
+    :return: PreflightReport of the orders and of the barcodes.
+    """
+    with span(metrics, "preflight") as it:
+        reports: List[PreflightReport] = [
+            preflight(orders_filepath, ORDERS, sample_rows),
+            preflight(barcodes_filepath, BARCODES, sample_rows),
+        ]
+        it.rows_in = it.rows_out = sum(report.rows for report in reports)
+
+    return reports
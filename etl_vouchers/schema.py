@@ -0,0 +1,174 @@
+from dataclasses import dataclass, replace
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.exceptions import ETLVouchersException
+
+CSV_ENGINES: Tuple[str, ...] = ("c", "pyarrow")
+
+
+@dataclass(frozen=True)
+class Column:
+    """
+    Column of a dataset and the dtype it is parsed into.
+    """
+
+    name: str
+    dtype: str
+
+
+@dataclass(frozen=True)
+class Schema:
+    """
+    Ordered set of columns a dataset consists of.
+    """
+
+    name: str
+    columns: Tuple[Column, ...]
+
+    @property
+    def names(self) -> List[str]:
+        return [it.name for it in self.columns]
+
+    @property
+    def dtypes(self) -> Dict[str, str]:
+        return {it.name: it.dtype for it in self.columns}
+
+    def with_dtypes(self, **dtypes: str) -> "Schema":
+        """
+        :return: copy of the schema with some of the column dtypes replaced,
+        e.g. ORDERS.with_dtypes(customer_id="int32") for feeds known to have small ids.
+        """
+        return replace(
+            self,
+            columns=tuple(
+                Column(it.name, dtypes.get(it.name, it.dtype)) for it in self.columns
+            ),
+        )
+
+
+# Ids are not bounded by the source systems, so int64 is the narrowest safe default:
+# the C parser silently wraps values that overflow narrower ints.
+# Barcodes and the order of a barcode may be missing, hence nullable ints instead of float64.
+ORDERS: Schema = Schema(
+    "orders", (Column("customer_id", "int64"), Column("order_id", "int64"))
+)
+BARCODES: Schema = Schema(
+    "barcodes", (Column("barcode", "Int64"), Column("order_id", "Int64"))
+)
+VOUCHERS: Schema = Schema(
+    "vouchers",
+    (
+        Column("customer_id", "int64"),
+        Column("order_id", "int64"),
+        Column("barcodes", "object"),
+    ),
+)
+
+SCHEMAS: Dict[str, Schema] = {it.name: it for it in (ORDERS, BARCODES, VOUCHERS)}
+
+
+def get_schema(name: str) -> Schema:
+    """
+    :param name: orders, barcodes or vouchers.
+    :return: registered Schema.
+    """
+    try:
+        return SCHEMAS[name]
+    except KeyError:
+        raise ETLVouchersException(f"Unknown schema {name}")
+
+
+def register_schema(schema: Schema) -> None:
+    """
+    Registers a schema or overrides the registered one with the same name.
+    """
+    SCHEMAS[schema.name] = schema
+
+
+_INT_DTYPES: Tuple[str, ...] = ("int8", "int16", "int32", "int64")
+
+
+def narrowest_dtype(series: pd.Series) -> str:
+    """
+    Narrowest int dtype that holds every value of an int column, nullable if the column is,
+    e.g. int32 for ids below 2 ** 31. Other columns keep their dtype.
+
+    :return: str, name of the dtype.
+    """
+    if not pd.api.types.is_integer_dtype(series.dtype):
+        return str(series.dtype)
+
+    nullable: bool = isinstance(series.dtype, pd.api.extensions.ExtensionDtype)
+    low, high = (series.min(), series.max()) if series.notna().any() else (0, 0)
+
+    for name in _INT_DTYPES:
+        info = np.iinfo(name)
+
+        if info.min <= low and high <= info.max:
+            return name.capitalize() if nullable else name
+
+    return str(series.dtype)
+
+
+def narrow_schema(schema: Schema, df: pd.DataFrame) -> Schema:
+    """
+    :param df: pandas DataFrame parsed with the schema, e.g. a representative feed.
+    :return: copy of the schema with the int columns narrowed to the value range of df,
+    see narrowest_dtype. Values out of that range would wrap, so only use it for feeds known to fit.
+    """
+    return schema.with_dtypes(
+        **{
+            it.name: narrowest_dtype(df[it.name])
+            for it in schema.columns
+            if it.name in df
+        }
+    )
+
+
+def memory_report(df: pd.DataFrame, df_inferred: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compares memory taken by every column with what it takes when pandas infers the dtypes,
+    and with the narrowest dtype its values fit into. The default schemas keep int64 ids,
+    so they take as much as the inferred ints, and nullable columns a byte per row more
+    than the inferred float64, only a narrowed schema takes less, see narrow_schema.
+
+    :param df: pandas DataFrame parsed with a schema.
+    :param df_inferred: the same data parsed without a schema, e.g. a plain read_csv.
+    :return: pd.DataFrame with column, dtype, bytes, inferred_dtype, inferred_bytes,
+    narrowest_dtype and narrowest_bytes columns.
+    """
+    rows: List[Dict] = []
+
+    for name in df.columns:
+        actual: int = int(df[name].memory_usage(index=False, deep=True))
+        inferred: int = int(df_inferred[name].memory_usage(index=False, deep=True))
+        narrowest: str = narrowest_dtype(df[name])
+        rows.append(
+            {
+                "column": name,
+                "dtype": str(df[name].dtype),
+                "bytes": actual,
+                "inferred_dtype": str(df_inferred[name].dtype),
+                "inferred_bytes": inferred,
+                "narrowest_dtype": narrowest,
+                "narrowest_bytes": int(
+                    df[name].astype(narrowest).memory_usage(index=False, deep=True)
+                ),
+            }
+        )
+
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "column",
+            "dtype",
+            "bytes",
+            "inferred_dtype",
+            "inferred_bytes",
+            "narrowest_dtype",
+            "narrowest_bytes",
+        ],
+    )
@@ -0,0 +1,463 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.batch import (
+    BARCODES_DROP,
+    ORDERS_DROP,
+    Drop,
+    DropPair,
+    pair_drops,
+    scan_drops,
+)
+from etl_vouchers.etl import InputCache, PipelineResponse, pipeline
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.schema import BARCODES
+from etl_vouchers.statistic import count_tickets, top_k
+from etl_vouchers.vouchers import Vouchers
+
+
+@dataclass
+class Dataset:
+    """
+    Validated orders and barcodes of a drop pair, kept in memory with the lookups derived from them.
+
+    :param pair - DropPair the dataset was loaded from.
+    :param vouchers - Vouchers of the pair, sorted by customer_id and order_id.
+    :param tickets - amount of tickets indexed by customer_id, see statistic.count_tickets.
+    :param unused - barcodes without an order, in the file order.
+    :param barcodes - valid barcodes that belong to an order, ascending.
+    :param barcode_orders - order id of every barcode in barcodes.
+    :param voucher_by_order - positions of the vouchers sorted by order_id.
+    :param loaded_at - unix time the dataset was loaded at.
+    :param load_seconds - how long extract, validation and transform took.
+    """
+
+    pair: DropPair
+    vouchers: Vouchers
+    tickets: pd.Series
+    unused: np.ndarray
+    barcodes: np.ndarray
+    barcode_orders: np.ndarray
+    voucher_by_order: np.ndarray
+    loaded_at: float
+    load_seconds: float
+
+    @classmethod
+    def load(
+        cls,
+        pair: DropPair,
+        allow_useless_vouchers: bool = False,
+        cache: Optional[InputCache] = None,
+    ) -> "Dataset":
+        """
+        Runs the pipeline over the pair without writing the output and derives the lookups.
+        """
+        started: float = time.perf_counter()
+        cache = cache or InputCache()
+        resp: PipelineResponse = pipeline(
+            pair.orders,
+            pair.barcodes,
+            transform_only=True,
+            silent=True,
+            allow_useless_vouchers=allow_useless_vouchers,
+            cache=cache,
+        )
+
+        # unused barcodes are taken from the raw file, like VoucherStatistic.unused_barcodes does
+        df_raw: pd.DataFrame = cache.extract(pair.barcodes, BARCODES)
+        df_used: pd.DataFrame = resp.df_barcodes.dropna(subset=["order_id"])
+        barcodes: np.ndarray = df_used["barcode"].to_numpy(dtype=np.int64)
+        order: np.ndarray = np.argsort(barcodes, kind="stable")
+
+        return cls(
+            pair=pair,
+            vouchers=resp.vouchers,
+            tickets=count_tickets(resp.df_orders),
+            unused=df_raw["barcode"][df_raw["order_id"].isna()]
+            .dropna()
+            .to_numpy(dtype=np.int64),
+            barcodes=barcodes[order],
+            barcode_orders=df_used["order_id"].to_numpy(dtype=np.int64)[order],
+            voucher_by_order=np.argsort(resp.vouchers.order_ids, kind="stable"),
+            loaded_at=time.time(),
+            load_seconds=time.perf_counter() - started,
+        )
+
+    def info(self) -> Dict:
+        return {
+            "orders": self.pair.orders,
+            "barcodes": self.pair.barcodes,
+            "vouchers": len(self.vouchers),
+            "customers": len(self.tickets),
+            "unused_barcodes": len(self.unused),
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+        }
+
+    def top_customers(self, top: int = 5) -> List[Dict]:
+        return top_k(self.tickets, top).to_dict(orient="records")
+
+    def unused_barcodes(self, limit: Optional[int] = None) -> List[int]:
+        return self.unused[:limit].tolist()
+
+    def order_of(self, barcode: int) -> Optional[int]:
+        """
+        :return: order id of the barcode, None if the barcode is unknown, unused or invalid.
+        """
+        position: int = int(np.searchsorted(self.barcodes, barcode))
+
+        if position == len(self.barcodes) or self.barcodes[position] != barcode:
+            return None
+
+        return int(self.barcode_orders[position])
+
+    def _voucher_records(self, positions: np.ndarray) -> List[Dict]:
+        return [
+            {
+                "customer_id": int(self.vouchers.customer_ids[it]),
+                "order_id": int(self.vouchers.order_ids[it]),
+                "barcodes": self.vouchers.barcodes[
+                    self.vouchers.offsets[it] : self.vouchers.offsets[it + 1]
+                ].tolist(),
+            }
+            for it in positions.tolist()
+        ]
+
+    def vouchers_of_customer(self, customer_id: int) -> List[Dict]:
+        customer_ids: np.ndarray = self.vouchers.customer_ids
+
+        return self._voucher_records(
+            np.arange(
+                np.searchsorted(customer_ids, customer_id, "left"),
+                np.searchsorted(customer_ids, customer_id, "right"),
+            )
+        )
+
+    def vouchers_of_order(self, order_id: int) -> List[Dict]:
+        order_ids: np.ndarray = self.vouchers.order_ids[self.voucher_by_order]
+
+        return self._voucher_records(
+            self.voucher_by_order[
+                np.searchsorted(order_ids, order_id, "left") : np.searchsorted(
+                    order_ids, order_id, "right"
+                )
+            ]
+        )
+
+
+def latest_pair(
+    input_path: str, max_skew: int = 60, settle_seconds: float = 1.0
+) -> Optional[DropPair]:
+    """
+    :return: pair of the most recent orders drop in the folder, None if there is none yet.
+    """
+    drops: Dict[str, List[Drop]] = scan_drops(input_path, settle_seconds)
+    timestamps: Dict[str, int] = {
+        it.filepath: it.ts for it in [*drops[ORDERS_DROP], *drops[BARCODES_DROP]]
+    }
+    pairs: List[DropPair] = pair_drops(
+        drops[ORDERS_DROP], drops[BARCODES_DROP], max_skew
+    )
+
+    if not pairs:
+        return None
+
+    return max(pairs, key=lambda it: (timestamps[it.orders], timestamps[it.barcodes]))
+
+
+class DatasetStore:
+    """
+    Holds the dataset that is served, and replaces it when a newer pair of drops appears.
+
+    The new dataset is loaded next to the current one, which is served until it is swapped,
+    so requests never wait for a reload. A pair that fails to load is not tried again,
+    the previous dataset stays.
+
+    :param find_pair - returns the pair that should be served, e.g. latest_pair of a folder.
+    :param allow_useless_vouchers - bool, if true, vouchers without barcodes are served as well.
+    :param cache - InputCache the datasets are loaded through, e.g. with the disk cache.
+    """
+
+    def __init__(
+        self,
+        find_pair: Callable[[], Optional[DropPair]],
+        allow_useless_vouchers: bool = False,
+        cache: Optional[InputCache] = None,
+    ):
+        self.find_pair: Callable[[], Optional[DropPair]] = find_pair
+        self.allow_useless_vouchers: bool = allow_useless_vouchers
+        self.cache: Optional[InputCache] = cache
+        self.current: Optional[Dataset] = None
+        self.failed: Dict[DropPair, str] = {}
+        self._lock: threading.Lock = threading.Lock()
+        # failed is read by the request threads, which must not wait for a reload behind _lock
+        self._failed_lock: threading.Lock = threading.Lock()
+
+    def reload(self) -> bool:
+        """
+        Loads the pair returned by find_pair, unless it is already served or failed before.
+
+        :return: True if a new dataset is served.
+        """
+        with self._lock:
+            pair: Optional[DropPair] = self.find_pair()
+
+            if (
+                pair is None
+                or pair in self.failed
+                or (self.current is not None and self.current.pair == pair)
+            ):
+                return False
+
+            # frames of the replaced pair are not needed anymore
+            if self.cache is not None:
+                self.cache.clear()
+
+            try:
+                dataset: Dataset = Dataset.load(
+                    pair, self.allow_useless_vouchers, self.cache
+                )
+            except ETLVouchersException as e:
+                with self._failed_lock:
+                    self.failed[pair] = str(e)
+
+                return False
+
+            self.current = dataset
+
+            return True
+
+    def failures(self) -> Dict[DropPair, str]:
+        """
+        :return: copy of the pairs that failed to load and their errors, safe to iterate during a reload.
+        """
+        with self._failed_lock:
+            return dict(self.failed)
+
+    def watch(self, interval: float, stop: threading.Event) -> threading.Thread:
+        """
+        Starts a daemon thread that calls reload every interval seconds until stop is set.
+        """
+
+        def run() -> None:
+            while not stop.wait(interval):
+                try:
+                    self.reload()
+                except ETLVouchersException:
+                    # e.g. the folder is not reachable for a moment, the next scan retries
+                    pass
+
+        thread: threading.Thread = threading.Thread(
+            target=run, name="dataset-watch", daemon=True
+        )
+        thread.start()
+
+        return thread
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "QueryServer"
+
+    def _send(self, status: int, body) -> None:
+        data: bytes = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params: Dict[str, str] = {
+            key: values[-1] for key, values in parse_qs(url.query).items()
+        }
+        # the dataset may be swapped by a reload, every request sticks to one
+        dataset: Optional[Dataset] = self.server.store.current
+
+        try:
+            status, body = self.server.route(url.path, params, dataset)
+        except ValueError as e:
+            status, body = 400, {"error": str(e)}
+
+        self._send(status, body)
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def _int_param(params: Dict[str, str], name: str, default: Optional[int] = None):
+    if name not in params:
+        return default
+
+    try:
+        return int(params[name])
+    except ValueError:
+        raise ValueError(f"{name} has to be an integer, got {params[name]}")
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    HTTP server that answers statistics and voucher lookups from the dataset in the store,
+    every request is handled on its own thread.
+
+    GET /health, /dataset, /top-customers?top=5, /unused-barcodes?limit=100,
+    /barcodes/<barcode>, /vouchers?customer_id=<id> or /vouchers?order_id=<id>, all respond with json.
+
+    :param address - (host, port) to listen on, port 0 picks a free one.
+    :param store - DatasetStore with the served dataset.
+    :param quiet - bool, if true, requests are not logged to stderr.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, address: Tuple[str, int], store: DatasetStore, quiet: bool = False
+    ):
+        super().__init__(address, _Handler)
+        self.store: DatasetStore = store
+        self.quiet: bool = quiet
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+
+        return f"http://{host}:{port}"
+
+    def route(
+        self, path: str, params: Dict[str, str], dataset: Optional[Dataset]
+    ) -> Tuple[int, object]:
+        """
+        :return: http status and json body of the request.
+        """
+        path = path.rstrip("/") or "/"
+
+        if path == "/health":
+            return 200, {
+                "status": "ok" if dataset is not None else "loading",
+                "failed": {
+                    f"{pair.orders} + {pair.barcodes}": error
+                    for pair, error in self.store.failures().items()
+                },
+            }
+
+        if dataset is None:
+            return 503, {"error": "No dataset is loaded yet"}
+
+        if path == "/dataset":
+            return 200, dataset.info()
+
+        if path == "/top-customers":
+            return 200, dataset.top_customers(_int_param(params, "top", 5))
+
+        if path == "/unused-barcodes":
+            return 200, dataset.unused_barcodes(_int_param(params, "limit"))
+
+        if path.startswith("/barcodes/"):
+            barcode: int = _int_param({"barcode": path[len("/barcodes/") :]}, "barcode")
+            order_id: Optional[int] = dataset.order_of(barcode)
+
+            if order_id is None:
+                return 404, {"error": f"Barcode {barcode} is not used by any order"}
+
+            return 200, {"barcode": barcode, "order_id": order_id}
+
+        if path == "/vouchers":
+            if "customer_id" in params:
+                return 200, dataset.vouchers_of_customer(
+                    _int_param(params, "customer_id")
+                )
+
+            if "order_id" in params:
+                return 200, dataset.vouchers_of_order(_int_param(params, "order_id"))
+
+            raise ValueError("customer_id or order_id is required")
+
+        return 404, {"error": f"Unknown path {path}"}
+
+
+def serve(
+    input_path: Optional[str] = None,
+    orders_filepath: Optional[str] = None,
+    barcodes_filepath: Optional[str] = None,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    interval: float = 5.0,
+    max_skew: int = 60,
+    allow_useless_vouchers: bool = False,
+    cache: Optional[InputCache] = None,
+    quiet: bool = False,
+    on_ready: Optional[Callable[[QueryServer], None]] = None,
+) -> None:
+    """
+    Loads a dataset once and serves it until interrupted.
+
+    With input_path, the newest orders.<ts> / barcodes.<ts> pair of the folder is served
+    and the folder is scanned every interval seconds for a newer one. Otherwise the given files
+    are served as they are.
+
+    :param input_path: folder with the drops.
+    :param orders_filepath: path to the orders file, if no input_path is supplied.
+    :param barcodes_filepath: path to the barcodes file, if no input_path is supplied.
+    :param host: address to listen on, local only by default.
+    :param port: port to listen on.
+    :param interval: seconds between the scans of the input folder.
+    :param max_skew: max difference of the timestamps of a pair in seconds.
+    :param allow_useless_vouchers: bool, if true, vouchers without barcodes are served as well.
+    :param cache: InputCache the datasets are loaded through.
+    :param quiet: bool, if true, requests are not logged.
+    :param on_ready: called with the server once the first dataset is loaded and it listens.
+    """
+    if input_path is not None:
+
+        def find_pair() -> Optional[DropPair]:
+            return latest_pair(input_path, max_skew)
+
+    elif orders_filepath is not None and barcodes_filepath is not None:
+        pair: DropPair = DropPair(
+            os.path.abspath(orders_filepath), os.path.abspath(barcodes_filepath)
+        )
+
+        def find_pair() -> Optional[DropPair]:
+            return pair
+
+    else:
+        raise ETLVouchersException(
+            "Either an input folder or orders and barcodes files are required"
+        )
+
+    store: DatasetStore = DatasetStore(find_pair, allow_useless_vouchers, cache)
+    store.reload()
+
+    if store.current is None and input_path is None:
+        raise ETLVouchersException(
+            f"Can not load the dataset: {next(iter(store.failures().values()))}"
+        )
+
+    stop: threading.Event = threading.Event()
+
+    try:
+        server: QueryServer = QueryServer((host, port), store, quiet=quiet)
+    except OSError as e:
+        raise ETLVouchersException(f"Can not listen on {host}:{port}: {str(e)}")
+
+    with server:
+        if input_path is not None:
+            store.watch(interval, stop)
+
+        if on_ready is not None:
+            on_ready(server)
+
+        try:
+            server.serve_forever()
+        finally:
+            stop.set()
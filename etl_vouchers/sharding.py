@@ -0,0 +1,228 @@
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.etl import _load
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.formats import CSV
+from etl_vouchers.parallel import _SerialExecutor
+from etl_vouchers.streaming import _hash_partition
+from etl_vouchers.utils import current_time, sanitize_path
+from etl_vouchers.vouchers import Vouchers
+from etl_vouchers.writer import MANIFEST_SUFFIX, _publish, read_manifest
+
+HASH_SHARDING: str = "hash"
+RANGE_SHARDING: str = "range"
+
+SHARDINGS: Sequence[str] = (HASH_SHARDING, RANGE_SHARDING)
+
+INDEX_SUFFIX: str = ".index.json"
+
+INDEX_VERSION: int = 1
+
+
+def shard_of(customer_ids: np.ndarray, shards: int) -> np.ndarray:
+    """
+    Shard of every customer in the hash sharding, consumers use it to find the shard of a customer.
+
+    :param customer_ids: int64 customer ids.
+    :param shards: amount of shards.
+    :return: np.ndarray with the shard (0 to shards - 1) of every customer.
+    """
+    return _hash_partition(pd.Series(customer_ids), shards)
+
+
+def _range_shards(customer_ids: np.ndarray, shards: int) -> np.ndarray:
+    """
+    Splits vouchers sorted by customer_id into contiguous ranges of about the same amount
+    of vouchers, the vouchers of a customer are never split.
+    """
+    shard_ids: np.ndarray = np.zeros(len(customer_ids), dtype=np.int64)
+
+    for shard in range(1, shards):
+        position: int = len(customer_ids) * shard // shards
+
+        if position < len(customer_ids):
+            # the boundary moves to the first voucher of the customer
+            position = int(
+                np.searchsorted(customer_ids, customer_ids[position], "left")
+            )
+            shard_ids[position:] = shard
+
+    return shard_ids
+
+
+def _write_shard(args) -> Dict:
+    vouchers, dest_path, prefix, fmt, compression = args
+    output_filepath: str = _load(
+        vouchers, dest_path, fmt=fmt, compression=compression, prefix=prefix
+    )
+    manifest: Dict = read_manifest(output_filepath)
+
+    return {
+        "file": manifest["file"],
+        "rows": manifest["rows"],
+        "bytes": manifest["bytes"],
+        "sha256": manifest["sha256"],
+        "min_customer_id": int(vouchers.customer_ids[0]) if len(vouchers) else None,
+        "max_customer_id": int(vouchers.customer_ids[-1]) if len(vouchers) else None,
+    }
+
+
+def _drop_published(folder: str, entries: List[Dict]) -> None:
+    for it in entries:
+        for path in (f"{folder}{it['file']}", f"{folder}{it['file']}{MANIFEST_SUFFIX}"):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def write_shards(
+    vouchers: Vouchers,
+    dest_path: str,
+    shards: int,
+    sharding: str = HASH_SHARDING,
+    fmt: str = CSV,
+    compression: Optional[str] = None,
+    workers: Optional[int] = None,
+    prefix: str = "vouchers",
+) -> str:
+    """
+    Writes the vouchers partitioned by customer_id into `shards` files, serialized on a process pool.
+
+    Every shard is a regular output with its own manifest, named <prefix>.shard-<i>-of-<n>.<ts>.<ext>,
+    the vouchers in it are sorted by customer_id and order_id. The index, <prefix>.<ts>.index.json,
+    lists the file, row count, size, sha256 and customer_id range of every shard.
+    It is written once all the shards are published, so a reader that waits for the index
+    never sees a partial shard, and if a shard fails, the shards already published are removed.
+
+    :param vouchers: Vouchers sorted by customer_id and order_id.
+    :param dest_path: path to the output folder.
+    :param shards: amount of shard files.
+    :param sharding: hash - customer_id hash, see shard_of; range - contiguous customer_id ranges.
+    :param fmt: csv, parquet or feather.
+    :param compression: compression codec of the shards, None - format default.
+    :param workers: amount of processes the shards are serialized on, min(shards, cpus) by default.
+    :param prefix: name of the output files before the shard and timestamp.
+    :return: str, path to the index file.
+    """
+    if sharding not in SHARDINGS:
+        raise ETLVouchersException(
+            f"Unknown sharding {sharding}, available: {list(SHARDINGS)}"
+        )
+
+    if shards < 1:
+        raise ETLVouchersException("At least one shard is required")
+
+    folder: str = sanitize_path(dest_path or ".")
+    shard_ids: np.ndarray = (
+        shard_of(vouchers.customer_ids, shards)
+        if sharding == HASH_SHARDING
+        else _range_shards(vouchers.customer_ids, shards)
+    )
+    # a stable sort keeps the vouchers of every shard in the customer_id, order_id order
+    order: np.ndarray = np.argsort(shard_ids, kind="stable")
+    bounds: np.ndarray = np.searchsorted(shard_ids[order], np.arange(shards + 1))
+    tasks = [
+        (
+            vouchers.take(order[bounds[shard] : bounds[shard + 1]]),
+            folder,
+            f"{prefix}.shard-{shard:04d}-of-{shards:04d}",
+            fmt,
+            compression,
+        )
+        for shard in range(shards)
+    ]
+
+    workers = workers or min(shards, os.cpu_count() or 1)
+    executor: Executor = (
+        _SerialExecutor() if workers == 1 else ProcessPoolExecutor(max_workers=workers)
+    )
+    with executor:
+        futures = [executor.submit(_write_shard, it) for it in tasks]
+
+    entries: List[Dict] = []
+    error: Optional[BaseException] = None
+
+    for shard, future in enumerate(futures):
+        try:
+            entries.append({"shard": shard, **future.result()})
+        except BaseException as e:
+            error = error or e
+
+    if error is not None:
+        _drop_published(folder, entries)
+
+        if isinstance(error, ETLVouchersException):
+            raise error
+
+        raise ETLVouchersException(f"Can not write the shards: {str(error)}")
+
+    index: Dict = {
+        "version": INDEX_VERSION,
+        "key": "customer_id",
+        "sharding": sharding,
+        "shards": shards,
+        "format": fmt,
+        "compression": compression,
+        "rows": sum(it["rows"] for it in entries),
+        "files": entries,
+        "created_at": time.time(),
+    }
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{prefix}.", suffix=".tmp", dir=folder)
+
+    with os.fdopen(fd, "w") as f:
+        json.dump(index, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+
+    ts: int = current_time()
+
+    return _publish(
+        tmp_path,
+        [
+            f"{folder}{prefix}.{ts}{INDEX_SUFFIX}",
+            *(f"{folder}{prefix}.{ts}.{n}{INDEX_SUFFIX}" for n in range(1, 10_000)),
+        ],
+    )
+
+
+def read_index(index_filepath: str) -> Dict:
+    """
+    :return: dict with the index of a sharded output, the file of every shard as a full path.
+    """
+    try:
+        with open(index_filepath) as f:
+            index: Dict = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ETLVouchersException(f"Can not read shard index {index_filepath}: {e}")
+
+    folder: str = os.path.dirname(os.path.abspath(index_filepath))
+
+    for it in index["files"]:
+        it["path"] = os.path.join(folder, it["file"])
+
+    return index
+
+
+def shards_for_customer(index: Dict, customer_id: int) -> List[Dict]:
+    """
+    :return: entries of the shards that may hold vouchers of the customer, based on the key ranges.
+    """
+    if index["sharding"] == HASH_SHARDING:
+        shard: int = int(
+            shard_of(np.array([customer_id], dtype=np.int64), index["shards"])[0]
+        )
+
+        return [it for it in index["files"] if it["shard"] == shard and it["rows"]]
+
+    return [
+        it
+        for it in index["files"]
+        if it["rows"] and it["min_customer_id"] <= customer_id <= it["max_customer_id"]
+    ]
@@ -0,0 +1,445 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.etl import extract_chunks
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.expectations import NATIVE_BACKEND
+from etl_vouchers.schema import BARCODES, ORDERS
+from etl_vouchers.statistic import top_k
+from etl_vouchers.validator import BarcodesValidator, OrdersValidator
+
+_DEFAULT_CHUNKSIZE: int = 1_000_000
+
+
+def _hash(values: np.ndarray) -> np.ndarray:
+    """
+    64 bit hashes of int keys, the same for every run, so sketches of separate runs can be merged.
+    """
+    return pd.util.hash_array(np.asarray(values, dtype=np.int64))
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """
+    Exact bit length of every uint64 value, found by a binary search over the shifts.
+    """
+    values = values.copy()
+    lengths: np.ndarray = np.zeros(len(values), dtype=np.int64)
+
+    for shift in (32, 16, 8, 4, 2, 1):
+        is_long: np.ndarray = values >= np.uint64(1 << shift)
+        values[is_long] >>= np.uint64(shift)
+        lengths += is_long * shift
+
+    return lengths + (values > 0)
+
+
+class CountMinSketch:
+    """
+    Approximate count of every key in depth x width counters.
+
+    A key is counted in one counter of every row, its estimate is the smallest of them,
+    so it is never below the true count and above it by at most e / width of the total count
+    with probability 1 - e ** -depth. Sketches of the same size are merged by adding the counters.
+
+    :param width - amount of counters in a row.
+    :param depth - amount of rows, each with its own hash of the key.
+    :param table - int64 counters, depth x width.
+    """
+
+    def __init__(
+        self, width: int = 1 << 18, depth: int = 4, table: Optional[np.ndarray] = None
+    ):
+        self.width: int = width
+        self.depth: int = depth
+        self.table: np.ndarray = (
+            np.zeros((depth, width), dtype=np.int64) if table is None else table
+        )
+
+    def _columns(self, keys: np.ndarray) -> np.ndarray:
+        # row i uses h1 + i * h2, two halves of a single hash are as good as depth independent hashes
+        hashes: np.ndarray = _hash(keys)
+        low: np.ndarray = hashes & np.uint64(0xFFFFFFFF)
+        high: np.ndarray = hashes >> np.uint64(32)
+
+        return np.stack(
+            [
+                (low + np.uint64(row) * high) % np.uint64(self.width)
+                for row in range(self.depth)
+            ]
+        ).astype(np.int64)
+
+    def add(self, keys: np.ndarray, counts: np.ndarray) -> None:
+        """
+        :param keys: unique int keys.
+        :param counts: amount of occurrences of every key.
+        """
+        for row, columns in enumerate(self._columns(keys)):
+            self.table[row] += np.bincount(
+                columns, weights=counts, minlength=self.width
+            ).astype(np.int64)
+
+    def estimate(self, keys: np.ndarray) -> np.ndarray:
+        """
+        :return: int64 array, estimated count of every key.
+        """
+        if not len(keys):
+            return np.empty(0, dtype=np.int64)
+
+        columns: np.ndarray = self._columns(keys)
+
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ETLVouchersException(
+                "Count-Min sketches of different sizes can not be merged"
+            )
+
+        return CountMinSketch(self.width, self.depth, self.table + other.table)
+
+
+class HeavyHitters:
+    """
+    Keys with the largest counts, within fixed memory.
+
+    Counts are kept in a CountMinSketch, next to it the `capacity` keys with the largest
+    estimates seen so far are kept as candidates. A key with a large count is estimated
+    at least at its count, so it can only be pushed out by keys estimated even higher.
+
+    :param sketch - CountMinSketch with the counts of all the keys.
+    :param capacity - max amount of candidates.
+    :param candidates - int64 array of the candidate keys.
+    """
+
+    def __init__(
+        self,
+        sketch: Optional[CountMinSketch] = None,
+        capacity: int = 1024,
+        candidates: Optional[np.ndarray] = None,
+    ):
+        self.sketch: CountMinSketch = sketch or CountMinSketch()
+        self.capacity: int = capacity
+        self.candidates: np.ndarray = (
+            np.empty(0, dtype=np.int64) if candidates is None else candidates
+        )
+
+    def _prune(self, keys: np.ndarray) -> None:
+        keys = np.union1d(self.candidates, keys)
+
+        if len(keys) > self.capacity:
+            estimates: np.ndarray = self.sketch.estimate(keys)
+            keys = keys[np.argpartition(-estimates, self.capacity - 1)[: self.capacity]]
+
+        self.candidates = np.sort(keys)
+
+    def add(self, keys: np.ndarray) -> None:
+        """
+        :param keys: int keys, repeated once per occurrence.
+        """
+        unique, counts = np.unique(np.asarray(keys, dtype=np.int64), return_counts=True)
+        self.sketch.add(unique, counts)
+        self._prune(unique)
+
+    def top(self, k: int) -> pd.Series:
+        """
+        :return: pd.Series, estimated count of the k keys with the largest estimates indexed by key.
+        """
+        estimates: pd.Series = pd.Series(
+            self.sketch.estimate(self.candidates), index=self.candidates
+        )
+        df_top: pd.DataFrame = top_k(estimates, k)
+
+        return pd.Series(
+            df_top["amount_of_tickets"].to_numpy(), index=df_top["customer_id"]
+        )
+
+    def merge(self, other: "HeavyHitters") -> "HeavyHitters":
+        merged: HeavyHitters = HeavyHitters(
+            self.sketch.merge(other.sketch),
+            max(self.capacity, other.capacity),
+            self.candidates,
+        )
+        merged._prune(other.candidates)
+
+        return merged
+
+
+class HyperLogLog:
+    """
+    Approximate amount of distinct keys in 2 ** precision one byte registers.
+
+    The first `precision` bits of the hash of a key pick a register, which keeps the longest run
+    of leading zeros of the remaining bits seen in it. The standard error is 1.04 / sqrt(2 ** precision),
+    0.8% for the default 16KB of registers. Sketches of the same precision are merged by the register maximum.
+
+    :param precision - amount of hash bits that pick the register, 4 to 18.
+    :param registers - uint8 registers.
+    """
+
+    def __init__(self, precision: int = 14, registers: Optional[np.ndarray] = None):
+        if not 4 <= precision <= 18:
+            raise ETLVouchersException("HyperLogLog precision has to be 4 to 18")
+
+        self.precision: int = precision
+        self.registers: np.ndarray = (
+            np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+        )
+
+    def add(self, keys: np.ndarray) -> None:
+        hashes: np.ndarray = _hash(keys)
+        bits: int = 64 - self.precision
+        indexes: np.ndarray = (hashes >> np.uint64(bits)).astype(np.int64)
+        ranks: np.ndarray = bits + 1 - _bit_length(hashes & np.uint64((1 << bits) - 1))
+        np.maximum.at(self.registers, indexes, ranks.astype(np.uint8))
+
+    def estimate(self) -> int:
+        m: int = len(self.registers)
+        alpha: float = 0.7213 / (1 + 1.079 / m)
+        estimate: float = (
+            alpha * m * m / np.power(2.0, -self.registers.astype(float)).sum()
+        )
+        zeros: int = int((self.registers == 0).sum())
+
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more precise for small cardinalities
+            estimate = m * np.log(m / zeros)
+
+        return int(round(estimate))
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if self.precision != other.precision:
+            raise ETLVouchersException(
+                "HyperLogLog sketches of different precisions can not be merged"
+            )
+
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+
+@dataclass
+class ApproxStatistic:
+    """
+    Approximate statistics of orders and barcodes files, built in a single streaming pass
+    within fixed memory, see sketch_files. Statistics of separate files or partitions are merged
+    with merge, and they can be saved and loaded to be merged with later runs.
+
+    Duplicated barcodes can not be found within fixed memory, so the barcode counts include them.
+
+    :param customers - HeavyHitters, tickets per customer.
+    :param distinct_customers - HyperLogLog of the customer ids.
+    :param distinct_orders - HyperLogLog of the order ids.
+    :param distinct_barcodes - HyperLogLog of the barcodes.
+    :param orders - amount of valid orders.
+    :param barcodes - amount of barcodes with a value.
+    :param unused_barcodes - amount of barcodes without an order.
+    """
+
+    customers: HeavyHitters
+    distinct_customers: HyperLogLog
+    distinct_orders: HyperLogLog
+    distinct_barcodes: HyperLogLog
+    orders: int = 0
+    barcodes: int = 0
+    unused_barcodes: int = 0
+
+    @classmethod
+    def empty(
+        cls,
+        width: int = 1 << 18,
+        depth: int = 4,
+        capacity: int = 1024,
+        precision: int = 14,
+    ) -> "ApproxStatistic":
+        """
+        :param width: counters in a row of the Count-Min sketch of the customers.
+        :param depth: rows of the Count-Min sketch.
+        :param capacity: amount of top customer candidates.
+        :param precision: HyperLogLog precision of the distinct counts.
+        """
+        return cls(
+            customers=HeavyHitters(CountMinSketch(width, depth), capacity),
+            distinct_customers=HyperLogLog(precision),
+            distinct_orders=HyperLogLog(precision),
+            distinct_barcodes=HyperLogLog(precision),
+        )
+
+    def add_orders(self, df_orders: pd.DataFrame) -> None:
+        """
+        :param df_orders: validated orders, every order is a ticket of its customer.
+        """
+        df_orders = df_orders.drop_duplicates(subset=["customer_id", "order_id"])
+        customer_ids: np.ndarray = df_orders["customer_id"].to_numpy(dtype=np.int64)
+
+        self.customers.add(customer_ids)
+        self.distinct_customers.add(customer_ids)
+        self.distinct_orders.add(df_orders["order_id"].to_numpy(dtype=np.int64))
+        self.orders += len(df_orders)
+
+    def add_barcodes(self, df_barcodes: pd.DataFrame) -> None:
+        """
+        :param df_barcodes: barcodes in the expected format, rows without a barcode are skipped.
+        """
+        df_barcodes = df_barcodes[df_barcodes["barcode"].notna()]
+
+        self.distinct_barcodes.add(df_barcodes["barcode"].to_numpy(dtype=np.int64))
+        self.barcodes += len(df_barcodes)
+        self.unused_barcodes += int(df_barcodes["order_id"].isna().sum())
+
+    def merge(self, other: "ApproxStatistic") -> "ApproxStatistic":
+        return ApproxStatistic(
+            customers=self.customers.merge(other.customers),
+            distinct_customers=self.distinct_customers.merge(other.distinct_customers),
+            distinct_orders=self.distinct_orders.merge(other.distinct_orders),
+            distinct_barcodes=self.distinct_barcodes.merge(other.distinct_barcodes),
+            orders=self.orders + other.orders,
+            barcodes=self.barcodes + other.barcodes,
+            unused_barcodes=self.unused_barcodes + other.unused_barcodes,
+        )
+
+    def top_customers(self, top: int = 5) -> pd.DataFrame:
+        """
+        :return: pd.DataFrame with customer_id and amount_of_tickets columns, the amounts are upper estimates.
+        """
+        tickets: pd.Series = self.customers.top(top)
+
+        return pd.DataFrame(
+            {
+                "customer_id": tickets.index.to_numpy(),
+                "amount_of_tickets": tickets.to_numpy(),
+            }
+        )
+
+    def summary(self) -> Dict:
+        """
+        :return: dict with the counts, the distinct counts are estimates.
+        """
+        return {
+            "orders": self.orders,
+            "distinct_customers": self.distinct_customers.estimate(),
+            "distinct_orders": self.distinct_orders.estimate(),
+            "barcodes": self.barcodes,
+            "distinct_barcodes": self.distinct_barcodes.estimate(),
+            "unused_barcodes": self.unused_barcodes,
+            "unused_barcodes_ratio": (
+                self.unused_barcodes / self.barcodes if self.barcodes else 0.0
+            ),
+        }
+
+    def save(self, filepath: str) -> str:
+        """
+        Saves the sketches into a .npz file, see load.
+
+        :return: str, path to the saved file.
+        """
+        np.savez(
+            filepath,
+            table=self.customers.sketch.table,
+            capacity=self.customers.capacity,
+            candidates=self.customers.candidates,
+            distinct_customers=self.distinct_customers.registers,
+            distinct_orders=self.distinct_orders.registers,
+            distinct_barcodes=self.distinct_barcodes.registers,
+            counts=np.array([self.orders, self.barcodes, self.unused_barcodes]),
+        )
+
+        return filepath if filepath.endswith(".npz") else f"{filepath}.npz"
+
+    @classmethod
+    def load(cls, filepath: str) -> "ApproxStatistic":
+        try:
+            data = np.load(filepath)
+        except (OSError, ValueError) as e:
+            raise ETLVouchersException(f"Can not load sketches {filepath}: {e}")
+
+        depth, width = data["table"].shape
+        hll: Tuple[HyperLogLog, ...] = tuple(
+            HyperLogLog(int(np.log2(len(data[it]))), data[it])
+            for it in ("distinct_customers", "distinct_orders", "distinct_barcodes")
+        )
+        orders, barcodes, unused_barcodes = data["counts"].tolist()
+
+        return cls(
+            HeavyHitters(
+                CountMinSketch(width, depth, data["table"]),
+                int(data["capacity"]),
+                data["candidates"],
+            ),
+            *hll,
+            orders=orders,
+            barcodes=barcodes,
+            unused_barcodes=unused_barcodes,
+        )
+
+
+def sketch_orders(
+    statistic: ApproxStatistic,
+    orders_filepath: str,
+    chunksize: int = _DEFAULT_CHUNKSIZE,
+    validation_backend: str = NATIVE_BACKEND,
+) -> ApproxStatistic:
+    for df_chunk in extract_chunks(orders_filepath, chunksize, ORDERS):
+        statistic.add_orders(
+            OrdersValidator(df_chunk, silent=True, backend=validation_backend)()
+        )
+
+    return statistic
+
+
+def sketch_barcodes(
+    statistic: ApproxStatistic,
+    barcodes_filepath: str,
+    chunksize: int = _DEFAULT_CHUNKSIZE,
+    validation_backend: str = NATIVE_BACKEND,
+) -> ApproxStatistic:
+    for df_chunk in extract_chunks(barcodes_filepath, chunksize, BARCODES):
+        if not BarcodesValidator(
+            df_chunk, silent=True, backend=validation_backend
+        ).has_expected_format():
+            raise InvalidSourceFile(
+                "Barcode csv file has to contain 2 columns - barcode, order_id"
+            )
+
+        statistic.add_barcodes(df_chunk)
+
+    return statistic
+
+
+def sketch_files(
+    orders_filepaths: Iterable[str] = (),
+    barcodes_filepaths: Iterable[str] = (),
+    chunksize: Optional[int] = None,
+    validation_backend: str = NATIVE_BACKEND,
+    **sizes,
+) -> ApproxStatistic:
+    """
+    Streams every file once, chunk by chunk, into its own ApproxStatistic and merges them.
+
+    Orders are validated the way count_tickets_streaming does, duplicated orders are only
+    dropped within a chunk. Memory is bounded by the chunk and the sketch sizes.
+
+    :param orders_filepaths: paths to orders files, e.g. partitions of one feed.
+    :param barcodes_filepaths: paths to barcodes files.
+    :param chunksize: amount of rows read at once.
+    :param sizes: sketch sizes, see ApproxStatistic.empty.
+    :return: ApproxStatistic of all the files.
+    """
+    chunksize = chunksize or _DEFAULT_CHUNKSIZE
+    statistic: ApproxStatistic = ApproxStatistic.empty(**sizes)
+
+    for filepath in orders_filepaths:
+        statistic = statistic.merge(
+            sketch_orders(
+                ApproxStatistic.empty(**sizes), filepath, chunksize, validation_backend
+            )
+        )
+
+    for filepath in barcodes_filepaths:
+        statistic = statistic.merge(
+            sketch_barcodes(
+                ApproxStatistic.empty(**sizes), filepath, chunksize, validation_backend
+            )
+        )
+
+    return statistic
@@ -0,0 +1,419 @@
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.etl import (
+    PipelineResponse,
+    PipelineSummary,
+    _load,
+    extract_chunks,
+)
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.expectations import NATIVE_BACKEND
+from etl_vouchers.formats import CSV
+from etl_vouchers.metrics import Metrics
+from etl_vouchers.schema import BARCODES, ORDERS
+from etl_vouchers.utils import pretty_print
+from etl_vouchers.validator import BarcodesValidator, OrdersValidator
+from etl_vouchers.vouchers import Vouchers
+
+_DEFAULT_CHUNKSIZE: int = 1_000_000
+
+
+class NotSorted(ETLVouchersException):
+    """
+    An input of the sort-merge join is not sorted by order_id.
+    """
+
+
+def _is_sorted(values: np.ndarray) -> bool:
+    return len(values) < 2 or bool((values[1:] >= values[:-1]).all())
+
+
+class SortedBarcodes:
+    """
+    Barcodes file validated in one streaming pass, the barcodes that belong to an order
+    are spilled as int64 (barcode, order_id) pairs in the file order, which is the order_id order.
+
+    Duplicates can be anywhere in a file sorted by order_id, so the whole barcode column has to be
+    seen before any barcode is joined. The pass keeps only the barcode values, 8 bytes a row,
+    and finds the duplicated ones with a sort, the rest of the pass is bounded by the chunk size.
+    The merge streams the spill back chunk by chunk, the csv is parsed once.
+
+    :param path - spill file with the (barcode, order_id) pairs, duplicates included.
+    :param duplicates - sorted barcode values that occur more than once in the file.
+    :param stats - amount of valid (including unused), duplicated and null barcodes.
+    """
+
+    def __init__(self, path: str, duplicates: np.ndarray, stats: Dict):
+        self.path: str = path
+        self.duplicates: np.ndarray = duplicates
+        self.stats: Dict[str, int] = stats
+
+    @classmethod
+    def extract(
+        cls,
+        barcodes_filepath: str,
+        folder: str,
+        chunksize: int = _DEFAULT_CHUNKSIZE,
+        validation_backend: str = NATIVE_BACKEND,
+    ) -> "SortedBarcodes":
+        """
+        Reads and validates the barcodes file chunk by chunk and spills it into folder.
+
+        :raises NotSorted: barcodes that belong to an order are not sorted by order_id,
+        as soon as the first unsorted chunk is read. Unused ones may be anywhere in the file.
+        """
+        path: str = f"{folder}barcodes.bin"
+        values: List[np.ndarray] = []
+        nulls: int = 0
+        last: Optional[int] = None
+
+        with open(path, "wb") as f:
+            for df_chunk in extract_chunks(barcodes_filepath, chunksize, BARCODES):
+                if not BarcodesValidator(
+                    df_chunk, silent=True, backend=validation_backend
+                ).has_expected_format():
+                    raise InvalidSourceFile(
+                        "Barcode csv file has to contain 2 columns - barcode, order_id"
+                    )
+
+                rows: int = len(df_chunk)
+                df_chunk = df_chunk.loc[df_chunk["barcode"].notna()]
+                nulls += rows - len(df_chunk)
+                values.append(df_chunk["barcode"].to_numpy(dtype=np.int64))
+
+                df_chunk = df_chunk.loc[df_chunk["order_id"].notna()]
+                order_ids: np.ndarray = df_chunk["order_id"].to_numpy(dtype=np.int64)
+
+                if len(order_ids):
+                    if (last is not None and order_ids[0] < last) or not _is_sorted(
+                        order_ids
+                    ):
+                        raise NotSorted(
+                            f"{barcodes_filepath} is not sorted by order_id"
+                        )
+
+                    last = int(order_ids[-1])
+
+                np.column_stack(
+                    (df_chunk["barcode"].to_numpy(dtype=np.int64), order_ids)
+                ).tofile(f)
+
+        all_values: np.ndarray = (
+            np.concatenate(values) if values else np.empty(0, dtype=np.int64)
+        )
+        del values
+        all_values.sort()
+
+        # a duplicated value equals one of its neighbours once the values are sorted
+        is_repeat: np.ndarray = all_values[1:] == all_values[:-1]
+        is_duplicate: np.ndarray = np.zeros(len(all_values), dtype=bool)
+        is_duplicate[1:] |= is_repeat
+        is_duplicate[:-1] |= is_repeat
+        duplicate_rows: int = int(is_duplicate.sum())
+
+        return cls(
+            path,
+            np.unique(all_values[1:][is_repeat]),
+            {
+                "rows": len(all_values) - duplicate_rows,
+                "duplicates": duplicate_rows,
+                "nulls": nulls,
+            },
+        )
+
+    @property
+    def dropped(self) -> Dict[str, int]:
+        """
+        :return: amount of rows dropped by every barcodes validation rule, like BarcodesValidator.dropped.
+        """
+        return {
+            name: self.stats[key]
+            for name, key in (
+                ("duplicate_barcodes", "duplicates"),
+                ("orders_without_barcodes", "nulls"),
+            )
+            if self.stats[key]
+        }
+
+    def chunks(self, chunksize: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        :return: iterator over the barcodes and order ids of the spill without the duplicates.
+        """
+        with open(self.path, "rb") as f:
+            while True:
+                pairs: np.ndarray = np.fromfile(
+                    f, dtype=np.int64, count=2 * chunksize
+                ).reshape(-1, 2)
+
+                if not len(pairs):
+                    return
+
+                # the duplicates are sorted, a binary search needs no hash table per chunk
+                positions: np.ndarray = np.minimum(
+                    np.searchsorted(self.duplicates, pairs[:, 0]),
+                    max(len(self.duplicates) - 1, 0),
+                )
+                is_valid: np.ndarray = (
+                    self.duplicates[positions] != pairs[:, 0]
+                    if len(self.duplicates)
+                    else np.ones(len(pairs), dtype=bool)
+                )
+
+                yield pairs[is_valid, 0], pairs[is_valid, 1]
+
+
+def merge_sorted(
+    orders_filepath: str,
+    barcodes: SortedBarcodes,
+    allow_useless_vouchers: bool = True,
+    chunksize: int = _DEFAULT_CHUNKSIZE,
+    silent: bool = False,
+    validation_backend: str = NATIVE_BACKEND,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[Vouchers]:
+    """
+    Joins an orders file sorted by order_id with the sorted barcodes in lockstep.
+
+    Both sides are streamed chunk by chunk. Barcode chunks are read until they pass the last order
+    of the orders chunk, the barcodes of every order are a contiguous run found by a binary search
+    and are sliced straight into the offsets of the vouchers. The barcodes of the last order
+    are carried over, it may go on in the next orders chunk, so neither side is ever hashed or sorted.
+
+    :param stats: dict, if supplied the amount of valid orders is counted into its orders key.
+    :return: iterator over Vouchers of every orders chunk in the orders file order.
+    :raises NotSorted: the orders are not sorted by order_id, before the unsorted chunk is yielded.
+    """
+    barcode_chunks: Iterator[Tuple[np.ndarray, np.ndarray]] = barcodes.chunks(chunksize)
+    buffer_barcodes: np.ndarray = np.empty(0, dtype=np.int64)
+    buffer_order_ids: np.ndarray = np.empty(0, dtype=np.int64)
+    is_exhausted: bool = False
+    last: Optional[int] = None
+
+    for df_chunk in extract_chunks(orders_filepath, chunksize, ORDERS):
+        df_chunk = OrdersValidator(
+            df_chunk, silent=silent, backend=validation_backend
+        )()
+        order_ids: np.ndarray = df_chunk["order_id"].to_numpy(dtype=np.int64)
+
+        if not len(order_ids):
+            continue
+
+        if (last is not None and order_ids[0] < last) or not _is_sorted(order_ids):
+            raise NotSorted(f"{orders_filepath} is not sorted by order_id")
+
+        last = int(order_ids[-1])
+
+        if stats is not None:
+            stats["orders"] = stats.get("orders", 0) + len(order_ids)
+
+        while not is_exhausted and (
+            not len(buffer_order_ids) or buffer_order_ids[-1] <= last
+        ):
+            chunk: Optional[Tuple[np.ndarray, np.ndarray]] = next(barcode_chunks, None)
+
+            if chunk is None:
+                is_exhausted = True
+            else:
+                buffer_barcodes = np.concatenate((buffer_barcodes, chunk[0]))
+                buffer_order_ids = np.concatenate((buffer_order_ids, chunk[1]))
+
+        starts: np.ndarray = np.searchsorted(buffer_order_ids, order_ids, "left")
+        counts: np.ndarray = (
+            np.searchsorted(buffer_order_ids, order_ids, "right") - starts
+        )
+        offsets: np.ndarray = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        # position of every barcode = start of its run + its rank in the voucher
+        positions: np.ndarray = np.repeat(starts - offsets[:-1], counts) + np.arange(
+            offsets[-1], dtype=np.int64
+        )
+
+        vouchers: Vouchers = Vouchers(
+            customer_ids=df_chunk["customer_id"].to_numpy(),
+            order_ids=df_chunk["order_id"].to_numpy(),
+            offsets=offsets,
+            barcodes=buffer_barcodes[positions],
+        )
+
+        if not allow_useless_vouchers:
+            vouchers = vouchers.take(np.flatnonzero(counts > 0))
+
+        yield vouchers
+
+        # barcodes of earlier orders never match again
+        carried: int = int(np.searchsorted(buffer_order_ids, last, "left"))
+        buffer_barcodes = buffer_barcodes[carried:]
+        buffer_order_ids = buffer_order_ids[carried:]
+
+
+def _sort_vouchers(vouchers: Vouchers) -> Vouchers:
+    """
+    Orders vouchers of the merge by customer_id and order_id, the way etl._transform does.
+
+    Repeated (customer_id, order_id) vouchers become one voucher with the barcodes of all of them,
+    they are next to each other once sorted, so only their offsets are dropped.
+    """
+    customer_ids: np.ndarray = vouchers.customer_ids
+    order_ids: np.ndarray = vouchers.order_ids
+    is_sorted: bool = bool(
+        (
+            (customer_ids[1:] > customer_ids[:-1])
+            | (
+                (customer_ids[1:] == customer_ids[:-1])
+                & (order_ids[1:] >= order_ids[:-1])
+            )
+        ).all()
+    )
+
+    if not is_sorted:
+        vouchers = vouchers.take(np.lexsort((order_ids, customer_ids)))
+        customer_ids, order_ids = vouchers.customer_ids, vouchers.order_ids
+
+    is_start: np.ndarray = np.ones(len(vouchers), dtype=bool)
+    is_start[1:] = (customer_ids[1:] != customer_ids[:-1]) | (
+        order_ids[1:] != order_ids[:-1]
+    )
+
+    if is_start.all():
+        return vouchers
+
+    starts: np.ndarray = np.flatnonzero(is_start)
+
+    return Vouchers(
+        customer_ids=customer_ids[starts],
+        order_ids=order_ids[starts],
+        offsets=vouchers.offsets[np.append(starts, len(vouchers))],
+        barcodes=vouchers.barcodes,
+    )
+
+
+def sorted_pipeline(
+    orders_filepath: str,
+    barcodes_filepath: str,
+    dest_path: str = None,
+    transform_only: bool = False,
+    silent: bool = False,
+    allow_useless_vouchers: bool = True,
+    chunksize: Optional[int] = None,
+    validation_backend: str = NATIVE_BACKEND,
+    output_format: str = CSV,
+    compression: Optional[str] = None,
+    metrics: Optional[Metrics] = None,
+) -> PipelineResponse:
+    """
+    Version of etl.pipeline for inputs that are already sorted by order_id.
+
+    Instead of the hash join and the sort of the joined rows, the orders are streamed
+    against the sorted barcodes, see merge_sorted. Neither input frame is kept: the duplicate
+    detection keeps the barcode values, see SortedBarcodes, the vouchers are kept as Vouchers
+    arrays, since the output is ordered by customer_id. Everything else is bounded by the chunk size,
+    so the memory grows with the output, which is reported unless silent.
+
+    The first chunk of the orders is checked before the barcodes are read, so unsorted orders
+    are rejected right away, unsorted barcodes once their first unsorted chunk is read.
+
+    :param chunksize: int, amount of rows read at once.
+    :return: PipelineResponse with the vouchers and summary, the input frames are not kept.
+    :raises NotSorted: an input is not sorted by order_id, nothing has been written yet.
+    """
+    metrics = metrics or Metrics()
+    chunksize = chunksize or _DEFAULT_CHUNKSIZE
+
+    if not silent:
+        pretty_print(
+            "Sorted Merge - Memory Is Not Bounded",
+            [
+                "The barcode values and all the vouchers are kept in memory to sort them by customer_id,",
+                "run the streaming mode (max_memory) for inputs that do not fit",
+            ],
+        )
+
+    head_chunks: Iterator[pd.DataFrame] = extract_chunks(
+        orders_filepath, chunksize, ORDERS
+    )
+    df_head: Optional[pd.DataFrame] = next(head_chunks, None)
+    head_chunks.close()
+
+    if df_head is not None and not _is_sorted(df_head["order_id"].dropna().to_numpy()):
+        raise NotSorted(f"{orders_filepath} is not sorted by order_id")
+
+    del df_head
+
+    with tempfile.TemporaryDirectory(prefix="etl_vouchers.") as folder:
+        with metrics.span("validate.barcodes") as it:
+            barcodes: SortedBarcodes = SortedBarcodes.extract(
+                barcodes_filepath, f"{folder}/", chunksize, validation_backend
+            )
+            it.rows_in = sum(barcodes.stats.values())
+            it.rows_out = barcodes.stats["rows"]
+            it.dropped = barcodes.dropped
+
+        stats: Dict[str, int] = {"orders": 0}
+
+        with metrics.span("transform") as it:
+            with metrics.span("merge") as merge_span:
+                parts: List[Vouchers] = list(
+                    merge_sorted(
+                        orders_filepath,
+                        barcodes,
+                        allow_useless_vouchers=allow_useless_vouchers,
+                        chunksize=chunksize,
+                        silent=silent,
+                        validation_backend=validation_backend,
+                        stats=stats,
+                    )
+                )
+                vouchers: Vouchers = (
+                    Vouchers.concat(parts)
+                    if parts
+                    else Vouchers(
+                        customer_ids=np.empty(0, dtype=np.int64),
+                        order_ids=np.empty(0, dtype=np.int64),
+                        offsets=np.zeros(1, dtype=np.int64),
+                        barcodes=np.empty(0, dtype=np.int64),
+                    )
+                )
+                del parts
+                merge_span.rows_in = stats["orders"] + barcodes.stats["rows"]
+                merge_span.rows_out = len(vouchers)
+
+            with metrics.span("aggregate", rows_in=len(vouchers)) as aggregate_span:
+                vouchers = _sort_vouchers(vouchers)
+                aggregate_span.rows_out = len(vouchers)
+
+            it.rows_out = len(vouchers)
+
+    if not silent and barcodes.dropped:
+        pretty_print(
+            "Barcodes Validator - Sorted Merge",
+            [
+                f"Dropped {barcodes.stats['duplicates']} duplicated barcodes",
+                f"Dropped {barcodes.stats['nulls']} orders without barcodes",
+            ],
+        )
+
+    file_path: Optional[str] = None
+
+    if not transform_only:
+        with metrics.span("load", rows_in=len(vouchers)) as it:
+            file_path = _load(
+                vouchers, dest_path, fmt=output_format, compression=compression
+            )
+            it.rows_out = len(vouchers)
+
+    return PipelineResponse(
+        df_orders=None,
+        df_barcodes=None,
+        df_vouchers=vouchers.to_frame(),
+        output_filepath=file_path,
+        summary=PipelineSummary(
+            orders=stats["orders"],
+            barcodes=barcodes.stats["rows"],
+            vouchers=len(vouchers),
+        ),
+        metrics=metrics,
+        vouchers=vouchers,
+    )
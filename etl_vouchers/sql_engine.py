@@ -0,0 +1,542 @@
+import importlib.util
+import json
+import os
+import sqlite3
+import tempfile
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from etl_vouchers.etl import (
+    PipelineResponse,
+    PipelineSummary,
+    _aggregate_barcodes,
+    extract_chunks,
+)
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.expectations import NATIVE_BACKEND
+from etl_vouchers.formats import CSV
+from etl_vouchers.metrics import Metrics
+from etl_vouchers.schema import BARCODES, ORDERS
+from etl_vouchers.utils import pretty_print
+from etl_vouchers.validator import (
+    SAMPLE_SIZE,
+    BarcodesValidator,
+    OrdersValidator,
+    _with_rest,
+)
+from etl_vouchers.writer import VouchersWriter
+
+SQLITE_ENGINE: str = "sqlite"
+DUCKDB_ENGINE: str = "duckdb"
+# duckdb when it is installed, sqlite otherwise
+SQL_ENGINE: str = "sql"
+
+SQL_ENGINES = (SQL_ENGINE, SQLITE_ENGINE, DUCKDB_ENGINE)
+
+SCHEMA_VERSION: int = 1
+
+_CHUNKSIZE: int = 500_000
+
+# seq keeps the file order of the rows, so the barcodes of a voucher come in the same order as in memory
+_TABLES: Dict[str, str] = {
+    "orders": "CREATE TABLE orders (seq BIGINT, customer_id BIGINT, order_id BIGINT)",
+    "barcodes": (
+        "CREATE TABLE barcodes (seq BIGINT, barcode BIGINT, order_id BIGINT, valid BOOLEAN)"
+    ),
+    "inputs": "CREATE TABLE inputs (inputs TEXT, stats TEXT)",
+}
+
+_INDEXES: List[str] = [
+    "CREATE INDEX orders_customer ON orders (customer_id, order_id, seq)",
+    "CREATE INDEX barcodes_order ON barcodes (order_id, seq)",
+]
+
+_DUPLICATES: str = "SELECT barcode FROM duplicates"
+
+
+def duckdb_available() -> bool:
+    return importlib.util.find_spec("duckdb") is not None
+
+
+class SQLEngine:
+    """
+    Runs the pipeline inside of an embedded SQLite database instead of pandas frames.
+
+    The inputs are bulk-loaded chunk by chunk, barcode rules are evaluated as SQL and the invalid rows
+    are only flagged, so statistics over the raw barcodes can run against the same tables.
+    The left join, the useless vouchers filter and the ordering run on indexes, the result is fetched
+    in batches and every batch is aggregated into vouchers, so only a batch is in memory at once.
+
+    A database file is reused by later runs as long as the inputs and the validation backend are the same.
+
+    :param database - path to the database file.
+    """
+
+    name: str = SQLITE_ENGINE
+    errors = (sqlite3.Error,)
+    indexes: List[str] = _INDEXES
+
+    def __init__(self, database: str):
+        self.database: str = database
+        self.connection = self._connect(database)
+
+    def __enter__(self) -> "SQLEngine":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def _connect(self, database: str):
+        connection = sqlite3.connect(database)
+        # a half-loaded database has no input state and is loaded again, so durability is not needed
+        connection.execute("PRAGMA journal_mode = MEMORY")
+        connection.execute("PRAGMA synchronous = OFF")
+
+        return connection
+
+    def _insert(self, table: str, df: pd.DataFrame) -> None:
+        self.connection.executemany(
+            f"INSERT INTO {table} VALUES ({', '.join('?' * len(df.columns))})",
+            zip(*(df[it].to_numpy(dtype=object, na_value=None) for it in df.columns)),
+        )
+
+    def _scalar(self, query: str):
+        return self.connection.execute(query).fetchone()[0]
+
+    def _column(self, query: str) -> List:
+        return [it[0] for it in self.connection.execute(query).fetchall()]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _inputs(
+        self, orders_filepath: str, barcodes_filepath: str, validation_backend: str
+    ) -> Dict:
+        """
+        :return: dict that identifies the loaded inputs - their paths, sizes and mtimes and the validation backend.
+        """
+        state: Dict = {"version": SCHEMA_VERSION, "backend": validation_backend}
+
+        for name, filepath in (
+            ("orders", orders_filepath),
+            ("barcodes", barcodes_filepath),
+        ):
+            try:
+                stat: os.stat_result = os.stat(filepath)
+            except OSError as e:
+                raise InvalidSourceFile(f"Can not read file {filepath}: {str(e)}")
+
+            state[name] = [os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns]
+
+        return state
+
+    def _loaded_stats(self, inputs: Dict) -> Optional[Dict]:
+        """
+        :return: stats of the previous load, None if the database does not hold the same inputs.
+        """
+        try:
+            row = self.connection.execute("SELECT inputs, stats FROM inputs").fetchone()
+        except self.errors:
+            return None
+
+        if row is None or json.loads(row[0]) != inputs:
+            return None
+
+        return json.loads(row[1])
+
+    def load_inputs(
+        self,
+        orders_filepath: str,
+        barcodes_filepath: str,
+        silent: bool = False,
+        validation_backend: str = NATIVE_BACKEND,
+        chunksize: int = _CHUNKSIZE,
+        metrics: Optional[Metrics] = None,
+    ) -> Dict:
+        """
+        Loads and validates the inputs, unless the database already holds them.
+
+        :return: dict with amount of valid orders and barcodes and the rows dropped by every barcodes rule.
+        """
+        metrics = metrics or Metrics()
+        inputs: Dict = self._inputs(
+            orders_filepath, barcodes_filepath, validation_backend
+        )
+
+        with metrics.span("cache.database") as it:
+            stats: Optional[Dict] = self._loaded_stats(inputs)
+
+            if stats is not None:
+                it.rows_out = stats["orders"] + stats["barcodes"]
+                return stats
+
+        for table in _TABLES:
+            self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+            self.connection.execute(_TABLES[table])
+
+        with metrics.span("extract.orders") as it:
+            it.rows_out = self._load_orders(
+                orders_filepath, silent, validation_backend, chunksize
+            )
+
+        with metrics.span("extract.barcodes") as it:
+            it.rows_out = self._load_barcodes(
+                barcodes_filepath, validation_backend, chunksize
+            )
+
+        with metrics.span("validate.barcodes", rows_in=it.rows_out) as it:
+            dropped: Dict[str, int] = self._validate_barcodes(silent)
+            it.dropped = dropped
+            it.rows_out = self._scalar("SELECT COUNT(*) FROM barcodes WHERE valid")
+
+        with metrics.span("index"):
+            for index in self.indexes:
+                self.connection.execute(index)
+
+        stats = {
+            "orders": self._scalar("SELECT COUNT(*) FROM orders"),
+            "barcodes": it.rows_out,
+            "dropped": dropped,
+        }
+        # written last, a database without it is loaded again
+        self.connection.execute(
+            "INSERT INTO inputs VALUES (?, ?)", [json.dumps(inputs), json.dumps(stats)]
+        )
+        self.connection.commit()
+
+        return stats
+
+    def _load_orders(
+        self,
+        orders_filepath: str,
+        silent: bool,
+        validation_backend: str,
+        chunksize: int,
+    ) -> int:
+        rows: int = 0
+
+        for df_chunk in extract_chunks(orders_filepath, chunksize, ORDERS):
+            df_chunk = OrdersValidator(
+                df_chunk, silent=silent, backend=validation_backend
+            )()
+            self._insert(
+                "orders",
+                pd.DataFrame(
+                    {
+                        "seq": range(rows, rows + len(df_chunk)),
+                        "customer_id": df_chunk["customer_id"].to_numpy(),
+                        "order_id": df_chunk["order_id"].to_numpy(),
+                    }
+                ),
+            )
+            rows += len(df_chunk)
+
+        return rows
+
+    def _load_barcodes(
+        self, barcodes_filepath: str, validation_backend: str, chunksize: int
+    ) -> int:
+        rows: int = 0
+
+        for df_chunk in extract_chunks(barcodes_filepath, chunksize, BARCODES):
+            if not BarcodesValidator(
+                df_chunk, silent=True, backend=validation_backend
+            ).has_expected_format():
+                raise InvalidSourceFile(
+                    "Barcode csv file has to contain 2 columns - barcode, order_id"
+                )
+
+            self._insert(
+                "barcodes",
+                pd.DataFrame(
+                    {
+                        "seq": range(rows, rows + len(df_chunk)),
+                        "barcode": df_chunk["barcode"].array,
+                        "order_id": df_chunk["order_id"].array,
+                        "valid": True,
+                    }
+                ),
+            )
+            rows += len(df_chunk)
+
+        return rows
+
+    def _validate_barcodes(self, silent: bool) -> Dict[str, int]:
+        """
+        Same rules as BarcodesValidator: every copy of a duplicated barcode and rows without a barcode are invalid.
+        """
+        dropped: Dict[str, int] = {}
+        self.connection.execute(
+            "CREATE TEMP TABLE duplicates AS SELECT barcode FROM barcodes "
+            "WHERE barcode IS NOT NULL GROUP BY barcode HAVING COUNT(*) > 1"
+        )
+        duplicates: int = self._scalar(
+            f"SELECT COUNT(*) FROM barcodes WHERE barcode IN ({_DUPLICATES})"
+        )
+        nulls: int = self._scalar("SELECT COUNT(*) FROM barcodes WHERE barcode IS NULL")
+
+        if duplicates:
+            dropped["duplicate_barcodes"] = duplicates
+
+            if not silent:
+                pretty_print(
+                    "Barcodes Validator - No Barcode Duplicates",
+                    [
+                        "Next barcodes are duplicated",
+                        *_with_rest(
+                            self._column(
+                                f"SELECT barcode FROM barcodes WHERE barcode IN ({_DUPLICATES}) "
+                                f"GROUP BY barcode ORDER BY MIN(seq) LIMIT {SAMPLE_SIZE}"
+                            ),
+                            self._scalar("SELECT COUNT(*) FROM duplicates"),
+                        ),
+                    ],
+                )
+
+        if nulls:
+            dropped["orders_without_barcodes"] = nulls
+
+            if not silent:
+                pretty_print(
+                    "Barcodes Validator - No Orders Without Barcodes",
+                    [
+                        "Next orders don't have barcodes",
+                        *_with_rest(
+                            self._column(
+                                "SELECT order_id FROM barcodes WHERE barcode IS NULL "
+                                f"GROUP BY order_id ORDER BY MIN(seq) LIMIT {SAMPLE_SIZE}"
+                            ),
+                            self._scalar(
+                                "SELECT COUNT(*) FROM (SELECT DISTINCT order_id FROM barcodes "
+                                "WHERE barcode IS NULL) d"
+                            ),
+                        ),
+                    ],
+                )
+
+        if dropped:
+            self.connection.execute(
+                "UPDATE barcodes SET valid = FALSE "
+                f"WHERE barcode IS NULL OR barcode IN ({_DUPLICATES})"
+            )
+
+        self.connection.execute("DROP TABLE duplicates")
+
+        return dropped
+
+    def _fetch(self, query: str, columns: List[str], batch_size: int):
+        cursor = self.connection.execute(query)
+
+        while True:
+            rows: List = cursor.fetchmany(batch_size)
+
+            if not rows:
+                break
+
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+    def vouchers(
+        self, allow_useless_vouchers: bool = True, batch_size: int = _CHUNKSIZE
+    ) -> Iterator[pd.DataFrame]:
+        """
+        :return: iterator over voucher frames sorted by customer_id and order_id, same as etl._transform returns.
+        """
+        query: str = (
+            "SELECT o.customer_id, o.order_id, b.barcode FROM orders o "
+            "LEFT JOIN barcodes b ON b.order_id = o.order_id AND b.valid "
+            f"{'' if allow_useless_vouchers else 'WHERE b.barcode IS NOT NULL '}"
+            "ORDER BY o.customer_id, o.order_id, o.seq, b.seq"
+        )
+        df_rest: Optional[pd.DataFrame] = None
+
+        for df_rows in self._fetch(
+            query, ["customer_id", "order_id", "barcode"], batch_size
+        ):
+            if df_rest is not None:
+                df_rows = pd.concat([df_rest, df_rows], ignore_index=True)
+
+            # the last voucher of a batch may continue in the next one
+            is_last: pd.Series = (
+                df_rows["customer_id"] == df_rows["customer_id"].iat[-1]
+            ) & (df_rows["order_id"] == df_rows["order_id"].iat[-1])
+            df_rest = df_rows[is_last]
+
+            if not is_last.all():
+                yield _aggregate_barcodes(df_rows[~is_last])
+
+        if df_rest is not None:
+            yield _aggregate_barcodes(df_rest)
+
+    def top_customers(self, top: int = 5) -> pd.DataFrame:
+        """
+        Same as statistic.top_k over statistic.count_tickets.
+
+        :return: pd.DataFrame with customer_id and amount_of_tickets columns.
+        """
+        return next(
+            self._fetch(
+                "SELECT customer_id, COUNT(*) AS amount_of_tickets "
+                "FROM (SELECT DISTINCT customer_id, order_id FROM orders) t "
+                "GROUP BY customer_id ORDER BY amount_of_tickets DESC, customer_id "
+                f"LIMIT {int(top)}",
+                ["customer_id", "amount_of_tickets"],
+                max(int(top), 1),
+            ),
+            pd.DataFrame(
+                {
+                    "customer_id": pd.Series(dtype="int64"),
+                    "amount_of_tickets": pd.Series(dtype="int64"),
+                }
+            ),
+        )
+
+    def unused_barcodes(self) -> pd.DataFrame:
+        """
+        Same as VoucherStatistic.unused_barcodes, the raw barcodes without an order in the file order.
+
+        :return: pd.DataFrame with barcode and order_id columns.
+        """
+        rows: List = self.connection.execute(
+            "SELECT barcode FROM barcodes WHERE order_id IS NULL ORDER BY seq"
+        ).fetchall()
+
+        return pd.DataFrame(
+            {
+                "barcode": pd.array([it[0] for it in rows], dtype="Int64"),
+                "order_id": pd.array([None] * len(rows), dtype="Int64"),
+            }
+        )
+
+
+class DuckDBEngine(SQLEngine):
+    """
+    SQLEngine on top of DuckDB, the chunks are inserted straight from the frames.
+    """
+
+    name: str = DUCKDB_ENGINE
+    # joins and sorts of duckdb do not use indexes, building them only costs time
+    indexes: List[str] = []
+
+    def _connect(self, database: str):
+        try:
+            import duckdb
+        except ImportError:
+            raise ETLVouchersException("duckdb engine requires duckdb to be installed")
+
+        self.errors = (duckdb.Error,)
+
+        return duckdb.connect(database)
+
+    def _insert(self, table: str, df: pd.DataFrame) -> None:
+        self.connection.register("chunk", df)
+
+        try:
+            self.connection.execute(f"INSERT INTO {table} SELECT * FROM chunk")
+        finally:
+            self.connection.unregister("chunk")
+
+
+def sql_engine(engine: str, database: str) -> SQLEngine:
+    """
+    :param engine: sql (duckdb when it is installed, sqlite otherwise), sqlite or duckdb.
+    :param database: path to the database file.
+    :return: connected SQLEngine
+    """
+    if engine == SQL_ENGINE:
+        engine = DUCKDB_ENGINE if duckdb_available() else SQLITE_ENGINE
+
+    if engine == SQLITE_ENGINE:
+        return SQLEngine(database)
+
+    if engine == DUCKDB_ENGINE:
+        return DuckDBEngine(database)
+
+    raise ETLVouchersException(f"Unknown engine {engine}")
+
+
+def sql_pipeline(
+    orders_filepath: str,
+    barcodes_filepath: str,
+    dest_path: str = None,
+    transform_only: bool = False,
+    silent: bool = False,
+    allow_useless_vouchers: bool = True,
+    engine: str = SQL_ENGINE,
+    database: Optional[str] = None,
+    validation_backend: str = NATIVE_BACKEND,
+    output_format: str = CSV,
+    compression: Optional[str] = None,
+    metrics: Optional[Metrics] = None,
+) -> PipelineResponse:
+    """
+    Version of etl.pipeline that runs in an embedded database, see SQLEngine.
+
+    :param orders_filepath: filepath to the csv with orders.
+    :param barcodes_filepath: filepath to the csv with barcodes data.
+    :param dest_path: path under which the output file is stored.
+    :param transform_only: bool, if true, the output file will not be generated.
+    :param silent: bool, if true, all the output to stdout will be suppressed.
+    :param allow_useless_vouchers: bool, if true, vouchers without barcodes will be generated as well.
+    :param engine: str, sql, sqlite or duckdb.
+    :param database: path to the database file that is kept for later runs, a temporary one by default.
+    :param validation_backend: str, "native" or "great_expectations".
+    :param output_format: str, format of the output file, csv, parquet or feather.
+    :param compression: str, compression codec of the output file, None - format default.
+    :param metrics: Metrics the stage spans are recorded into, a new one by default.
+    :return: PipelineResponse with summary and metrics only.
+    """
+    metrics = metrics or Metrics()
+
+    with tempfile.TemporaryDirectory(prefix="etl_vouchers.") as folder:
+        with sql_engine(
+            engine, database or os.path.join(folder, "etl_vouchers.db")
+        ) as store:
+            stats: Dict = store.load_inputs(
+                orders_filepath,
+                barcodes_filepath,
+                silent=silent,
+                validation_backend=validation_backend,
+                metrics=metrics,
+            )
+
+            file_path: Optional[str] = None
+            vouchers: int = 0
+
+            # vouchers are aggregated batch by batch while they are written
+            with metrics.span("load", rows_in=stats["orders"]) as it:
+                writer: Optional[VouchersWriter] = (
+                    None
+                    if transform_only
+                    else VouchersWriter(
+                        dest_path, fmt=output_format, compression=compression
+                    )
+                )
+
+                try:
+                    for df_vouchers in store.vouchers(allow_useless_vouchers):
+                        vouchers += len(df_vouchers)
+
+                        if writer is not None:
+                            writer.write(df_vouchers)
+                except BaseException:
+                    if writer is not None:
+                        writer.abort()
+
+                    raise
+
+                if writer is not None:
+                    file_path = writer.close()
+
+                it.rows_out = vouchers
+
+    return PipelineResponse(
+        df_orders=None,
+        df_barcodes=None,
+        df_vouchers=None,
+        output_filepath=file_path,
+        summary=PipelineSummary(
+            orders=stats["orders"], barcodes=stats["barcodes"], vouchers=vouchers
+        ),
+        metrics=metrics,
+    )
@@ -1,49 +1,234 @@
-from dataclasses import dataclass
-from typing import List
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Iterator, List, Optional, Sequence
+import numpy as np
 import pandas as pd
 
-from etl_vouchers.etl import pipeline, extract
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.etl import (
+    PANDAS_ENGINE,
+    InputCache,
+    PipelineResponse,
+    extract_chunks,
+    pipeline,
+)
+from etl_vouchers.schema import BARCODES, ORDERS
+from etl_vouchers.validator import OrdersValidator
 from etl_vouchers.utils import pretty_print
 
+ETL_REPORT: str = "etl"
+TOP_CUSTOMERS_REPORT: str = "top_customers"
+UNUSED_BARCODES_REPORT: str = "unused_barcodes"
+
+REPORTS: Sequence[str] = (ETL_REPORT, TOP_CUSTOMERS_REPORT, UNUSED_BARCODES_REPORT)
+
+
+def count_tickets(df_orders: pd.DataFrame) -> pd.Series:
+    """
+    Every order is a voucher (ticket), so tickets are counted without running the transform.
+
+    :param df_orders: validated orders.
+    :return: pd.Series, amount of tickets indexed by customer_id.
+    """
+    return (
+        df_orders.drop_duplicates(subset=["customer_id", "order_id"])["customer_id"]
+        .value_counts(sort=False)
+        .astype(np.int64)
+    )
+
+
+def count_tickets_streaming(orders_filepath: str, chunksize: int) -> pd.Series:
+    """
+    Same as count_tickets, but the orders are streamed chunk by chunk, only the counters are kept in memory.
+    Duplicated orders are only dropped within a chunk, order ids are expected to be unique.
+
+    :param orders_filepath: path to the orders file.
+    :param chunksize: amount of rows read at once.
+    :return: pd.Series, amount of tickets indexed by customer_id.
+    """
+    tickets: pd.Series = pd.Series([], dtype=np.int64)
+
+    for df_chunk in extract_chunks(orders_filepath, chunksize, ORDERS):
+        df_chunk = OrdersValidator(df_chunk, silent=True)()
+        tickets = tickets.add(count_tickets(df_chunk), fill_value=0)
+
+    return tickets.astype(np.int64)
+
+
+def top_k(tickets: pd.Series, k: int) -> pd.DataFrame:
+    """
+    Picks the k customers with the most tickets without sorting all of them.
+
+    The k-th largest amount is found with a partial selection, only the customers that reach it are sorted.
+    Ties are broken by customer_id, ascending.
+
+    :param tickets: pd.Series, amount of tickets indexed by customer_id.
+    :param k: amount of customers.
+    :return: pd.DataFrame with customer_id and amount_of_tickets columns.
+    """
+    customers: np.ndarray = tickets.index.to_numpy()
+    amounts: np.ndarray = tickets.to_numpy()
+    k = max(min(k, len(amounts)), 0)
+
+    if k == 0:
+        candidates: np.ndarray = np.array([], dtype=np.int64)
+    elif k < len(amounts):
+        kth: int = np.partition(amounts, len(amounts) - k)[len(amounts) - k]
+        candidates = np.flatnonzero(amounts >= kth)
+    else:
+        candidates = np.arange(len(amounts))
+
+    winners: np.ndarray = candidates[
+        np.lexsort((customers[candidates], -amounts[candidates]))[:k]
+    ]
+
+    return pd.DataFrame(
+        {"customer_id": customers[winners], "amount_of_tickets": amounts[winners]}
+    )
+
+
+@dataclass
+class StatisticReport:
+    """
+    Results of VoucherStatistic.report, None for the reports that were not requested.
+    """
+
+    pipeline: Optional[PipelineResponse] = None
+    top_customers: Optional[pd.DataFrame] = None
+    unused_barcodes: Optional[pd.DataFrame] = None
+
 
 @dataclass
 class VoucherStatistic:
     """
     Statistic dataclass for vouchers, responsible for data analysis and sending the results to stdout.
+
+    All the statistics of an instance share one InputCache,
+    so every input file is extracted and validated only once.
+    If index_path is supplied, unused barcodes are read from the barcode index
+    in that folder, it is built on the first run and whenever the barcodes file changes.
+    With any engine but pandas, the inputs are loaded into an embedded database and the statistics
+    are queried from it, see etl_vouchers.sql_engine.SQLEngine. The database is kept for later runs
+    over the same inputs if database is supplied, a temporary one is used otherwise.
     """
 
     orders_filepath: str
     barcodes_filepath: str
+    cache: InputCache = field(default_factory=InputCache, repr=False, compare=False)
+    index_path: Optional[str] = None
+    engine: str = PANDAS_ENGINE
+    database: Optional[str] = None
 
-    def top_customers(self, top=5):
-        df_vouchers = pipeline(
-            self.orders_filepath,
-            self.barcodes_filepath,
-            transform_only=True,
-            silent=True,
-        ).df_vouchers
-
-        df_resp: pd.DataFrame = (
-            df_vouchers.groupby(["customer_id"])
-            .agg({"order_id": "count"})
-            .reset_index()
-            .rename(columns={"order_id": "amount_of_tickets"})
-            .sort_values(by=["amount_of_tickets"], ascending=False)[:top]
-        )
+    def __post_init__(self):
+        from etl_vouchers.sql_engine import SQL_ENGINES
+
+        if self.engine != PANDAS_ENGINE and self.engine not in SQL_ENGINES:
+            raise ETLVouchersException(
+                f"Unknown engine {self.engine}, available: {[PANDAS_ENGINE, *SQL_ENGINES]}"
+            )
+
+        if self.engine != PANDAS_ENGINE and self.index_path is not None:
+            raise ETLVouchersException(
+                "The barcode index is only supported by the pandas engine"
+            )
+
+    @contextmanager
+    def _sql_store(self) -> Iterator:
+        """
+        :return: context manager of the SQLEngine with both inputs loaded.
+        """
+        from etl_vouchers.sql_engine import sql_engine
+
+        with tempfile.TemporaryDirectory(prefix="etl_vouchers.") as folder:
+            database: str = self.database or os.path.join(folder, "vouchers.db")
 
-        rows: List[str] = [
-            f"{it.customer_id}, {it.amount_of_tickets}" for _, it in df_resp.iterrows()
-        ]
+            with sql_engine(self.engine, database) as store:
+                store.load_inputs(
+                    self.orders_filepath, self.barcodes_filepath, silent=True
+                )
+                yield store
+
+    def top_customers(
+        self, top=5, chunksize: Optional[int] = None, approx: bool = False
+    ):
+        """
+        Top customers by amount of tickets (vouchers), counted straight from the orders.
+
+        :param top: amount of customers.
+        :param chunksize: if supplied, the orders are streamed chunk by chunk instead of loaded at once.
+        :param approx: bool, if true, the orders are streamed into sketches within fixed memory,
+        the amounts are upper estimates, see etl_vouchers.sketches.
+        :return: pd.DataFrame with customer_id and amount_of_tickets columns.
+        """
+        if self.engine != PANDAS_ENGINE:
+            if chunksize is not None or approx:
+                raise ETLVouchersException(
+                    "Streamed and approximate top customers are only supported by the pandas engine"
+                )
+
+            with self._sql_store() as store:
+                df_resp: pd.DataFrame = store.top_customers(top)
+        elif approx:
+            from etl_vouchers.sketches import sketch_files
+
+            df_resp = sketch_files(
+                [self.orders_filepath], chunksize=chunksize
+            ).top_customers(top)
+        else:
+            if chunksize is None:
+                df_orders: pd.DataFrame = self.cache.validated(
+                    self.orders_filepath, ORDERS, OrdersValidator, silent=True
+                )
+                tickets: pd.Series = count_tickets(df_orders)
+            else:
+                tickets = count_tickets_streaming(self.orders_filepath, chunksize)
+
+            df_resp = top_k(tickets, top)
+
+        rows: List[str] = (
+            df_resp["customer_id"].astype(str)
+            + ", "
+            + df_resp["amount_of_tickets"].astype(str)
+        ).tolist()
 
         pretty_print(
-            f"BONUS - Top {top} Customers", ["customer_id, amount_of_tickets", *rows]
+            f"BONUS - Top {top} Customers{' (approximate)' if approx else ''}",
+            ["customer_id, amount_of_tickets", *rows],
         )
 
         return df_resp
 
+    def _indexed_unused_barcodes(self) -> pd.DataFrame:
+        from etl_vouchers.barcode_index import ensure_index
+
+        barcodes: np.ndarray = ensure_index(
+            self.barcodes_filepath, self.index_path
+        ).unused()
+
+        return pd.DataFrame(
+            {
+                "barcode": pd.Series(barcodes, dtype="Int64"),
+                "order_id": pd.Series(pd.NA, index=range(len(barcodes)), dtype="Int64"),
+            }
+        )
+
     def unused_barcodes(self):
-        df_barcodes = extract(self.barcodes_filepath)
-        df_resp: pd.DataFrame = df_barcodes[df_barcodes["order_id"].isna()]
+        """
+        Barcodes without an order. Read from the barcode index, if index_path is supplied:
+        sorted by barcode and without the rows that miss the barcode as well.
+
+        :return: pd.DataFrame with barcode and order_id columns.
+        """
+        if self.engine != PANDAS_ENGINE:
+            with self._sql_store() as store:
+                df_resp: pd.DataFrame = store.unused_barcodes()
+        elif self.index_path is None:
+            df_barcodes = self.cache.extract(self.barcodes_filepath, BARCODES)
+            df_resp = df_barcodes[df_barcodes["order_id"].isna()]
+        else:
+            df_resp = self._indexed_unused_barcodes()
 
         num: int = len(df_resp)
         multi: bool = num > 1
@@ -58,3 +243,57 @@ class VoucherStatistic:
         )
 
         return df_resp
+
+    def report(
+        self,
+        reports: Sequence[str] = REPORTS,
+        top: int = 5,
+        dest_path: Optional[str] = None,
+        allow_useless_vouchers: bool = False,
+        silent: bool = False,
+    ) -> StatisticReport:
+        """
+        Runs the ETL and all the requested statistics over a single extraction of the inputs.
+
+        :param reports: subset of REPORTS - etl, top_customers, unused_barcodes.
+        :param top: amount of customers in the top_customers report.
+        :param dest_path: path under which the ETL output file is stored.
+        :param allow_useless_vouchers: bool, if true, the ETL output contains vouchers without barcodes.
+        :param silent: bool, if true, validation output is suppressed.
+        :return: StatisticReport
+        """
+        unknown: List[str] = [it for it in reports if it not in REPORTS]
+
+        if unknown:
+            raise ETLVouchersException(
+                f"Unknown reports {unknown}, available: {list(REPORTS)}"
+            )
+
+        if self.engine != PANDAS_ENGINE and self.database is None:
+            # one temporary database for the etl and all the statistics
+            with tempfile.TemporaryDirectory(prefix="etl_vouchers.") as folder:
+                return replace(
+                    self, database=os.path.join(folder, "vouchers.db")
+                ).report(reports, top, dest_path, allow_useless_vouchers, silent)
+
+        result: StatisticReport = StatisticReport()
+
+        if ETL_REPORT in reports:
+            result.pipeline = pipeline(
+                self.orders_filepath,
+                self.barcodes_filepath,
+                dest_path,
+                silent=silent,
+                allow_useless_vouchers=allow_useless_vouchers,
+                cache=self.cache if self.engine == PANDAS_ENGINE else None,
+                engine=self.engine,
+                database=self.database,
+            )
+
+        if TOP_CUSTOMERS_REPORT in reports:
+            result.top_customers = self.top_customers(top=top)
+
+        if UNUSED_BARCODES_REPORT in reports:
+            result.unused_barcodes = self.unused_barcodes()
+
+        return result
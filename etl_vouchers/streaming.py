@@ -0,0 +1,516 @@
+import math
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.etl import (
+    PipelineResponse,
+    PipelineSummary,
+    _aggregate_barcodes,
+    extract_chunks,
+)
+from etl_vouchers.exceptions import InvalidSourceFile
+from etl_vouchers.expectations import NATIVE_BACKEND
+from etl_vouchers.formats import CSV
+from etl_vouchers.metrics import Metrics
+from etl_vouchers.schema import BARCODES, ORDERS
+from etl_vouchers.utils import pretty_print
+from etl_vouchers.validator import BarcodesValidator, OrdersValidator
+from etl_vouchers.writer import VouchersWriter
+
+# Rough in-memory footprint of a parsed row, including pandas overhead and the
+# temporary copies made by merge/sort. Used to turn the memory ceiling into
+# chunk and partition sizes.
+_BYTES_PER_ROW: int = 256
+
+# How many bytes of memory one byte of csv input costs once it is parsed, joined and grouped.
+_CSV_INFLATION: int = 8
+
+_DEFAULT_CHUNKSIZE: int = 1_000_000
+
+# Amount of customer ids sampled out of every chunk, the ranges of the output partitions are their quantiles.
+_SAMPLE_ROWS: int = 1000
+
+_SPILL_DTYPES: Dict[str, str] = {
+    "customer_id": "int64",
+    "order_id": "Int64",
+    "barcode": "Int64",
+    "seq": "Int64",
+    "order_seq": "int64",
+}
+
+
+class SpillFiles:
+    """
+    A set of csv files in a temporary folder, rows are appended to a partition by id.
+
+    :param folder - folder where the partition files are created.
+    :param name - prefix of the partition files.
+    :param partitions - amount of partitions.
+    """
+
+    def __init__(self, folder: str, name: str, partitions: int):
+        self.folder: str = folder
+        self.name: str = name
+        self.partitions: int = partitions
+        self.paths: List[str] = [
+            os.path.join(folder, f"{name}.{it}.csv") for it in range(partitions)
+        ]
+        self.rows: List[int] = [0] * partitions
+
+    def append(self, df: pd.DataFrame, partition_ids: np.ndarray) -> None:
+        for partition_id, df_part in df.groupby(partition_ids, sort=False):
+            path: str = self.paths[partition_id]
+            df_part.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+            self.rows[partition_id] += len(df_part)
+
+    @staticmethod
+    def _astype(df: pd.DataFrame) -> pd.DataFrame:
+        return df.astype(
+            {col: dtype for col, dtype in _SPILL_DTYPES.items() if col in df.columns}
+        )
+
+    def read(self, partition_id: int) -> Optional[pd.DataFrame]:
+        path: str = self.paths[partition_id]
+
+        if not os.path.exists(path):
+            return None
+
+        return self._astype(pd.read_csv(path))
+
+    def read_chunks(self, partition_id: int, chunksize: int) -> Iterator[pd.DataFrame]:
+        with pd.read_csv(self.paths[partition_id], chunksize=chunksize) as reader:
+            for df_chunk in reader:
+                yield self._astype(df_chunk)
+
+    def drop(self, partition_id: int) -> None:
+        path: str = self.paths[partition_id]
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        self.rows[partition_id] = 0
+
+
+def _hash_partition(values: pd.Series, partitions: int) -> np.ndarray:
+    # hash the int64 representation, so e.g. int64 and nullable Int64 keys agree
+    hashes: np.ndarray = pd.util.hash_array(values.to_numpy(dtype=np.int64))
+
+    return (hashes % partitions).astype(np.int64)
+
+
+def _sample(values: pd.Series, rows: int) -> np.ndarray:
+    """
+    :return: every n-th of the values, about rows / chunk of them, so every chunk is sampled at the same rate.
+    """
+    return values.to_numpy(dtype=np.int64)[:: max(rows // _SAMPLE_ROWS, 1)]
+
+
+def _range_bounds(sample: np.ndarray, partitions: int) -> np.ndarray:
+    """
+    Cuts the sampled values into ranges with about the same amount of rows, so skewed
+    or outlying ids do not end up in a single partition.
+
+    :return: sorted distinct lower bounds of the partitions after the first one,
+    all greater than the smallest value, so every partition gets fewer rows than all of them.
+    """
+    if partitions < 2 or not len(sample):
+        return np.array([], dtype=np.int64)
+
+    sample = np.sort(sample)
+    bounds: np.ndarray = np.unique(
+        sample[np.arange(1, partitions) * len(sample) // partitions]
+    )
+
+    bounds = bounds[bounds > sample[0]]
+
+    if not len(bounds) and sample[-1] > sample[0]:
+        # the smallest value takes most of the rows, the rest still goes to the second partition
+        bounds = sample[np.searchsorted(sample, sample[0], "right")][None]
+
+    return bounds
+
+
+def _range_partition(values: pd.Series, bounds: np.ndarray) -> np.ndarray:
+    return np.searchsorted(bounds, values.to_numpy(), side="right").astype(np.int64)
+
+
+def plan_streaming(
+    input_bytes: int,
+    max_memory: Optional[int] = None,
+    chunksize: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Derives the chunk size and amount of spill partitions from the memory ceiling.
+
+    :param input_bytes: total size of the input files on disk.
+    :param max_memory: approximate memory ceiling in bytes, None - no ceiling.
+    :param chunksize: explicit amount of rows per chunk, overrides the derived one.
+    :return: dict with chunksize and partitions.
+    """
+    if max_memory is None:
+        return {"chunksize": chunksize or _DEFAULT_CHUNKSIZE, "partitions": 1}
+
+    if chunksize is None:
+        # a chunk is parsed while the previous one is spilled, leave room for both
+        chunksize = max(max_memory // (2 * _BYTES_PER_ROW), 1000)
+
+    partitions: int = max(math.ceil(input_bytes * _CSV_INFLATION / max_memory), 1)
+
+    return {"chunksize": chunksize, "partitions": partitions}
+
+
+def _spill_orders(
+    orders_filepath: str,
+    chunksize: int,
+    spill: SpillFiles,
+    silent: bool,
+    validation_backend: str,
+) -> Dict[str, int]:
+    """
+    Validates orders chunk by chunk and spills them partitioned by order_id hash.
+    Every row keeps its position in the file as order_seq, so repeated orders are joined
+    in the same order as by etl.pipeline.
+
+    :return: dict with amount of rows and a sample of the customer ids.
+    """
+    rows: int = 0
+    samples: List[np.ndarray] = []
+
+    for df_chunk in extract_chunks(orders_filepath, chunksize, ORDERS):
+        df_chunk = OrdersValidator(
+            df_chunk, silent=silent, backend=validation_backend
+        )()[["customer_id", "order_id"]]
+
+        if df_chunk.empty:
+            continue
+
+        df_chunk = df_chunk.assign(order_seq=np.arange(rows, rows + len(df_chunk)))
+        rows += len(df_chunk)
+        samples.append(_sample(df_chunk["customer_id"], chunksize))
+
+        spill.append(df_chunk, _hash_partition(df_chunk["order_id"], spill.partitions))
+
+    return {
+        "rows": rows,
+        "sample": np.concatenate(samples) if samples else np.array([], np.int64),
+    }
+
+
+def _spill_barcodes(
+    barcodes_filepath: str,
+    chunksize: int,
+    by_barcode: SpillFiles,
+    by_order: SpillFiles,
+    silent: bool,
+    validation_backend: str,
+) -> Dict[str, int]:
+    """
+    Validates barcodes out of core and spills the valid ones partitioned by order_id hash.
+
+    Every duplicate of a barcode lands in the same barcode-hash partition,
+    so duplicates are found exactly while only one partition is in memory.
+
+    :return: dict with amount of valid, duplicated and null barcodes.
+    """
+    stats: Dict[str, int] = {"rows": 0, "duplicates": 0, "nulls": 0}
+    seq: int = 0
+
+    for df_chunk in extract_chunks(barcodes_filepath, chunksize, BARCODES):
+        if not BarcodesValidator(
+            df_chunk, silent=True, backend=validation_backend
+        ).has_expected_format():
+            raise InvalidSourceFile(
+                "Barcode csv file has to contain 2 columns - barcode, order_id"
+            )
+
+        df_chunk = df_chunk[["barcode", "order_id"]].assign(
+            seq=np.arange(seq, seq + len(df_chunk))
+        )
+        seq += len(df_chunk)
+
+        is_null: pd.Series = df_chunk["barcode"].isna()
+        stats["nulls"] += int(is_null.sum())
+        df_chunk = df_chunk[~is_null]
+
+        by_barcode.append(
+            df_chunk, _hash_partition(df_chunk["barcode"], by_barcode.partitions)
+        )
+
+    for partition_id in range(by_barcode.partitions):
+        df_part: Optional[pd.DataFrame] = by_barcode.read(partition_id)
+
+        if df_part is None:
+            continue
+
+        validator: BarcodesValidator = BarcodesValidator(
+            df_part, silent=True, backend=validation_backend
+        )
+        df_part = validator()
+        stats["duplicates"] += validator.dropped.get("duplicate_barcodes", 0)
+        stats["rows"] += len(df_part)
+
+        # barcodes without an order never match an order in the left join
+        df_part = df_part.dropna(subset=["order_id"])
+        by_order.append(
+            df_part, _hash_partition(df_part["order_id"], by_order.partitions)
+        )
+        by_barcode.drop(partition_id)
+
+    if not silent and (stats["duplicates"] or stats["nulls"]):
+        pretty_print(
+            "Barcodes Validator - Streaming",
+            [
+                f"Dropped {stats['duplicates']} duplicated barcodes",
+                f"Dropped {stats['nulls']} orders without barcodes",
+            ],
+        )
+
+    return stats
+
+
+def _join_partitions(
+    orders: SpillFiles,
+    barcodes: SpillFiles,
+    joined: SpillFiles,
+    customer_bounds: np.ndarray,
+    allow_useless_vouchers: bool,
+) -> None:
+    """
+    Left joins every order_id partition and spills the result partitioned by customer_id range.
+    """
+    for partition_id in range(orders.partitions):
+        df_orders: Optional[pd.DataFrame] = orders.read(partition_id)
+
+        if df_orders is None:
+            continue
+
+        df_barcodes: Optional[pd.DataFrame] = barcodes.read(partition_id)
+
+        if df_barcodes is None:
+            df_barcodes = pd.DataFrame(
+                {
+                    col: pd.Series(dtype="Int64")
+                    for col in ("barcode", "order_id", "seq")
+                }
+            )
+
+        df_joined: pd.DataFrame = df_orders.merge(
+            df_barcodes, on=["order_id"], how="left"
+        )
+
+        if not allow_useless_vouchers:
+            df_joined = df_joined.dropna(subset=["barcode"])
+
+        joined.append(
+            df_joined,
+            _range_partition(df_joined["customer_id"], customer_bounds),
+        )
+        orders.drop(partition_id)
+        barcodes.drop(partition_id)
+
+
+def _split_partition(
+    joined: SpillFiles, partition_id: int, max_rows: int
+) -> Optional[SpillFiles]:
+    """
+    Splits a partition over the budget into ranges by the quantiles of a sample of its rows,
+    by order_id if all of them belong to a single customer.
+
+    :return: SpillFiles with the ranges in order, None if all the rows belong to a single voucher.
+    """
+    parts: int = math.ceil(joined.rows[partition_id] / max_rows)
+    sample: np.ndarray = np.concatenate(
+        [
+            df_chunk[["customer_id", "order_id"]].to_numpy(dtype=np.int64)[
+                :: max(max_rows // _SAMPLE_ROWS, 1)
+            ]
+            for df_chunk in joined.read_chunks(partition_id, max_rows)
+        ]
+    )
+    key: str = "customer_id" if (sample[:, 0] != sample[0, 0]).any() else "order_id"
+    bounds: np.ndarray = _range_bounds(
+        sample[:, 0 if key == "customer_id" else 1], parts
+    )
+
+    if not len(bounds):
+        return None
+
+    split = SpillFiles(joined.folder, f"{joined.name}.{partition_id}", len(bounds) + 1)
+
+    for df_chunk in joined.read_chunks(partition_id, max_rows):
+        split.append(df_chunk, _range_partition(df_chunk[key], bounds))
+
+    joined.drop(partition_id)
+
+    return split
+
+
+def _iter_vouchers(
+    joined: SpillFiles, max_rows: Optional[int] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    :param max_rows: amount of joined rows that fit the memory ceiling, larger partitions are split further.
+    :return: iterator over voucher frames, globally sorted by customer_id and order_id.
+    """
+    for partition_id in range(joined.partitions):
+        if not joined.rows[partition_id]:
+            continue
+
+        if max_rows is not None and joined.rows[partition_id] > max_rows:
+            split: Optional[SpillFiles] = _split_partition(
+                joined, partition_id, max_rows
+            )
+
+            if split is not None:
+                yield from _iter_vouchers(split, max_rows)
+                continue
+
+        # restore the orders and the barcodes file order inside of every voucher, as the merge of etl.pipeline
+        df_joined: pd.DataFrame = joined.read(partition_id).sort_values(
+            by=["order_seq", "seq"], kind="mergesort"
+        )
+
+        yield _aggregate_barcodes(df_joined)
+        joined.drop(partition_id)
+
+
+def stream_pipeline(
+    orders_filepath: str,
+    barcodes_filepath: str,
+    dest_path: str = None,
+    transform_only: bool = False,
+    silent: bool = False,
+    allow_useless_vouchers: bool = True,
+    max_memory: Optional[int] = None,
+    chunksize: Optional[int] = None,
+    spill_path: Optional[str] = None,
+    validation_backend: str = NATIVE_BACKEND,
+    output_format: str = CSV,
+    compression: Optional[str] = None,
+    metrics: Optional[Metrics] = None,
+) -> PipelineResponse:
+    """
+    Bounded-memory version of etl.pipeline.
+
+    Both inputs are read and validated chunk by chunk and spilled to temporary csv files
+    partitioned by order_id hash, every partition pair is joined on its own, and the joined
+    rows are regrouped by customer_id range so the vouchers can be written incrementally
+    in the same order etl.pipeline produces them. The ranges are quantiles of sampled
+    customer ids, and a range that still does not fit max_memory is split again when it is read.
+    Only row counts are returned.
+
+    :param orders_filepath: filepath to the csv with orders.
+    :param barcodes_filepath: filepath to the csv with barcodes data.
+    :param dest_path: path under which the output file is stored.
+    :param transform_only: bool, if true, the output file will not be generated.
+    :param silent: bool, if true, all the output to stdout will be suppressed.
+    :param allow_useless_vouchers: bool, if true, vouchers without barcodes will be generated as well.
+    :param max_memory: int, approximate memory ceiling in bytes.
+    :param chunksize: int, amount of rows read at once.
+    :param spill_path: folder for the temporary spill files, system temp folder by default.
+    :param validation_backend: str, "native" or "great_expectations".
+    :param output_format: str, format of the output file, csv, parquet or feather.
+    :param compression: str, compression codec of the output file, None - format default.
+    :param metrics: Metrics the spill, join and load spans are recorded into, a new one by default.
+    :return: PipelineResponse with summary and metrics only.
+    """
+    metrics = metrics or Metrics()
+
+    try:
+        input_bytes: int = os.path.getsize(orders_filepath) + os.path.getsize(
+            barcodes_filepath
+        )
+    except OSError as e:
+        raise InvalidSourceFile(f"Can not read file: {str(e)}")
+
+    plan: Dict[str, int] = plan_streaming(input_bytes, max_memory, chunksize)
+    partitions: int = plan["partitions"]
+
+    with tempfile.TemporaryDirectory(prefix="etl_vouchers.", dir=spill_path) as folder:
+        orders = SpillFiles(folder, "orders", partitions)
+        barcodes_by_barcode = SpillFiles(folder, "barcodes_by_barcode", partitions)
+        barcodes = SpillFiles(folder, "barcodes", partitions)
+        joined = SpillFiles(folder, "joined", partitions)
+
+        with metrics.span("spill.orders") as it:
+            orders_stats: Dict = _spill_orders(
+                orders_filepath, plan["chunksize"], orders, silent, validation_backend
+            )
+            it.rows_out = orders_stats["rows"]
+
+        with metrics.span("spill.barcodes") as it:
+            barcodes_stats: Dict[str, int] = _spill_barcodes(
+                barcodes_filepath,
+                plan["chunksize"],
+                barcodes_by_barcode,
+                barcodes,
+                silent,
+                validation_backend,
+            )
+            it.rows_out = barcodes_stats["rows"]
+            it.dropped = {
+                "duplicate_barcodes": barcodes_stats["duplicates"],
+                "orders_without_barcodes": barcodes_stats["nulls"],
+            }
+
+        if orders_stats["rows"]:
+            with metrics.span("join", rows_in=orders_stats["rows"]):
+                _join_partitions(
+                    orders,
+                    barcodes,
+                    joined,
+                    _range_bounds(orders_stats["sample"], partitions),
+                    allow_useless_vouchers,
+                )
+
+        file_path: Optional[str] = None
+        vouchers: int = 0
+
+        # vouchers are aggregated partition by partition while they are written
+        with metrics.span("load") as it:
+            writer: Optional[VouchersWriter] = (
+                None
+                if transform_only
+                else VouchersWriter(
+                    dest_path, fmt=output_format, compression=compression
+                )
+            )
+
+            try:
+                for df_vouchers in _iter_vouchers(
+                    joined,
+                    None
+                    if max_memory is None
+                    else max(max_memory // _BYTES_PER_ROW, 1),
+                ):
+                    vouchers += len(df_vouchers)
+
+                    if writer is not None:
+                        writer.write(df_vouchers)
+            except BaseException:
+                if writer is not None:
+                    writer.abort()
+
+                raise
+
+            if writer is not None:
+                file_path = writer.close()
+
+            it.rows_out = vouchers
+
+    return PipelineResponse(
+        df_orders=None,
+        df_barcodes=None,
+        df_vouchers=None,
+        output_filepath=file_path,
+        summary=PipelineSummary(
+            orders=orders_stats["rows"],
+            barcodes=barcodes_stats["rows"],
+            vouchers=vouchers,
+        ),
+        metrics=metrics,
+    )
@@ -0,0 +1,171 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.formats import CSV, PARQUET, _arrow_table, _pyarrow, file_extension
+from etl_vouchers.utils import current_time, sanitize_path
+
+
+@dataclass
+class DatasetShape:
+    """
+    Knobs of a synthetic orders/barcodes dataset.
+
+    :param orders - amount of orders.
+    :param customers - amount of distinct customers, orders / 4 by default.
+    :param barcodes_per_order - mean amount of barcodes of an order that has barcodes.
+    :param skew - overdispersion of barcodes per order, 0 - poisson, the higher the more orders
+    with many barcodes (negative binomial with the same mean).
+    :param unused_rate - amount of barcodes without an order, as a share of the assigned barcodes.
+    :param duplicate_rate - share of barcode rows that repeat a barcode of another row.
+    :param orders_without_barcodes - share of orders that do not get any barcode.
+    :param seed - seed of the random generator.
+    """
+
+    orders: int
+    customers: Optional[int] = None
+    barcodes_per_order: float = 2.0
+    skew: float = 0.0
+    unused_rate: float = 0.1
+    duplicate_rate: float = 0.001
+    orders_without_barcodes: float = 0.1
+    seed: int = 0
+
+
+def _barcodes_per_order(
+    rng: np.random.Generator, shape: DatasetShape, size: int
+) -> np.ndarray:
+    mean: float = shape.barcodes_per_order
+
+    if shape.skew <= 0:
+        counts: np.ndarray = rng.poisson(mean, size)
+    else:
+        dispersion: float = 1 / shape.skew
+        counts = rng.negative_binomial(
+            dispersion, dispersion / (dispersion + mean), size
+        )
+
+    counts[rng.random(size) < shape.orders_without_barcodes] = 0
+
+    return counts
+
+
+def generate_chunk(
+    rng: np.random.Generator,
+    shape: DatasetShape,
+    first_order: int,
+    size: int,
+    first_barcode: int,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Generates orders first_order..first_order + size and their barcodes.
+    Barcode values start at first_barcode and are unique unless duplicated on purpose.
+
+    :return: orders and barcodes frames.
+    """
+    customers: int = shape.customers or max(shape.orders // 4, 1)
+    order_ids: np.ndarray = np.arange(first_order, first_order + size, dtype=np.int64)
+    df_orders: pd.DataFrame = pd.DataFrame(
+        {"customer_id": rng.integers(0, customers, size), "order_id": order_ids}
+    )
+
+    counts: np.ndarray = _barcodes_per_order(rng, shape, size)
+    assigned: np.ndarray = np.repeat(order_ids, counts).astype(np.float64)
+    unused: np.ndarray = np.full(int(len(assigned) * shape.unused_rate), np.nan)
+    barcode_order_ids: np.ndarray = np.concatenate([assigned, unused])
+
+    barcodes: np.ndarray = np.arange(
+        first_barcode, first_barcode + len(barcode_order_ids), dtype=np.int64
+    )
+    duplicates: np.ndarray = np.flatnonzero(
+        rng.random(len(barcodes)) < shape.duplicate_rate
+    )
+
+    if len(duplicates) and len(barcodes) > 1:
+        barcodes[duplicates] = barcodes[rng.integers(0, len(barcodes), len(duplicates))]
+
+    shuffle: np.ndarray = rng.permutation(len(barcodes))
+    df_barcodes: pd.DataFrame = pd.DataFrame(
+        {
+            "barcode": barcodes[shuffle],
+            "order_id": pd.array(barcode_order_ids[shuffle], dtype="Int64"),
+        }
+    )
+
+    return df_orders, df_barcodes
+
+
+def _arrow_writer(filepath: str, fmt: str, schema):
+    """
+    :return: writer that appends pyarrow Tables of the schema to a parquet or feather file.
+    """
+    if fmt == PARQUET:
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(filepath, schema, compression="snappy")
+
+    return _pyarrow().ipc.new_file(filepath, schema)
+
+
+def generate_dataset(
+    shape: DatasetShape,
+    dest_path: str,
+    fmt: str = CSV,
+    chunksize: int = 1_000_000,
+) -> Tuple[str, str]:
+    """
+    Writes a synthetic orders and barcodes pair chunk by chunk, so any scale fits in memory.
+
+    :param shape: DatasetShape
+    :param dest_path: folder of the generated files.
+    :param fmt: csv, parquet or feather, every chunk is a row group or a record batch of the arrow formats.
+    :param chunksize: amount of orders generated at once.
+    :return: paths to the orders and barcodes files, with the header or schema even if there are no orders.
+    """
+    dest_path = sanitize_path(dest_path)
+    os.makedirs(dest_path, exist_ok=True)
+
+    ts: int = current_time()
+    orders_path: str = f"{dest_path}orders.{ts}.{file_extension(fmt)}"
+    barcodes_path: str = f"{dest_path}barcodes.{ts}.{file_extension(fmt)}"
+    rng: np.random.Generator = np.random.default_rng(shape.seed)
+
+    first_barcode: int = 0
+    writers: Dict = {}
+
+    try:
+        # without orders a single empty chunk is written, so both files get their columns
+        for first_order in range(0, shape.orders, chunksize) or range(1):
+            df_orders, df_barcodes = generate_chunk(
+                rng,
+                shape,
+                first_order,
+                min(chunksize, shape.orders - first_order),
+                first_barcode,
+            )
+            first_barcode += len(df_barcodes)
+
+            if fmt == CSV:
+                header: bool = first_order == 0
+                df_orders.to_csv(orders_path, mode="a", header=header, index=False)
+                df_barcodes.to_csv(barcodes_path, mode="a", header=header, index=False)
+                continue
+
+            for filepath, df in (
+                (orders_path, df_orders),
+                (barcodes_path, df_barcodes),
+            ):
+                table = _arrow_table(df)
+
+                if filepath not in writers:
+                    writers[filepath] = _arrow_writer(filepath, fmt, table.schema)
+
+                writers[filepath].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return orders_path, barcodes_path
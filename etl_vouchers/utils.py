@@ -1,6 +1,9 @@
-from typing import List
+from typing import List, Union
+import re
 import time
 
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
 
 def current_time() -> int:
     """
@@ -19,6 +22,23 @@ def sanitize_path(path: str) -> str:
     return path
 
 
+def parse_size(size: Union[int, str]) -> int:
+    """
+    Parses human readable sizes, e.g. 512, "512K", "1.5GB" or "2g".
+
+    :return: int, amount of bytes.
+    """
+    if isinstance(size, int):
+        return size
+
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?\s*", size.upper())
+
+    if match is None:
+        raise ValueError(f"Can not parse size {size}")
+
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
 def pretty_print(header: str, rows: List[str]) -> None:
     """
     Prints the output in subjectively beautiful format.
@@ -1,28 +1,56 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from abc import ABC, abstractmethod
+import numpy as np
 import pandas as pd
-import great_expectations as ge
-from great_expectations.dataset import PandasDataset
 from etl_vouchers.exceptions import InvalidSourceFile
+from etl_vouchers.expectations import NATIVE_BACKEND, dataset_for
 from etl_vouchers.utils import pretty_print
 
 
+SAMPLE_SIZE: int = 10
+
+
 def is_valid(validation_responses: List[Dict]) -> bool:
     return all([it["success"] for it in validation_responses])
 
 
+def sample(values: pd.Series, size: int = SAMPLE_SIZE) -> List:
+    """
+    :return: up to `size` distinct values, followed by the amount of the rest if there are more.
+    """
+    uniques: np.ndarray = pd.unique(values)
+
+    return _with_rest(list(uniques[:size]), len(uniques))
+
+
+def _with_rest(values: List, total: int) -> List:
+    if len(values) < total:
+        return [*values, f"... and {total - len(values)} more"]
+
+    return values
+
+
 class Validator(ABC):
     """
     Base validator class.
 
     :param df - input pandas DataFrame that has to be validated.
     :param silent - boolean flag, if true - nothing is printed to stdout.
+    :param backend - validation backend, "native" or "great_expectations".
+
+    After the call, `dropped` holds the amount of rows every failed rule removed
+    and `samples` a bounded sample of the offending values, see sample().
     """
 
-    def __init__(self, df: pd.DataFrame, silent: bool = False):
+    def __init__(
+        self, df: pd.DataFrame, silent: bool = False, backend: str = NATIVE_BACKEND
+    ):
         self.df: pd.DataFrame = df
-        self.dfe: PandasDataset = ge.from_pandas(self.df)
+        self.backend: str = backend
+        self.dfe = dataset_for(self.df, backend)
         self.silent: bool = silent
+        self.dropped: Dict[str, int] = {}
+        self.samples: Dict[str, List] = {}
 
     @abstractmethod
     def __call__(self, **kwargs) -> pd.DataFrame:
@@ -60,6 +88,13 @@ class OrdersValidator(Validator):
 class BarcodesValidator(Validator):
     """
     Validator for barcodes dataset.
+
+    Rows with a duplicated barcode (all of the copies) and rows without a barcode are dropped.
+    The native backend evaluates both rules from a single hash pass over the barcodes, any other
+    backend evaluates them itself, see no_duplicate_barcodes and no_orders_without_barcodes,
+    and the pass only finds the rows of the failed rules. The rows are dropped with a single filter.
+    Duplicates are found within the frame, so it has to hold every copy of a barcode,
+    e.g. the whole file or a barcode-hash partition of it.
     """
 
     def __call__(self) -> pd.DataFrame:
@@ -68,34 +103,66 @@ class BarcodesValidator(Validator):
                 "Barcode csv file has to contain 2 columns - barcode, order_id"
             )
 
-        if not self.no_duplicate_barcodes():
+        is_duplicate, is_null = self.masks()
+
+        if self.backend != NATIVE_BACKEND:
+            if self.no_duplicate_barcodes():
+                is_duplicate = np.zeros_like(is_duplicate)
+
+            if self.no_orders_without_barcodes():
+                is_null = np.zeros_like(is_null)
+
+        is_dropped: np.ndarray = is_duplicate | is_null
+
+        if is_duplicate.any():
+            self.dropped["duplicate_barcodes"] = int(is_duplicate.sum())
+            self.samples["duplicate_barcodes"] = sample(
+                self.df["barcode"][is_duplicate]
+            )
+
             if not self.silent:
                 pretty_print(
                     "Barcodes Validator - No Barcode Duplicates",
                     [
                         "Next barcodes are duplicated",
-                        *self.df[self.df.duplicated(subset=["barcode"])][
-                            "barcode"
-                        ].tolist(),
+                        *self.samples["duplicate_barcodes"],
                     ],
                 )
 
-            self.df = self.df.drop_duplicates(subset=["barcode"], keep=False)
+        if is_null.any():
+            self.dropped["orders_without_barcodes"] = int(is_null.sum())
+            self.samples["orders_without_barcodes"] = sample(
+                self.df["order_id"][is_null]
+            )
 
-        if not self.no_orders_without_barcodes():
             if not self.silent:
                 pretty_print(
                     "Barcodes Validator - No Orders Without Barcodes",
                     [
                         "Next orders don't have barcodes",
-                        *self.df[self.df["barcode"].isna()]["order_id"].tolist(),
+                        *self.samples["orders_without_barcodes"],
                     ],
                 )
 
-            self.df = self.df.dropna(subset=["barcode"])
+        if is_dropped.any():
+            self.df = self.df[~is_dropped]
 
         return self.df
 
+    def masks(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Factorizes the barcodes once: missing barcodes get code -1
+        and a barcode is duplicated if its code occurs more than once.
+
+        :return: tuple of boolean masks - duplicated barcodes, missing barcodes.
+        """
+        codes: np.ndarray = pd.factorize(self.df["barcode"])[0]
+        # shifted by one, so missing barcodes are counted in the first bin
+        occurrences: np.ndarray = np.bincount(codes + 1)[codes + 1]
+        is_null: np.ndarray = codes < 0
+
+        return (occurrences > 1) & ~is_null, is_null
+
     def has_expected_format(self) -> bool:
         responses: List[Dict] = [
             self.dfe.expect_column_to_exist("barcode", column_index=0),
@@ -0,0 +1,246 @@
+from dataclasses import dataclass
+from typing import Iterator, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.formats import _arrow_table, _pyarrow
+
+# list offsets of the arrow barcodes column are int32
+_MAX_ARROW_OFFSET: int = np.iinfo(np.int32).max
+
+
+@dataclass
+class Vouchers:
+    """
+    Vouchers in the compressed sparse row layout: one row per voucher in parallel id arrays,
+    and the barcodes of all of them in a single flat array. The barcodes of the i-th voucher
+    are barcodes[offsets[i]:offsets[i + 1]].
+
+    Vouchers take 8 bytes per barcode and 24 per voucher instead of a python list per voucher,
+    reductions over them are numpy reductions, and the lists of the vouchers DataFrame
+    are built only on demand, e.g. for a batch of the csv output.
+
+    :param customer_ids - customer id of every voucher in the dtype of the orders, sorted with order_ids.
+    :param order_ids - order id of every voucher.
+    :param offsets - int64 array of len(vouchers) + 1 positions into barcodes, starts with 0.
+    :param barcodes - int64 barcodes of all the vouchers.
+    """
+
+    customer_ids: np.ndarray
+    order_ids: np.ndarray
+    offsets: np.ndarray
+    barcodes: np.ndarray
+
+    @classmethod
+    def from_merged(cls, df_merged: pd.DataFrame) -> "Vouchers":
+        """
+        Collapses merged (customer_id, order_id, barcode) rows into one voucher per order.
+
+        The rows are sorted once, group boundaries are found by comparing neighbouring keys,
+        and the offsets of the groups are a cumulative count of the rows with a barcode.
+
+        :param df_merged: pd.DataFrame with customer_id, order_id and barcode (nullable) columns.
+        :return: Vouchers sorted by customer_id and order_id.
+        """
+        df_sorted: pd.DataFrame = df_merged.sort_values(
+            by=["customer_id", "order_id"], kind="mergesort"
+        )
+
+        customer_ids: np.ndarray = df_sorted["customer_id"].to_numpy()
+        order_ids: np.ndarray = df_sorted["order_id"].to_numpy()
+
+        is_group_start: np.ndarray = np.ones(len(df_sorted), dtype=bool)
+        is_group_start[1:] = (customer_ids[1:] != customer_ids[:-1]) | (
+            order_ids[1:] != order_ids[:-1]
+        )
+        group_starts: np.ndarray = np.flatnonzero(is_group_start)
+
+        has_barcode: np.ndarray = df_sorted["barcode"].notna().to_numpy()
+        # row_offsets[i] is the position in barcodes where the i-th row of df_sorted starts
+        row_offsets: np.ndarray = np.concatenate(([0], np.cumsum(has_barcode)))
+
+        return cls(
+            customer_ids=customer_ids[group_starts],
+            order_ids=order_ids[group_starts],
+            offsets=row_offsets[np.append(group_starts, len(df_sorted))].astype(
+                np.int64
+            ),
+            barcodes=df_sorted["barcode"][has_barcode].to_numpy(dtype=np.int64),
+        )
+
+    @classmethod
+    def from_frame(cls, df_vouchers: pd.DataFrame) -> "Vouchers":
+        """
+        :param df_vouchers: pd.DataFrame with customer_id, order_id and barcodes (list of ints) columns.
+        """
+        lists: List[List[int]] = df_vouchers["barcodes"].tolist()
+        lengths: np.ndarray = np.fromiter(
+            (len(it) for it in lists), dtype=np.int64, count=len(lists)
+        )
+
+        return cls(
+            customer_ids=df_vouchers["customer_id"].to_numpy(),
+            order_ids=df_vouchers["order_id"].to_numpy(),
+            offsets=np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+            barcodes=np.fromiter(
+                (barcode for it in lists for barcode in it),
+                dtype=np.int64,
+                count=int(lengths.sum()),
+            ),
+        )
+
+    @classmethod
+    def concat(cls, parts: Sequence["Vouchers"]) -> "Vouchers":
+        """
+        :param parts: at least one Vouchers.
+        :return: vouchers of all the parts one after another, the offsets of every part
+        are shifted by the barcodes of the parts before it.
+        """
+        shifts: np.ndarray = np.cumsum([0] + [int(it.offsets[-1]) for it in parts])
+
+        return cls(
+            customer_ids=np.concatenate([it.customer_ids for it in parts]),
+            order_ids=np.concatenate([it.order_ids for it in parts]),
+            offsets=np.concatenate(
+                [[0]] + [it.offsets[1:] + shift for it, shift in zip(parts, shifts)]
+            ).astype(np.int64),
+            barcodes=np.concatenate([it.barcodes for it in parts]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.customer_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            it.nbytes
+            for it in (self.customer_ids, self.order_ids, self.offsets, self.barcodes)
+        )
+
+    def barcode_counts(self) -> np.ndarray:
+        """
+        :return: amount of barcodes of every voucher.
+        """
+        return np.diff(self.offsets)
+
+    def slice(self, start: int, stop: int) -> "Vouchers":
+        """
+        :return: vouchers start to stop, their offsets start at 0 again, no vouchers if start is past the end.
+        """
+        stop = min(stop, len(self))
+        start = min(start, stop)
+        offsets: np.ndarray = self.offsets[start : stop + 1]
+
+        return Vouchers(
+            customer_ids=self.customer_ids[start:stop],
+            order_ids=self.order_ids[start:stop],
+            offsets=offsets - offsets[0],
+            barcodes=self.barcodes[offsets[0] : offsets[-1]],
+        )
+
+    def take(self, positions: np.ndarray) -> "Vouchers":
+        """
+        :param positions: int array of voucher positions.
+        :return: vouchers at the positions in their order, with the barcodes gathered behind new offsets.
+        """
+        counts: np.ndarray = self.barcode_counts()[positions]
+        offsets: np.ndarray = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        # position of every gathered barcode = start of its voucher + its rank in the voucher
+        barcode_positions: np.ndarray = np.repeat(
+            self.offsets[:-1][positions] - offsets[:-1], counts
+        ) + np.arange(offsets[-1], dtype=np.int64)
+
+        return Vouchers(
+            customer_ids=self.customer_ids[positions],
+            order_ids=self.order_ids[positions],
+            offsets=offsets,
+            barcodes=self.barcodes[barcode_positions],
+        )
+
+    def batches(self, batch_size: int) -> Iterator["Vouchers"]:
+        for start in range(0, len(self), batch_size):
+            yield self.slice(start, start + batch_size)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: pd.DataFrame with customer_id, order_id and barcodes (list of ints) columns, the etl output.
+        """
+        barcodes: List[int] = self.barcodes.tolist()
+        bounds: List[int] = self.offsets.tolist()
+
+        return pd.DataFrame(
+            {
+                "customer_id": self.customer_ids,
+                "order_id": self.order_ids,
+                "barcodes": [
+                    barcodes[start:end] for start, end in zip(bounds[:-1], bounds[1:])
+                ],
+            }
+        )
+
+    def to_arrow(self, max_barcodes: int = _MAX_ARROW_OFFSET):
+        """
+        :param max_barcodes: max amount of barcodes in a record batch, list offsets are int32.
+        :return: pyarrow Table with the schema of the vouchers DataFrame, the barcodes
+        column is built from the offsets and the flat barcodes without any python list.
+        Vouchers with more barcodes than int32 offsets can address are split into
+        several record batches, each with its own rebased offsets.
+        """
+        pa = _pyarrow()
+        empty: pd.DataFrame = pd.DataFrame(
+            {
+                "customer_id": self.customer_ids[:0],
+                "order_id": self.order_ids[:0],
+                "barcodes": pd.Series([], dtype=object),
+            }
+        )
+        schema = _arrow_table(empty).schema
+        batches: List = []
+        start: int = 0
+
+        while start < len(self) or not batches:
+            # the vouchers after start whose barcodes all fit into one batch
+            limit: int = int(self.offsets[start]) + max_barcodes
+            stop: int = int(np.searchsorted(self.offsets, limit, "right")) - 1
+
+            if stop <= start < len(self):
+                raise ETLVouchersException(
+                    f"Order {self.order_ids[start]} has more barcodes than an arrow list can hold"
+                )
+
+            chunk: Vouchers = self.slice(start, stop)
+            batches.append(
+                pa.RecordBatch.from_arrays(
+                    [
+                        pa.array(chunk.customer_ids),
+                        pa.array(chunk.order_ids),
+                        pa.ListArray.from_arrays(
+                            pa.array(chunk.offsets, type=pa.int32()),
+                            pa.array(chunk.barcodes),
+                        ),
+                    ],
+                    schema=schema,
+                )
+            )
+            start = stop
+
+        return pa.Table.from_batches(batches, schema=schema)
+
+    def barcodes_per_customer(self) -> pd.Series:
+        """
+        :return: pd.Series, amount of barcodes of all the vouchers of a customer indexed by customer_id.
+        """
+        if not len(self):
+            return pd.Series([], dtype=np.int64)
+
+        is_start: np.ndarray = np.ones(len(self), dtype=bool)
+        is_start[1:] = self.customer_ids[1:] != self.customer_ids[:-1]
+        starts: np.ndarray = np.flatnonzero(is_start)
+
+        return pd.Series(
+            np.add.reduceat(self.barcode_counts(), starts),
+            index=self.customer_ids[starts],
+            dtype=np.int64,
+        )
@@ -0,0 +1,377 @@
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import tempfile
+import time
+import zipfile
+from typing import Dict, Optional, Union
+
+import pandas as pd
+
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.formats import (
+    CSV,
+    PARQUET,
+    _arrow_table,
+    _pyarrow,
+    detect_format,
+    file_extension,
+)
+from etl_vouchers.schema import VOUCHERS, Schema
+from etl_vouchers.utils import current_time, sanitize_path
+from etl_vouchers.vouchers import Vouchers
+
+MANIFEST_SUFFIX: str = ".manifest.json"
+
+CSV_COMPRESSIONS = ("gzip", "bz2", "xz", "zip", "zstd")
+
+
+class _HashingFile(io.RawIOBase):
+    """
+    Write-only file that passes the bytes through to `raw` while counting and hashing them,
+    so the checksum of the output is known without reading it back.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+        self.size: int = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.raw.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+        return len(data)
+
+    def tell(self) -> int:
+        return self.size
+
+    def flush(self) -> None:
+        self.raw.flush()
+
+    def close(self) -> None:
+        # the raw file is synced and closed by the writer
+        super().close()
+
+
+def _zstd_writer(fileobj):
+    try:
+        import zstandard
+    except ImportError:
+        raise ETLVouchersException("zstd compression of csv requires zstandard")
+
+    return zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False)
+
+
+def _fsync_folder(folder: str) -> None:
+    """
+    Persists the directory entry of a published file, not available on every platform.
+    """
+    try:
+        fd: int = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _publish(tmp_path: str, candidates) -> str:
+    """
+    Moves tmp_path to the first candidate path that does not exist yet.
+    The hard link fails instead of replacing an existing file, so concurrent runs never clobber each other.
+
+    :return: str, path the file was published under.
+    """
+    for path in candidates:
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            continue
+        except (OSError, AttributeError):
+            # file systems without hard links - reserve the name, then replace the placeholder
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                continue
+
+            os.replace(tmp_path, path)
+            return path
+
+        os.unlink(tmp_path)
+        return path
+
+    raise ETLVouchersException("Can not find a free output file name")
+
+
+class VouchersWriter:
+    """
+    Writes vouchers batch by batch into a temporary file next to the output
+    and atomically publishes it under a collision-free name once it is complete.
+
+    The output is named <prefix>.<timestamp>.<extension>, if the name is taken
+    (e.g. another run in the same second) <prefix>.<timestamp>.<n>.<extension> is used.
+    After the output is published, <output>.manifest.json with the format, row count,
+    size and sha256 of the output is written, so a reader that waits for the manifest
+    never sees a partial file.
+
+    Usage:
+        with VouchersWriter(dest_path, fmt="csv", compression="gzip") as writer:
+            for df in batches:
+                writer.write(df)
+
+        writer.output_filepath
+
+    :param dest_path - path to the output folder, current folder by default.
+    :param fmt - csv, parquet or feather.
+    :param compression - csv: gzip, bz2, xz, zip or zstd; parquet: snappy, gzip, zstd, ...;
+    feather: lz4 or zstd. None - uncompressed csv, default codec of the other formats.
+    :param prefix - name of the output file before the timestamp.
+    :param schema - Schema of the output, used to write an empty file if no batch is written.
+    :param manifest - bool, if false, the manifest is not written.
+    """
+
+    def __init__(
+        self,
+        dest_path: Optional[str] = None,
+        fmt: str = CSV,
+        compression: Optional[str] = None,
+        prefix: str = "vouchers",
+        schema: Optional[Schema] = VOUCHERS,
+        manifest: bool = True,
+    ):
+        self.fmt: str = detect_format("", fmt)
+        self.compression: Optional[str] = compression
+        self.prefix: str = prefix
+        self.schema: Optional[Schema] = schema
+        self.manifest: bool = manifest
+        self.folder: str = sanitize_path(dest_path or ".")
+        self.rows: int = 0
+        self.output_filepath: Optional[str] = None
+        self.manifest_filepath: Optional[str] = None
+
+        if self.fmt == CSV and compression not in (None, *CSV_COMPRESSIONS):
+            raise ETLVouchersException(f"Unknown csv compression {compression}")
+
+        if self.fmt != CSV:
+            _pyarrow()
+
+        fd, self._tmp_path = tempfile.mkstemp(
+            prefix=f".{prefix}.", suffix=".tmp", dir=self.folder
+        )
+        self._raw = os.fdopen(fd, "wb")
+        self._hashing: _HashingFile = _HashingFile(self._raw)
+        self._stream = None
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._text = None
+        self._arrow_writer = None
+        self._arrow_schema = None
+        self._started: bool = False
+
+    def __enter__(self) -> "VouchersWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _open_csv(self) -> None:
+        if self.compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._hashing, mode="wb", mtime=0)
+        elif self.compression == "bz2":
+            self._stream = bz2.BZ2File(self._hashing, mode="wb")
+        elif self.compression == "xz":
+            self._stream = lzma.LZMAFile(self._hashing, mode="wb")
+        elif self.compression == "zip":
+            self._zip = zipfile.ZipFile(
+                self._hashing, mode="w", compression=zipfile.ZIP_DEFLATED
+            )
+            self._stream = self._zip.open(f"{self.prefix}.csv", mode="w")
+        elif self.compression == "zstd":
+            self._stream = _zstd_writer(self._hashing)
+        else:
+            self._stream = self._hashing
+
+        self._text = io.TextIOWrapper(self._stream, encoding="utf-8", newline="")
+
+    def _write_arrow(self, batch: Union[pd.DataFrame, Vouchers]) -> None:
+        pa = _pyarrow()
+
+        if isinstance(batch, Vouchers):
+            table = batch.to_arrow()
+        elif self._arrow_writer is None:
+            table = _arrow_table(batch)
+        else:
+            table = pa.Table.from_pandas(
+                batch, schema=self._arrow_schema, preserve_index=False
+            )
+
+        if self._arrow_writer is None:
+            self._arrow_schema = table.schema
+            sink = pa.PythonFile(self._hashing, mode="w")
+
+            if self.fmt == PARQUET:
+                import pyarrow.parquet as pq
+
+                self._arrow_writer = pq.ParquetWriter(
+                    sink, table.schema, compression=self.compression or "snappy"
+                )
+            else:
+                self._arrow_writer = pa.ipc.new_file(
+                    sink,
+                    table.schema,
+                    options=pa.ipc.IpcWriteOptions(
+                        compression=None
+                        if self.compression == "uncompressed"
+                        else self.compression
+                    ),
+                )
+
+        self._arrow_writer.write_table(table)
+
+    def write(self, df: Union[pd.DataFrame, Vouchers]) -> None:
+        """
+        Appends a batch of vouchers, the columns of every batch must match the first one.
+        Vouchers are written to parquet and feather without building their barcode lists.
+        """
+        if self.fmt == CSV:
+            if self._text is None:
+                self._open_csv()
+
+            if isinstance(df, Vouchers):
+                df = df.to_frame()
+
+            df.to_csv(self._text, header=not self._started, index=False)
+        else:
+            self._write_arrow(df)
+
+        self._started = True
+        self.rows += len(df)
+
+    def _empty_frame(self) -> pd.DataFrame:
+        if self.schema is None:
+            return pd.DataFrame()
+
+        return pd.DataFrame(
+            {name: pd.Series(dtype=dtype) for name, dtype in self.schema.dtypes.items()}
+        )
+
+    def _finish_stream(self) -> None:
+        if self._text is not None:
+            self._text.flush()
+            # detach keeps the hashing file open, closing the compressor writes its trailer
+            self._text.detach()
+
+            if self._stream is not self._hashing:
+                self._stream.close()
+
+            if self.compression == "zip":
+                self._zip.close()
+
+        if self._arrow_writer is not None:
+            self._arrow_writer.close()
+
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+
+    def _candidates(self):
+        ts: int = current_time()
+        extension: str = file_extension(self.fmt, self.compression)
+
+        yield f"{self.folder}{self.prefix}.{ts}.{extension}"
+
+        for n in range(1, 10_000):
+            yield f"{self.folder}{self.prefix}.{ts}.{n}.{extension}"
+
+    def close(self) -> str:
+        """
+        Finishes the output, publishes it and writes the manifest.
+
+        :return: str, path to the published output file.
+        """
+        if self.output_filepath is not None:
+            return self.output_filepath
+
+        if not self._started:
+            self.write(self._empty_frame())
+
+        self._finish_stream()
+        self.output_filepath = _publish(self._tmp_path, self._candidates())
+        _fsync_folder(self.folder)
+
+        if self.manifest:
+            self.manifest_filepath = self._write_manifest()
+
+        return self.output_filepath
+
+    def abort(self) -> None:
+        """
+        Drops the partial output, nothing is published.
+        """
+        try:
+            self._raw.close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.unlink(self._tmp_path)
+
+    def _write_manifest(self) -> str:
+        manifest: Dict = {
+            "file": os.path.basename(self.output_filepath),
+            "format": self.fmt,
+            "compression": self.compression,
+            "rows": self.rows,
+            "bytes": self._hashing.size,
+            "sha256": self._hashing.sha256.hexdigest(),
+            "created_at": time.time(),
+        }
+        path: str = f"{self.output_filepath}{MANIFEST_SUFFIX}"
+        tmp_path: str = f"{path}.tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+
+        return path
+
+
+def read_manifest(output_filepath: str) -> Dict:
+    """
+    :return: dict with the manifest of a published output file.
+    """
+    with open(f"{output_filepath}{MANIFEST_SUFFIX}") as f:
+        return json.load(f)
+
+
+def verify(output_filepath: str) -> bool:
+    """
+    :return: True if the size and sha256 of the output file match its manifest.
+    """
+    manifest: Dict = read_manifest(output_filepath)
+    sha256 = hashlib.sha256()
+
+    with open(output_filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+
+    return (
+        os.path.getsize(output_filepath) == manifest["bytes"]
+        and sha256.hexdigest() == manifest["sha256"]
+    )
@@ -5,10 +5,15 @@ packages = ['etl_vouchers']
 
 package_data = {'': ['*']}
 
-install_requires = ['great-expectations>=0.13.19,<0.14.0',
-                    'invoke>=1.5.0,<2.0.0',
+install_requires = ['invoke>=1.5.0,<2.0.0',
                     'pandas>=1.2.4,<2.0.0']
 
+extras_require = \
+{'arrow': ['pyarrow>=4.0.0'],
+ 'duckdb': ['duckdb>=0.3.0'],
+ 'great-expectations': ['great-expectations>=0.13.19,<0.14.0'],
+ 'zstd': ['zstandard>=0.15.0']}
+
 setup_kwargs = {
     'name': 'etl-vouchers',
     'version': '0.1.0',
@@ -22,6 +27,7 @@ setup_kwargs = {
     'packages': packages,
     'package_data': package_data,
     'install_requires': install_requires,
+    'extras_require': extras_require,
     'python_requires': '==3.7.2',
 }
 
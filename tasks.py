@@ -1,11 +1,37 @@
+# pandas and the pipeline modules are imported in the task bodies, so `invoke --list` and `--help`
+# do not pay for them, see tests/tasks_test.py
 from invoke import task
-from etl_vouchers.etl import pipeline, PipelineResponse
 from etl_vouchers.exceptions import ETLVouchersException
-from etl_vouchers.statistic import VoucherStatistic
+from etl_vouchers.metrics import Metrics, profile as profile_run
+from etl_vouchers.utils import parse_size, pretty_print
 
 
 @task
-def etl(c, orders, barcodes, dest=None, allow_useless=False):
+def etl(
+    c,
+    orders,
+    barcodes,
+    dest=None,
+    allow_useless=False,
+    max_memory=None,
+    chunksize=None,
+    validation_backend="native",
+    csv_engine="c",
+    format="csv",
+    compression=None,
+    workers=None,
+    metrics=None,
+    profile=None,
+    profile_output=None,
+    cache=False,
+    engine="pandas",
+    database=None,
+    sorted_inputs=False,
+    shards=None,
+    sharding="hash",
+    preflight_rows=1000,
+    preflight_only=False,
+):
     """
     Runs ETL pipeline against the supplied csv files and generates the output file.
 
@@ -14,23 +40,276 @@ def etl(c, orders, barcodes, dest=None, allow_useless=False):
     :param barcodes: path to barcodes csv
     :param dest: path to the output folder
     :param allow_useless: bool, if true, vouchers without any barcodes will be generated as well
+    :param max_memory: approximate memory ceiling (e.g. 512MB), enables the streaming mode
+    :param chunksize: amount of rows read at once, enables the streaming mode
+    :param validation_backend: native or great_expectations
+    :param csv_engine: c or pyarrow
+    :param format: format of the output file - csv, parquet or feather
+    :param compression: compression of the output file, e.g. gzip for csv, zstd for parquet and feather
+    :param workers: amount of worker processes for the partitioned parallel mode
+    :param metrics: path to the file stage metrics are saved to, prometheus text for .prom, json lines otherwise
+    :param profile: cprofile or tracemalloc, profiles the whole run
+    :param profile_output: path to the profiler output, etl.<profile> by default
+    :param cache: bool, if true, parsed and validated inputs are stored in and loaded from the disk cache
+    :param engine: pandas, sql (duckdb when installed, sqlite otherwise), sqlite or duckdb
+    :param database: path to the database file of the sql engines, reused by later runs over the same inputs
+    :param sorted_inputs: bool, if true, both inputs are sorted by order_id and joined in lockstep, unsorted ones fall back to the hash join
+    :param shards: amount of output files the vouchers are split into by customer_id, written in parallel with an index file
+    :param sharding: hash or range, how customer ids are assigned to the shards
+    :param preflight_rows: amount of rows of every input checked with the header before the full parse, 0 - only the header
+    :param preflight_only: bool, if true, only the header and sampled rows of the inputs are checked, nothing is written
     :return:
     """
+    from etl_vouchers.disk_cache import input_cache
+    from etl_vouchers.etl import PipelineResponse, pipeline
+
     if dest is None:
         dest = "./datasets/"
 
     try:
-        resp: PipelineResponse = pipeline(
-            orders, barcodes, dest, allow_useless_vouchers=allow_useless
+        if preflight_only:
+            from etl_vouchers.preflight import preflight_inputs
+
+            pretty_print(
+                "Preflight - file, columns, sampled rows",
+                [
+                    f"{it.filepath}, {' '.join(it.columns)}, {it.rows}"
+                    for it in preflight_inputs(orders, barcodes, int(preflight_rows))
+                ],
+            )
+            return
+
+        with profile_run(profile, profile_output or f"etl.{profile}"):
+            resp: PipelineResponse = pipeline(
+                orders,
+                barcodes,
+                dest,
+                allow_useless_vouchers=allow_useless,
+                summary_only=True,
+                max_memory=None if max_memory is None else parse_size(max_memory),
+                chunksize=None if chunksize is None else int(chunksize),
+                validation_backend=validation_backend,
+                csv_engine=csv_engine,
+                output_format=format,
+                compression=compression,
+                workers=None if workers is None else int(workers),
+                cache=input_cache(use_disk=True) if cache else None,
+                engine=engine,
+                database=database,
+                sorted_inputs=sorted_inputs,
+                shards=None if shards is None else int(shards),
+                sharding=sharding,
+                preflight_rows=int(preflight_rows),
+                # the stage table below shows the peak RSS of every stage
+                metrics=Metrics(track_memory=True),
+            )
+
+        print(f"Output saved to {resp.output_filepath}\n")
+        print(
+            f"Orders: {resp.summary.orders}, barcodes: {resp.summary.barcodes}, "
+            f"vouchers: {resp.summary.vouchers}\n"
+        )
+        pretty_print(
+            "Stages - name, started, seconds, rows in, rows out, peak RSS MB",
+            [
+                f"{it.name}, {it.started:.3f}, {it.seconds:.3f}, {it.rows_in}, {it.rows_out}, "
+                f"{(it.peak_rss or 0) / 1024 ** 2:.1f}"
+                for it in resp.metrics.spans
+            ],
+        )
+
+        if metrics is not None:
+            print(f"Metrics saved to {resp.metrics.write(metrics)}\n")
+
+        if profile is not None:
+            print(f"Profile saved to {profile_output or f'etl.{profile}'}\n")
+    except ETLVouchersException as e:
+        print("Failed with: ", e)
+
+
+@task
+def batch(
+    c,
+    input,
+    dest=None,
+    ledger=None,
+    workers=None,
+    max_pending=None,
+    watch=False,
+    interval=5.0,
+    max_skew=60,
+    allow_useless=False,
+    format="csv",
+    compression=None,
+    retry_failed=False,
+):
+    """
+    Runs ETL pipeline for every orders.<ts>.csv and barcodes.<ts>.csv pair of drops in the input folder
+    that is not in the ledger yet, pairs are matched by the nearest timestamp and run on a process pool.
+
+    :param c: cmd
+    :param input: path to the folder with the drops
+    :param dest: path to the output folder
+    :param ledger: path to the ledger of processed pairs, <dest>/ledger.jsonl by default
+    :param workers: amount of worker processes, amount of CPUs by default
+    :param max_pending: max amount of pairs submitted to the workers at once, 2 * workers by default
+    :param watch: bool, if true, the folder is scanned for new drops until Ctrl+C
+    :param interval: seconds between the scans in the watch mode
+    :param max_skew: max difference of the timestamps of a pair in seconds
+    :param allow_useless: bool, if true, vouchers without any barcodes will be generated as well
+    :param format: format of the output files - csv, parquet or feather
+    :param compression: compression of the output files
+    :param retry_failed: bool, if true, pairs that failed before are run again
+    :return: None
+    """
+    from etl_vouchers.batch import DONE, run_batch
+
+    if dest is None:
+        dest = "./datasets/"
+
+    def report(entry):
+        if entry["status"] == DONE:
+            print(
+                f"{entry['orders']} + {entry['barcodes']} -> {entry['output']}, "
+                f"vouchers: {entry['vouchers']}, {entry['seconds']:.1f}s"
+            )
+        else:
+            print(
+                f"{entry['orders']} + {entry['barcodes']} failed with: {entry['error']}"
+            )
+
+    try:
+        results = run_batch(
+            input,
+            dest,
+            ledger_path=ledger,
+            workers=None if workers is None else int(workers),
+            max_pending=None if max_pending is None else int(max_pending),
+            watch=watch,
+            interval=float(interval),
+            max_skew=int(max_skew),
+            retry_failed=retry_failed,
+            on_result=report,
+            allow_useless_vouchers=allow_useless,
+            output_format=format,
+            compression=compression,
+        )
+
+        print(
+            f"\nProcessed pairs: {len(results)}, "
+            f"failed: {sum(it['status'] != DONE for it in results)}\n"
+        )
+    except ETLVouchersException as e:
+        print("Failed with: ", e)
+
+
+@task
+def serve(
+    c,
+    input=None,
+    orders=None,
+    barcodes=None,
+    host="127.0.0.1",
+    port=8080,
+    interval=5.0,
+    max_skew=60,
+    allow_useless=False,
+    cache=False,
+    quiet=False,
+):
+    """
+    Loads and validates a dataset once and answers statistics and voucher lookups over HTTP until Ctrl+C.
+
+    :param c: cmd
+    :param input: path to the folder with the drops, the newest pair is served and replaced by newer ones
+    :param orders: path to orders csv, if no input folder is supplied
+    :param barcodes: path to barcodes csv, if no input folder is supplied
+    :param host: address to listen on
+    :param port: port to listen on
+    :param interval: seconds between the scans of the input folder
+    :param max_skew: max difference of the timestamps of a pair in seconds
+    :param allow_useless: bool, if true, vouchers without any barcodes are served as well
+    :param cache: bool, if true, parsed and validated inputs are stored in and loaded from the disk cache
+    :param quiet: bool, if true, requests are not logged
+    :return: None
+    """
+    from etl_vouchers.disk_cache import input_cache
+    from etl_vouchers.server import serve as serve_dataset
+
+    def ready(server):
+        dataset = server.store.current
+        source = (
+            "nothing yet"
+            if dataset is None
+            else f"{dataset.pair.orders} + {dataset.pair.barcodes}"
+        )
+        print(f"Serving {source} on {server.url}\n")
+
+    try:
+        serve_dataset(
+            input_path=input,
+            orders_filepath=orders,
+            barcodes_filepath=barcodes,
+            host=host,
+            port=int(port),
+            interval=float(interval),
+            max_skew=int(max_skew),
+            allow_useless_vouchers=allow_useless,
+            cache=input_cache(use_disk=cache),
+            quiet=quiet,
+            on_ready=ready,
+        )
+    except KeyboardInterrupt:
+        print("Stopped")
+    except ETLVouchersException as e:
+        print("Failed with: ", e)
+
+
+@task
+def incremental_etl(
+    c, orders, barcodes, state, dest=None, allow_useless=False, output="delta"
+):
+    """
+    Runs ETL pipeline that recomputes only the vouchers affected since the previous run
+    and generates either a delta or a full snapshot output file.
+
+    :param c: cmd
+    :param orders: path to orders csv
+    :param barcodes: path to barcodes csv
+    :param state: path to the folder with the state of the previous run
+    :param dest: path to the output folder
+    :param allow_useless: bool, if true, vouchers without any barcodes will be generated as well
+    :param output: delta (only changed vouchers with upsert/delete op) or snapshot (all the vouchers)
+    :return:
+    """
+    from etl_vouchers.incremental import IncrementalResponse, incremental_pipeline
+
+    if dest is None:
+        dest = "./datasets/"
+
+    try:
+        resp: IncrementalResponse = incremental_pipeline(
+            orders,
+            barcodes,
+            state,
+            dest,
+            output=output,
+            allow_useless_vouchers=allow_useless,
         )
 
         print(f"Output saved to {resp.output_filepath}\n")
+        print(
+            f"Inputs: {resp.inputs}, recomputed orders: {resp.affected_orders}, "
+            f"changed vouchers: {len(resp.df_delta)}\n"
+        )
     except ETLVouchersException as e:
         print("Failed with: ", e)
 
 
 @task
-def unused_barcodes(c, orders, barcodes):
+def unused_barcodes(
+    c, orders, barcodes, cache=False, index=None, engine="pandas", database=None
+):
     """
     Runs statistic class against the supplied data and
     generates output amount of unused barcodes.
@@ -38,18 +317,40 @@ def unused_barcodes(c, orders, barcodes):
     :param c: cmd
     :param orders: path to orders csv
     :param barcodes: path to barcodes csv
+    :param cache: bool, if true, parsed and validated inputs are stored in and loaded from the disk cache
+    :param index: path to the barcode index folder, if supplied the unused barcodes are read from it
+    :param engine: pandas, sql (duckdb when installed, sqlite otherwise), sqlite or duckdb
+    :param database: path to the database file of the sql engines, reused by later runs over the same inputs
     :return: None
     """
+    from etl_vouchers.disk_cache import input_cache
+    from etl_vouchers.statistic import VoucherStatistic
+
     try:
         VoucherStatistic(
-            orders_filepath=orders, barcodes_filepath=barcodes
+            orders_filepath=orders,
+            barcodes_filepath=barcodes,
+            cache=input_cache(use_disk=cache),
+            index_path=index,
+            engine=engine,
+            database=database,
         ).unused_barcodes()
     except ETLVouchersException as e:
         print("Failed with: ", e)
 
 
 @task
-def top_customers(c, orders, barcodes):
+def top_customers(
+    c,
+    orders,
+    barcodes,
+    top=5,
+    chunksize=None,
+    cache=False,
+    approx=False,
+    engine="pandas",
+    database=None,
+):
     """
     Runs statistic class against the supplied data and
     generates output for top 5 customers that bought the most amount of tickets.
@@ -57,11 +358,319 @@ def top_customers(c, orders, barcodes):
     :param c: cmd
     :param orders: path to orders csv
     :param barcodes: path to barcodes csv
+    :param top: amount of customers
+    :param chunksize: if supplied, orders are streamed chunk by chunk with this amount of rows
+    :param cache: bool, if true, parsed and validated inputs are stored in and loaded from the disk cache
+    :param approx: bool, if true, the orders are streamed once into fixed-size sketches, the amounts are estimates
+    :param engine: pandas, sql (duckdb when installed, sqlite otherwise), sqlite or duckdb
+    :param database: path to the database file of the sql engines, reused by later runs over the same inputs
     :return: None
     """
+    from etl_vouchers.disk_cache import input_cache
+    from etl_vouchers.statistic import VoucherStatistic
+
     try:
         VoucherStatistic(
-            orders_filepath=orders, barcodes_filepath=barcodes
-        ).top_customers(top=5)
+            orders_filepath=orders,
+            barcodes_filepath=barcodes,
+            cache=input_cache(use_disk=cache),
+            engine=engine,
+            database=database,
+        ).top_customers(
+            top=int(top),
+            chunksize=None if chunksize is None else int(chunksize),
+            approx=approx,
+        )
+    except ETLVouchersException as e:
+        print("Failed with: ", e)
+
+
+@task(iterable=["orders", "barcodes", "merge"])
+def summary(
+    c, orders=None, barcodes=None, top=5, chunksize=None, save=None, merge=None
+):
+    """
+    Streams the supplied files once into fixed-size sketches and prints approximate
+    top customers, distinct customers, orders and barcodes, and the unused barcodes ratio.
+    Sketches of every file, and of earlier runs, are merged.
+
+    :param c: cmd
+    :param orders: path to orders csv, can be repeated, e.g. for partitions of a feed
+    :param barcodes: path to barcodes csv, can be repeated
+    :param top: amount of customers
+    :param chunksize: amount of rows read at once
+    :param save: path to the .npz file the merged sketches are saved to
+    :param merge: path to sketches saved by an earlier run, can be repeated
+    :return: None
+    """
+    from etl_vouchers.sketches import ApproxStatistic, sketch_files
+
+    try:
+        statistic: ApproxStatistic = sketch_files(
+            orders, barcodes, chunksize=None if chunksize is None else int(chunksize)
+        )
+
+        for filepath in merge:
+            statistic = statistic.merge(ApproxStatistic.load(filepath))
+
+        pretty_print(
+            "Approximate summary",
+            [f"{name}: {value}" for name, value in statistic.summary().items()],
+        )
+        df_top = statistic.top_customers(int(top))
+        pretty_print(
+            f"Top {top} Customers (approximate)",
+            [
+                "customer_id, amount_of_tickets",
+                *(
+                    f"{customer_id}, {amount}"
+                    for customer_id, amount in zip(
+                        df_top["customer_id"], df_top["amount_of_tickets"]
+                    )
+                ),
+            ],
+        )
+
+        if save is not None:
+            print(f"Sketches saved to {statistic.save(save)}\n")
     except ETLVouchersException as e:
         print("Failed with: ", e)
+
+
+@task(iterable=["barcode"])
+def lookup_barcodes(
+    c, barcodes, index="./.barcode_index", barcode=None, low=None, high=None
+):
+    """
+    Looks barcodes up in the barcode index of the barcodes file,
+    the index is built on the first run and whenever the file changes.
+
+    :param c: cmd
+    :param barcodes: path to barcodes csv
+    :param index: path to the barcode index folder
+    :param barcode: barcode to show the order of, can be repeated
+    :param low: lowest barcode of the range to show
+    :param high: highest barcode of the range to show
+    :return: None
+    """
+    from etl_vouchers.barcode_index import BarcodeIndex, ensure_index
+
+    try:
+        barcode_index: BarcodeIndex = ensure_index(barcodes, index)
+
+        if barcode:
+            pretty_print(
+                "Barcode lookup - barcode, order_id",
+                [
+                    f"{key}, {value}"
+                    for key, value in barcode_index.lookup_many(
+                        [int(it) for it in barcode]
+                    ).items()
+                ],
+            )
+
+        if low is not None or high is not None:
+            df_range = barcode_index.between(
+                None if low is None else int(low), None if high is None else int(high)
+            )
+            pretty_print(
+                f"Barcodes from {low} to {high}", [df_range.to_string(index=False)]
+            )
+
+        print(f"Barcodes: {len(barcode_index)}, unused: {barcode_index.unused_count}\n")
+    except ETLVouchersException as e:
+        print("Failed with: ", e)
+
+
+@task
+def memory_report(c, orders, barcodes, csv_engine="c"):
+    """
+    Extracts the supplied csv files with their schemas and without them, and shows how many bytes
+    every column takes compared to the dtypes pandas infers and to the narrowest dtype its values fit.
+
+    :param c: cmd
+    :param orders: path to orders csv
+    :param barcodes: path to barcodes csv
+    :param csv_engine: c or pyarrow
+    :return: None
+    """
+    from etl_vouchers.etl import extract
+    from etl_vouchers.schema import BARCODES, ORDERS, memory_report as memory_report_of
+
+    try:
+        for schema, filepath in ((ORDERS, orders), (BARCODES, barcodes)):
+            df_report = memory_report_of(
+                extract(filepath, schema, engine=csv_engine),
+                extract(filepath, engine=csv_engine),
+            )
+
+            pretty_print(
+                f"Memory report - {schema.name}",
+                [df_report.to_string(index=False)],
+            )
+    except ETLVouchersException as e:
+        print("Failed with: ", e)
+
+
+@task(iterable=["only"])
+def report(
+    c,
+    orders,
+    barcodes,
+    dest=None,
+    top=5,
+    allow_useless=False,
+    only=None,
+    cache=False,
+    engine="pandas",
+    database=None,
+):
+    """
+    Extracts and validates the supplied csv files once and runs the ETL
+    together with all the statistics (top customers, unused barcodes) over them.
+
+    :param c: cmd
+    :param orders: path to orders csv
+    :param barcodes: path to barcodes csv
+    :param dest: path to the output folder
+    :param top: amount of customers in the top customers statistic
+    :param allow_useless: bool, if true, vouchers without any barcodes will be generated as well
+    :param only: run only the given reports (etl, top_customers, unused_barcodes), can be repeated
+    :param cache: bool, if true, parsed and validated inputs are stored in and loaded from the disk cache
+    :param engine: pandas, sql (duckdb when installed, sqlite otherwise), sqlite or duckdb
+    :param database: path to the database file of the sql engines, reused by later runs over the same inputs
+    :return: None
+    """
+    from etl_vouchers.disk_cache import input_cache
+    from etl_vouchers.statistic import REPORTS, StatisticReport, VoucherStatistic
+
+    if dest is None:
+        dest = "./datasets/"
+
+    try:
+        resp: StatisticReport = VoucherStatistic(
+            orders_filepath=orders,
+            barcodes_filepath=barcodes,
+            cache=input_cache(use_disk=cache),
+            engine=engine,
+            database=database,
+        ).report(
+            reports=only or REPORTS,
+            top=int(top),
+            dest_path=dest,
+            allow_useless_vouchers=allow_useless,
+        )
+
+        if resp.pipeline is not None:
+            print(f"Output saved to {resp.pipeline.output_filepath}\n")
+    except ETLVouchersException as e:
+        print("Failed with: ", e)
+
+
+@task
+def generate_dataset(
+    c,
+    orders,
+    dest="./datasets/synthetic/",
+    customers=None,
+    barcodes_per_order=2.0,
+    skew=0.0,
+    unused_rate=0.1,
+    duplicate_rate=0.001,
+    orders_without_barcodes=0.1,
+    seed=0,
+    format="csv",
+):
+    """
+    Generates a synthetic pair of orders and barcodes files of the given scale.
+
+    :param c: cmd
+    :param orders: amount of orders
+    :param dest: path to the output folder
+    :param customers: amount of distinct customers, orders / 4 by default
+    :param barcodes_per_order: mean amount of barcodes per order
+    :param skew: overdispersion of barcodes per order, 0 - poisson
+    :param unused_rate: amount of barcodes without an order, as a share of the assigned barcodes
+    :param duplicate_rate: share of barcode rows that repeat another barcode
+    :param orders_without_barcodes: share of orders without any barcode
+    :param seed: seed of the random generator
+    :param format: csv, parquet or feather
+    :return: None
+    """
+    from etl_vouchers.synthetic import DatasetShape, generate_dataset as generate_files
+
+    try:
+        orders_path, barcodes_path = generate_files(
+            DatasetShape(
+                orders=int(float(orders)),
+                customers=None if customers is None else int(float(customers)),
+                barcodes_per_order=float(barcodes_per_order),
+                skew=float(skew),
+                unused_rate=float(unused_rate),
+                duplicate_rate=float(duplicate_rate),
+                orders_without_barcodes=float(orders_without_barcodes),
+                seed=int(seed),
+            ),
+            dest,
+            fmt=format,
+        )
+
+        print(f"Orders saved to {orders_path}\nBarcodes saved to {barcodes_path}\n")
+    except ETLVouchersException as e:
+        print("Failed with: ", e)
+
+
+@task
+def benchmark(c, orders, barcodes, output=None, baseline=None, repeat=1, threshold=0.1):
+    """
+    Measures wall time, peak RSS and rows/sec of every pipeline and statistic stage.
+
+    :param c: cmd
+    :param orders: path to orders csv
+    :param barcodes: path to barcodes csv
+    :param output: path to the json file the results are saved to
+    :param baseline: path to the json results of a previous run to compare with
+    :param repeat: amount of runs of every stage, the best wall time is reported
+    :param threshold: relative slowdown or memory growth reported as a regression
+    :return: None
+    """
+    from etl_vouchers.benchmark import BenchmarkResult, compare, run_benchmark
+
+    try:
+        result: BenchmarkResult = run_benchmark(orders, barcodes, repeat=int(repeat))
+
+        pretty_print(
+            "Benchmark - stage, rows, seconds, peak RSS MB, rows/sec",
+            [
+                f"{it.stage}, {it.rows}, {it.seconds:.3f}, "
+                f"{it.peak_rss / 1024 ** 2:.1f}, {it.rows_per_second:.0f}"
+                for it in result.stages
+            ],
+        )
+
+        if output is not None:
+            print(f"Results saved to {result.to_json(output)}\n")
+
+        if baseline is not None:
+            pretty_print(
+                f"Regressions against {baseline}",
+                compare(BenchmarkResult.from_json(baseline), result, float(threshold))
+                or ["None"],
+            )
+    except ETLVouchersException as e:
+        print("Failed with: ", e)
+
+
+@task
+def clear_cache(c):
+    """
+    Removes all the parsed and validated inputs from the disk cache.
+
+    :param c: cmd
+    :return: None
+    """
+    from etl_vouchers.disk_cache import DiskCache
+
+    cache = DiskCache()
+    cache.clear()
+    print(f"Cache {cache.folder} cleared\n")
@@ -0,0 +1,92 @@
+import os
+
+import pandas as pd
+import pytest
+from etl_vouchers.barcode_index import BarcodeIndex, build_index, ensure_index
+from etl_vouchers.exceptions import ETLVouchersException
+
+
+@pytest.fixture
+def barcodes_path(tmp_path):
+    path = tmp_path / "barcodes.csv"
+    path.write_text("barcode,order_id\n50,1\n30,\n,2\n90,\n30,4\n70,6\n10,7\n")
+
+    return str(path)
+
+
+@pytest.fixture
+def index(tmp_path, barcodes_path):
+    return build_index(barcodes_path, str(tmp_path / "index"))
+
+
+def test_build_index(index):
+    assert len(index) == 6
+    assert index.barcodes.tolist() == [10, 30, 30, 50, 70, 90]
+    assert index.meta["without_barcode"] == 1
+    assert index.unused_count == 2
+
+
+@pytest.mark.parametrize(
+    "barcode, expected",
+    [(10, 7), (50, 1), (90, None), (30, None), (20, None), (0, None), (100, None)],
+)
+def test_lookup(index, barcode, expected):
+    assert index.lookup(barcode) == expected
+
+
+def test_lookup_many(index):
+    order_ids = index.lookup_many([70, 90, 10, 11])
+
+    assert order_ids.index.tolist() == [70, 90, 10, 11]
+    assert order_ids.tolist() == [6, pd.NA, 7, pd.NA]
+
+
+@pytest.mark.parametrize(
+    "low, high, expected_barcodes, expected_orders",
+    [
+        (30, 70, [30, 30, 50, 70], [pd.NA, 4, 1, 6]),
+        (31, 69, [50], [1]),
+        (None, 10, [10], [7]),
+        (80, None, [90], [pd.NA]),
+        (91, 100, [], []),
+    ],
+)
+def test_between(index, low, high, expected_barcodes, expected_orders):
+    df = index.between(low, high)
+
+    assert df["barcode"].tolist() == expected_barcodes
+    assert df["order_id"].tolist() == expected_orders
+
+
+def test_unused(index):
+    assert index.unused().tolist() == [30, 90]
+    assert index.unused(limit=1).tolist() == [30]
+
+
+def test_empty_index(tmp_path):
+    path = tmp_path / "barcodes.csv"
+    path.write_text("barcode,order_id\n")
+    index = build_index(str(path), str(tmp_path / "index"))
+
+    assert len(index) == 0
+    assert index.lookup(1) is None
+    assert index.unused().tolist() == []
+
+
+def test_ensure_index_rebuilds_changed_file(tmp_path, barcodes_path, index):
+    assert ensure_index(barcodes_path, index.path).meta == index.meta
+
+    with open(barcodes_path, "a") as f:
+        f.write("20,8\n")
+
+    rebuilt = ensure_index(barcodes_path, index.path)
+
+    assert len(rebuilt) == 7
+    assert rebuilt.lookup(20) == 8
+
+
+def test_open_incomplete_index(tmp_path, index):
+    os.unlink(f"{index.path}meta.json")
+
+    with pytest.raises(ETLVouchersException):
+        BarcodeIndex(index.path)
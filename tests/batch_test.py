@@ -0,0 +1,142 @@
+import os
+import threading
+
+import pytest
+from etl_vouchers.batch import (
+    DONE,
+    FAILED,
+    Drop,
+    DropPair,
+    Ledger,
+    pair_drops,
+    run_batch,
+    scan_drops,
+)
+
+ORDERS = "customer_id,order_id\n1,1\n1,2\n2,3\n"
+BARCODES = "barcode,order_id\n10,1\n11,1\n12,3\n13,\n"
+
+
+@pytest.fixture
+def folders(tmp_path):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "out").mkdir()
+
+    return tmp_path / "in", tmp_path / "out"
+
+
+def _drop(folder, name, content):
+    path = folder / name
+    path.write_text(content)
+    os.utime(path, (0, 0))
+
+    return str(path)
+
+
+def _drops(kind, *timestamps):
+    return [Drop(kind, ts, f"{kind}.{ts}.csv") for ts in timestamps]
+
+
+@pytest.mark.parametrize(
+    "orders, barcodes, expected",
+    [
+        ([100], [97], [(100, 97)]),
+        ([100], [97, 101], [(100, 101)]),
+        ([100, 102], [101], [(100, 101)]),
+        ([100, 200], [199, 98], [(100, 98), (200, 199)]),
+        ([100], [300], []),
+        ([], [100], []),
+    ],
+)
+def test_pair_drops(orders, barcodes, expected):
+    pairs = pair_drops(
+        _drops("orders", *orders), _drops("barcodes", *barcodes), max_skew=60
+    )
+
+    assert pairs == [
+        DropPair(f"orders.{o}.csv", f"barcodes.{b}.csv") for o, b in expected
+    ]
+
+
+def test_scan_drops(folders):
+    folder = folders[0]
+    orders = _drop(folder, "orders.100.csv", ORDERS)
+    _drop(folder, "orders.notes.txt", "")
+    _drop(folder, "customers.100.csv", "")
+    (folder / "barcodes.101.csv").write_text(BARCODES)
+
+    drops = scan_drops(str(folder), settle_seconds=60)
+
+    assert drops == {"orders": [Drop("orders", 100, orders)], "barcodes": []}
+    assert len(scan_drops(str(folder))["barcodes"]) == 1
+
+
+def test_run_batch(folders):
+    folder, dest = folders
+    _drop(folder, "orders.100.csv", ORDERS)
+    _drop(folder, "barcodes.98.csv", BARCODES)
+    _drop(folder, "orders.200.csv", ORDERS)
+    _drop(folder, "barcodes.201.csv", "barcode\n1\n")
+    _drop(folder, "orders.300.csv", ORDERS)
+
+    results = run_batch(str(folder), str(dest), workers=2)
+
+    assert sorted((os.path.basename(it["orders"]), it["status"]) for it in results) == [
+        ("orders.100.csv", DONE),
+        ("orders.200.csv", FAILED),
+    ]
+    assert [it["vouchers"] for it in results if it["status"] == DONE] == [3]
+    assert os.path.exists([it for it in results if it["status"] == DONE][0]["output"])
+    assert len(Ledger(str(dest / "ledger.jsonl")).entries) == 2
+
+    # nothing runs twice, failed pairs only on request
+    assert run_batch(str(folder), str(dest), workers=1) == []
+    assert [
+        it["status"]
+        for it in run_batch(str(folder), str(dest), workers=1, retry_failed=True)
+    ] == [FAILED]
+
+
+def test_run_batch_missing_dest(folders):
+    folder, dest = folders
+    dest = dest / "missing" / "out"
+    _drop(folder, "orders.100.csv", ORDERS)
+    _drop(folder, "barcodes.98.csv", BARCODES)
+    _drop(folder, "orders.200.csv", ORDERS)
+    _drop(folder, "barcodes.201.csv", BARCODES)
+
+    results = run_batch(str(folder), str(dest), workers=1)
+
+    assert [it["status"] for it in results] == [DONE, DONE]
+    assert len(Ledger(str(dest / "ledger.jsonl")).entries) == 2
+
+
+def test_run_batch_watch(folders):
+    folder, dest = folders
+    stop = threading.Event()
+    _drop(folder, "orders.100.csv", ORDERS)
+    _drop(folder, "barcodes.100.csv", BARCODES)
+
+    def on_result(entry):
+        if len(Ledger(str(dest / "ledger.jsonl")).entries) == 1:
+            # a drop that arrives while the batch runs is picked up by the next scan
+            _drop(folder, "orders.200.csv", ORDERS)
+            _drop(folder, "barcodes.200.csv", BARCODES)
+        else:
+            stop.set()
+
+    results = run_batch(
+        str(folder),
+        str(dest),
+        workers=1,
+        watch=True,
+        interval=0.05,
+        settle_seconds=0,
+        on_result=on_result,
+        stop=stop,
+    )
+
+    assert [os.path.basename(it["orders"]) for it in results] == [
+        "orders.100.csv",
+        "orders.200.csv",
+    ]
@@ -0,0 +1,56 @@
+import pytest
+from etl_vouchers.benchmark import (
+    STAGES,
+    BenchmarkResult,
+    StageResult,
+    compare,
+    measure,
+    run_benchmark,
+)
+from etl_vouchers.synthetic import DatasetShape, generate_dataset
+
+
+def _result(seconds, peak_rss):
+    return BenchmarkResult(
+        orders_filepath="orders.csv",
+        barcodes_filepath="barcodes.csv",
+        stages=[StageResult("transform", 10, seconds, peak_rss, 10 / seconds)],
+    )
+
+
+def test_measure():
+    result, stage = measure("sum", 100, lambda: sum(range(100)), repeat=3)
+
+    assert result == 4950
+    assert stage.stage == "sum"
+    assert stage.rows == 100
+    assert stage.seconds > 0
+    assert stage.rows_per_second == pytest.approx(100 / stage.seconds)
+
+
+def test_run_benchmark(tmp_path):
+    orders_path, barcodes_path = generate_dataset(
+        DatasetShape(orders=2000), str(tmp_path / "data")
+    )
+
+    result = run_benchmark(orders_path, barcodes_path)
+
+    assert [it.stage for it in result.stages] == STAGES
+    assert result.stages[0].rows == 2000
+    assert all(it.seconds > 0 and it.peak_rss > 0 for it in result.stages)
+
+    loaded = BenchmarkResult.from_json(result.to_json(str(tmp_path / "result.json")))
+
+    assert loaded == result
+
+
+def test_compare():
+    baseline = _result(1.0, 100)
+
+    assert compare(baseline, _result(1.05, 100)) == []
+    assert compare(baseline, _result(1.5, 100)) == [
+        "transform: seconds 1 -> 1.5 (+50%)"
+    ]
+    assert compare(baseline, _result(1.0, 200), threshold=0.5) == [
+        "transform: peak_rss 100 -> 200 (+100%)"
+    ]
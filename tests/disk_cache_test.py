@@ -0,0 +1,130 @@
+import os
+
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.disk_cache import DiskCache, input_cache
+from etl_vouchers.schema import BARCODES, ORDERS
+from etl_vouchers.validator import BarcodesValidator
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def input_files(tmp_path):
+    orders_path = tmp_path / "orders.csv"
+    barcodes_path = tmp_path / "barcodes.csv"
+
+    pd.DataFrame({"customer_id": [10, 11, 10], "order_id": [1, 2, 3]}).to_csv(
+        orders_path, index=False
+    )
+    pd.DataFrame(
+        {"barcode": [100, 101, 102, 102, 103], "order_id": [1, 1, 2, 3, None]}
+    ).to_csv(barcodes_path, index=False)
+
+    return str(orders_path), str(barcodes_path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiskCache(str(tmp_path / "cache"))
+
+
+def test_get_put(cache, input_files):
+    orders = input_files[0]
+    df = etl.extract(orders, ORDERS)
+
+    assert cache.get(orders, ("extract", ORDERS), ORDERS) is None
+
+    cache.put(orders, ("extract", ORDERS), df)
+
+    pd.testing.assert_frame_equal(cache.get(orders, ("extract", ORDERS), ORDERS), df)
+    assert cache.get(orders, ("extract", None), ORDERS) is None
+    assert cache.size > 0
+
+
+def test_key_follows_content(cache, input_files):
+    orders = input_files[0]
+    key = cache.key(orders, ("extract",))
+
+    os.utime(orders, ns=(0, 0))
+    assert cache.key(orders, ("extract",)) == key
+
+    with open(orders, "a") as f:
+        f.write("12,4\n")
+
+    assert cache.key(orders, ("extract",)) != key
+
+
+def test_evicts_least_recently_used(tmp_path, input_files):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=2**20)
+    orders = input_files[0]
+    df = etl.extract(orders, ORDERS)
+
+    cache.put(orders, ("extract", "c"), df)
+    # room for a single entry only
+    cache.max_bytes = cache.size
+    cache.put(orders, ("extract", "pyarrow"), df)
+
+    assert cache.get(orders, ("extract", "c")) is None
+    assert cache.get(orders, ("extract", "pyarrow")) is not None
+
+
+def test_runs_sharing_the_folder(tmp_path, input_files):
+    folder = str(tmp_path / "cache")
+    first, second = DiskCache(folder), DiskCache(folder)
+    orders, barcodes = input_files
+
+    # both runs key their inputs before either of them stores an entry
+    first.key(orders, ("extract",))
+    second.key(barcodes, ("extract",))
+    first.put(orders, ("extract",), etl.extract(orders, ORDERS))
+    second.put(barcodes, ("extract",), etl.extract(barcodes, BARCODES))
+
+    assert second.get(orders, ("extract",)) is not None
+    assert first.get(barcodes, ("extract",)) is not None
+
+    # every entry in the folder counts towards the size limit
+    second.max_bytes = 0
+    second.put(orders, ("validated",), etl.extract(orders, ORDERS))
+
+    assert first.size == 0
+
+
+def test_clear(cache, input_files):
+    orders = input_files[0]
+    cache.put(orders, ("extract",), etl.extract(orders, ORDERS))
+    cache.clear()
+
+    assert cache.size == 0
+    assert not [it for it in os.listdir(cache.folder) if it.endswith(".feather")]
+
+
+def test_pipeline_with_disk_cache(tmp_path, input_files):
+    folder = str(tmp_path / "cache")
+
+    expected = etl.pipeline(*input_files, transform_only=True, silent=True)
+    first = etl.pipeline(
+        *input_files,
+        transform_only=True,
+        silent=True,
+        cache=input_cache(use_disk=True, folder=folder),
+    )
+    cached = etl.pipeline(
+        *input_files,
+        transform_only=True,
+        silent=True,
+        cache=input_cache(use_disk=True, folder=folder),
+    )
+
+    assert first.metrics.get("cache.barcodes").rows_out is None
+    assert cached.metrics.get("cache.barcodes").rows_out == 3
+    assert cached.metrics.get("validate.barcodes") is None
+    pd.testing.assert_frame_equal(cached.df_vouchers, expected.df_vouchers)
+
+
+def test_input_cache_without_disk(input_files):
+    cache = input_cache()
+
+    assert cache.store is None
+    assert len(cache.validated(input_files[1], BARCODES, BarcodesValidator, True)) == 3
@@ -1,10 +1,16 @@
+import time
+
+import numpy as np
 import pandas as pd
 import pytest
 from etl_vouchers import etl
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.metrics import Metrics
+from etl_vouchers.schema import BARCODES, ORDERS
 
 
 def _extract_mock(df_orders, df_barcodes):
-    def _inner_mock(filepath):
+    def _inner_mock(filepath, *args, **kwargs):
         if filepath == "orders":
             return df_orders
         return df_barcodes
@@ -182,5 +188,174 @@ def test_etl(mocker, df_orders, df_barcodes, df_expected_vouchers, allow_useless
     assert resp.df_barcodes is not None
     assert resp.df_vouchers.equals(df_expected_vouchers)
     assert resp.output_filepath == "./test/output/path.csv"
+    assert resp.summary.vouchers == len(df_expected_vouchers)
 
     etl._load.assert_called_once()
+
+
+def test_etl_summary_only(mocker):
+    df_orders = pd.DataFrame({"customer_id": [1, 1, 2], "order_id": [1, 2, 3]})
+    df_barcodes = pd.DataFrame({"barcode": [1, 2, 3, 4], "order_id": [1, 1, 3, None]})
+    mocker.patch(
+        "etl_vouchers.etl.extract", side_effect=_extract_mock(df_orders, df_barcodes)
+    )
+
+    resp = etl.pipeline("orders", "barcodes", transform_only=True, summary_only=True)
+
+    assert resp.df_orders is None
+    assert resp.df_barcodes is None
+    assert resp.df_vouchers is None
+    assert resp.summary == etl.PipelineSummary(orders=3, barcodes=4, vouchers=3)
+
+
+def _groupby_apply_transform(df_orders, df_barcodes, allow_useless_vouchers):
+    df_vouchers = df_orders.merge(df_barcodes, on=["order_id"], how="left").astype(
+        {"barcode": pd.Int64Dtype()}
+    )
+
+    if not allow_useless_vouchers:
+        df_vouchers = df_vouchers.dropna(subset=["barcode"])
+
+    return (
+        df_vouchers.sort_values(by=["customer_id", "order_id"], kind="mergesort")
+        .groupby(["customer_id", "order_id"])
+        .apply(lambda df_group: df_group["barcode"].dropna().tolist())
+        .reset_index()
+        .rename(columns={0: "barcodes"})
+    )
+
+
+@pytest.mark.parametrize("allow_useless", [True, False])
+def test_transform_matches_groupby_apply(allow_useless):
+    rng = np.random.default_rng(0)
+    df_orders = pd.DataFrame(
+        {"customer_id": rng.integers(0, 50, 500), "order_id": rng.permutation(500)}
+    )
+    df_barcodes = pd.DataFrame(
+        {"barcode": np.arange(1000), "order_id": rng.integers(0, 600, 1000)}
+    ).astype({"barcode": pd.Int64Dtype()})
+
+    df_vouchers = etl._transform(df_orders, df_barcodes, allow_useless)
+    df_expected = _groupby_apply_transform(df_orders, df_barcodes, allow_useless)
+
+    assert df_vouchers.equals(df_expected)
+    assert df_vouchers.to_csv(index=False) == df_expected.to_csv(index=False)
+
+
+@pytest.mark.parametrize("engine", ["c", "pyarrow"])
+def test_extract_with_schema(tmp_path, engine):
+    if engine == "pyarrow":
+        pytest.importorskip("pyarrow")
+
+    filepath = tmp_path / "barcodes.csv"
+    filepath.write_text("barcode,order_id,comment\n1,2,a\n3,,b\n,5,c\n")
+
+    df = etl.extract(str(filepath), BARCODES, engine=engine)
+
+    assert df.columns.tolist() == ["barcode", "order_id"]
+    assert df.dtypes.tolist() == [pd.Int64Dtype(), pd.Int64Dtype()]
+    assert df["order_id"].isna().tolist() == [False, True, False]
+
+
+def test_extract_with_schema_missing_column(tmp_path):
+    filepath = tmp_path / "orders.csv"
+    filepath.write_text("customer_id,order\n1,2\n")
+
+    with pytest.raises(InvalidSourceFile):
+        etl.extract(str(filepath), ORDERS)
+
+
+def test_extract_unknown_engine():
+    with pytest.raises(ETLVouchersException):
+        etl.extract("orders.csv", engine="python")
+
+
+def test_etl_metrics(mocker):
+    df_orders = pd.DataFrame({"customer_id": [1, 1, 2], "order_id": [1, 2, 3]})
+    df_barcodes = pd.DataFrame(
+        {"barcode": [1, 2, 2, 4, None], "order_id": [1, 1, 3, None, 2]}
+    )
+    mocker.patch(
+        "etl_vouchers.etl.extract", side_effect=_extract_mock(df_orders, df_barcodes)
+    )
+    mocker.patch("etl_vouchers.etl._load", return_value="./test/output/path.csv")
+
+    resp = etl.pipeline(
+        "orders",
+        "barcodes",
+        silent=True,
+        summary_only=True,
+        concurrent_extract=False,
+        metrics=Metrics(track_memory=True),
+    )
+    spans = {it.name: it for it in resp.metrics.spans}
+
+    assert list(spans) == [
+        "extract.orders",
+        "validate.orders",
+        "extract.barcodes",
+        "validate.barcodes",
+        "transform",
+        "transform.merge",
+        "transform.aggregate",
+        "load",
+    ]
+    assert spans["validate.barcodes"].rows_in == 5
+    assert spans["validate.barcodes"].rows_out == 2
+    assert spans["validate.barcodes"].dropped == {
+        "duplicate_barcodes": 2,
+        "orders_without_barcodes": 1,
+    }
+    assert spans["transform"].rows_out == 3
+    assert all(it.seconds >= 0 and it.peak_rss > 0 for it in spans.values())
+
+
+def test_concurrent_extract_overlaps(mocker):
+    df_orders = pd.DataFrame({"customer_id": [1, 1, 2], "order_id": [1, 2, 3]})
+    df_barcodes = pd.DataFrame({"barcode": [1, 2, 3], "order_id": [1, 1, 3]})
+    extract_mock = _extract_mock(df_orders, df_barcodes)
+
+    def slow_extract(filepath, *args, **kwargs):
+        time.sleep(0.2)
+        return extract_mock(filepath)
+
+    mocker.patch("etl_vouchers.etl.extract", side_effect=slow_extract)
+
+    resp = etl.pipeline("orders", "barcodes", transform_only=True, silent=True)
+    orders = resp.metrics.get("extract.orders")
+    barcodes = resp.metrics.get("extract.barcodes")
+
+    assert sorted(it.name for it in resp.metrics.spans[:4]) == [
+        "extract.barcodes",
+        "extract.orders",
+        "validate.barcodes",
+        "validate.orders",
+    ]
+    assert barcodes.started < orders.started + orders.seconds
+    assert orders.started < barcodes.started + barcodes.seconds
+    assert resp.summary.vouchers == 3
+
+
+def test_concurrent_extract_errors(mocker):
+    def failing_extract(filepath, *args, **kwargs):
+        if filepath == "orders":
+            raise InvalidSourceFile("Can not read file orders")
+
+        raise ValueError("unexpected")
+
+    mocker.patch("etl_vouchers.etl.extract", side_effect=failing_extract)
+
+    with pytest.raises(InvalidSourceFile, match="orders"):
+        etl.pipeline("orders", "barcodes", transform_only=True, silent=True)
+
+    mocker.patch(
+        "etl_vouchers.etl.extract",
+        side_effect=lambda filepath, *args, **kwargs: (
+            pd.DataFrame({"customer_id": [1], "order_id": [1]})
+            if filepath == "orders"
+            else failing_extract(filepath)
+        ),
+    )
+
+    with pytest.raises(InvalidSourceFile, match="barcodes: unexpected"):
+        etl.pipeline("orders", "barcodes", transform_only=True, silent=True)
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.expectations import NativeDataset, dataset_for
+
+
+@pytest.mark.parametrize(
+    "column, column_index, success",
+    [
+        ("barcode", None, True),
+        ("barcode", 0, True),
+        ("barcode", 1, False),
+        ("order_id", 1, True),
+        ("order_id", 2, False),
+        ("customer_id", None, False),
+    ],
+)
+def test_expect_column_to_exist(column, column_index, success):
+    dataset = NativeDataset(pd.DataFrame({"barcode": [], "order_id": []}))
+
+    assert dataset.expect_column_to_exist(column, column_index=column_index) == {
+        "success": success
+    }
+
+
+@pytest.mark.parametrize(
+    "values, success",
+    [([], True), ([1, 2], True), ([1, None], False), ([None], False)],
+)
+def test_expect_column_values_to_not_be_null(values, success):
+    dataset = NativeDataset(pd.DataFrame({"barcode": values}, dtype="Int64"))
+
+    assert dataset.expect_column_values_to_not_be_null("barcode")["success"] == success
+    assert not dataset.expect_column_values_to_not_be_null("missing")["success"]
+
+
+@pytest.mark.parametrize(
+    "values, success",
+    [([], True), ([1, 2], True), ([1, 1], False), ([None, None, 1], True)],
+)
+def test_expect_column_values_to_be_unique(values, success):
+    dataset = NativeDataset(pd.DataFrame({"barcode": values}, dtype="Int64"))
+
+    assert dataset.expect_column_values_to_be_unique("barcode")["success"] == success
+
+
+def test_native_dataset_does_not_copy():
+    df = pd.DataFrame({"barcode": [1, 2]})
+
+    assert dataset_for(df).df is df
+
+
+def test_unknown_backend():
+    with pytest.raises(ETLVouchersException):
+        dataset_for(pd.DataFrame(), backend="unknown")
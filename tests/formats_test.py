@@ -0,0 +1,133 @@
+import pandas as pd
+import pytest
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.formats import (
+    detect_format,
+    file_extension,
+    iter_frames,
+    read_frame,
+    write_frame,
+)
+from etl_vouchers.schema import BARCODES
+
+
+@pytest.fixture
+def df_vouchers():
+    return pd.DataFrame(
+        {
+            "customer_id": [1, 1, 2],
+            "order_id": [1, 2, 3],
+            "barcodes": [[1, 2], [], [3]],
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "filepath, fmt, expected_format",
+    [
+        ("orders.csv", None, "csv"),
+        ("orders.CSV.GZ", None, "csv"),
+        ("orders.parquet", None, "parquet"),
+        ("orders.feather", None, "feather"),
+        ("orders.arrow", None, "feather"),
+        ("orders", None, "csv"),
+        ("orders.csv", "parquet", "parquet"),
+    ],
+)
+def test_detect_format(filepath, fmt, expected_format):
+    assert detect_format(filepath, fmt) == expected_format
+
+
+def test_detect_unknown_format():
+    with pytest.raises(ETLVouchersException):
+        detect_format("orders.csv", "xlsx")
+
+
+@pytest.mark.parametrize(
+    "fmt, compression, expected_extension",
+    [
+        ("csv", None, "csv"),
+        ("csv", "gzip", "csv.gz"),
+        ("parquet", "zstd", "parquet"),
+        ("feather", None, "feather"),
+    ],
+)
+def test_file_extension(fmt, compression, expected_extension):
+    assert file_extension(fmt, compression) == expected_extension
+
+
+@pytest.mark.parametrize(
+    "fmt, compression", [("parquet", None), ("parquet", "zstd"), ("feather", "lz4")]
+)
+def test_columnar_vouchers_roundtrip(tmp_path, df_vouchers, fmt, compression):
+    pa = pytest.importorskip("pyarrow")
+    filepath = str(tmp_path / f"vouchers.{fmt}")
+
+    write_frame(df_vouchers, filepath, compression=compression)
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        arrow_schema = pq.read_schema(filepath)
+    else:
+        import pyarrow.feather as feather
+
+        arrow_schema = feather.read_table(filepath).schema
+
+    assert arrow_schema.field("barcodes").type == pa.list_(pa.int64())
+
+    df = read_frame(filepath)
+
+    assert df[["customer_id", "order_id"]].equals(
+        df_vouchers[["customer_id", "order_id"]]
+    )
+    assert [it.tolist() for it in df["barcodes"]] == [[1, 2], [], [3]]
+    assert read_frame(filepath, columns=["order_id"]).columns.tolist() == ["order_id"]
+
+
+def test_csv_compressed_roundtrip(tmp_path, df_vouchers):
+    filepath = str(tmp_path / "vouchers.csv.gz")
+
+    write_frame(df_vouchers, filepath, compression="gzip")
+
+    assert read_frame(filepath)["barcodes"].tolist() == ["[1, 2]", "[]", "[3]"]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet", "feather"])
+def test_read_with_schema(tmp_path, fmt):
+    if fmt != "csv":
+        pytest.importorskip("pyarrow")
+
+    filepath = str(tmp_path / f"barcodes.{fmt}")
+    write_frame(
+        pd.DataFrame({"barcode": [1, 2, 3], "order_id": [1.0, None, 2.0], "x": 1}),
+        filepath,
+    )
+
+    df = read_frame(filepath, BARCODES)
+
+    assert df.columns.tolist() == ["barcode", "order_id"]
+    assert df.dtypes.tolist() == [pd.Int64Dtype(), pd.Int64Dtype()]
+
+    chunks = list(iter_frames(filepath, 2, BARCODES))
+
+    assert [len(it) for it in chunks] == [2, 1]
+    assert pd.concat(chunks, ignore_index=True).equals(df)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet", "feather"])
+def test_read_with_schema_rejects_leading_columns(tmp_path, fmt):
+    if fmt != "csv":
+        pytest.importorskip("pyarrow")
+
+    filepath = str(tmp_path / f"barcodes.{fmt}")
+    write_frame(
+        pd.DataFrame({"x": 1, "barcode": [1, 2, 3], "order_id": [1.0, None, 2.0]}),
+        filepath,
+    )
+
+    with pytest.raises(InvalidSourceFile):
+        read_frame(filepath, BARCODES)
+
+    with pytest.raises(InvalidSourceFile):
+        next(iter_frames(filepath, 2, BARCODES))
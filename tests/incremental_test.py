@@ -0,0 +1,243 @@
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.incremental import (
+    APPENDED,
+    CHANGED,
+    NEW,
+    UNCHANGED,
+    IncrementalState,
+    _delta,
+    fingerprint,
+    incremental_pipeline,
+)
+from etl_vouchers.vouchers import Vouchers
+
+
+@pytest.fixture
+def paths(tmp_path):
+    for it in ("out", "full"):
+        (tmp_path / it).mkdir()
+
+    return {
+        "orders": tmp_path / "orders.csv",
+        "barcodes": tmp_path / "barcodes.csv",
+        "state": str(tmp_path / "state"),
+        "out": str(tmp_path / "out"),
+        "full": str(tmp_path / "full"),
+    }
+
+
+def _run(paths, **kwargs):
+    return incremental_pipeline(
+        str(paths["orders"]),
+        str(paths["barcodes"]),
+        paths["state"],
+        paths["out"],
+        silent=True,
+        **kwargs,
+    )
+
+
+def _full_output(paths, allow_useless):
+    resp = etl.pipeline(
+        str(paths["orders"]),
+        str(paths["barcodes"]),
+        paths["full"],
+        silent=True,
+        allow_useless_vouchers=allow_useless,
+    )
+
+    with open(resp.output_filepath) as f:
+        return f.read()
+
+
+def test_fingerprint_prefix(tmp_path):
+    filepath = tmp_path / "orders.csv"
+    filepath.write_text("customer_id,order_id\n1,1\n")
+    previous = fingerprint(str(filepath))
+
+    with open(filepath, "a") as f:
+        f.write("2,2\n")
+
+    current = fingerprint(str(filepath), prefix_size=previous["size"])
+
+    assert current["sha256"] != previous["sha256"]
+    assert current["prefix_sha256"] == previous["sha256"]
+    assert current["ends_with_newline"]
+
+
+@pytest.mark.parametrize("allow_useless", [True, False])
+def test_incremental_snapshot_matches_full_run(paths, allow_useless):
+    paths["orders"].write_text("customer_id,order_id\n1,1\n2,2\n3,3\n1,4\n")
+    paths["barcodes"].write_text("barcode,order_id\n1,1\n2,1\n3,\n4,3\n5,4\n")
+
+    resp = _run(paths, allow_useless_vouchers=allow_useless)
+
+    assert resp.inputs == {"orders": NEW, "barcodes": NEW}
+
+    with open(paths["orders"], "a") as f:
+        f.write("4,5\n")
+    paths["barcodes"].write_text("barcode,order_id\n1,1\n2,1\n3,5\n4,3\n5,4\n4,2\n")
+
+    resp = _run(paths, allow_useless_vouchers=allow_useless, output="snapshot")
+
+    assert resp.inputs == {"orders": APPENDED, "barcodes": CHANGED}
+    assert resp.affected_orders == 2
+
+    with open(resp.output_filepath) as f:
+        assert f.read() == _full_output(paths, allow_useless)
+
+    resp = _run(paths, allow_useless_vouchers=allow_useless)
+
+    assert resp.inputs == {"orders": UNCHANGED, "barcodes": UNCHANGED}
+    assert resp.affected_orders == 0
+    assert resp.df_delta.empty
+
+
+def test_incremental_delta_deletes(paths):
+    paths["orders"].write_text("customer_id,order_id\n1,1\n2,2\n")
+    paths["barcodes"].write_text("barcode,order_id\n1,1\n2,2\n")
+
+    _run(paths, allow_useless_vouchers=False)
+
+    paths["barcodes"].write_text("barcode,order_id\n1,1\n2,\n")
+
+    resp = _run(paths, allow_useless_vouchers=False)
+
+    assert resp.df_delta[["customer_id", "order_id", "op"]].values.tolist() == [
+        [2, 2, "delete"]
+    ]
+    assert pd.read_csv(resp.output_filepath)["op"].tolist() == ["delete"]
+
+
+@pytest.mark.parametrize("dtype", [object, np.int32])
+def test_delta_keys(dtype):
+    previous = Vouchers(
+        customer_ids=np.array([1, 2], dtype=dtype),
+        order_ids=np.array([1, 2], dtype=dtype),
+        offsets=np.array([0, 1, 2]),
+        barcodes=np.array([5, 6]),
+    )
+    current = Vouchers(
+        customer_ids=np.array([1, 3]),
+        order_ids=np.array([1, 3]),
+        offsets=np.array([0, 1, 2]),
+        barcodes=np.array([5, 7]),
+    )
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        df_delta = _delta(previous, current)
+
+    assert df_delta[["customer_id", "order_id", "op"]].values.tolist() == [
+        [2, 2, "delete"],
+        [3, 3, "upsert"],
+    ]
+
+
+def test_incremental_unknown_output(paths):
+    with pytest.raises(ETLVouchersException):
+        _run(paths, output="everything")
+
+
+@pytest.mark.parametrize("allow_useless", [True, False])
+def test_incremental_append_matches_full_run(paths, allow_useless):
+    paths["orders"].write_text("customer_id,order_id\n1,1\n2,2\n3,3\n")
+    paths["barcodes"].write_text(
+        "barcode,order_id\n10,1\n11,1\n12,2\n13,\n14,7\n15,3\n15,\n"
+    )
+
+    _run(paths, allow_useless_vouchers=allow_useless)
+
+    with open(paths["orders"], "a") as f:
+        f.write("1,7\n4,8\n")
+    # a new barcode of order 1, a duplicate of a used, an unused and a duplicated barcode,
+    # a barcode of an appended order and a row without a barcode
+    with open(paths["barcodes"], "a") as f:
+        f.write("16,1\n12,3\n13,8\n15,8\n17,8\n,2\n")
+
+    resp = _run(paths, allow_useless_vouchers=allow_useless, output="snapshot")
+
+    assert resp.inputs == {"orders": APPENDED, "barcodes": APPENDED}
+
+    with open(resp.output_filepath) as f:
+        assert f.read() == _full_output(paths, allow_useless)
+
+    assert resp.summary.orders == 5
+    assert resp.summary.barcodes == 5
+
+    resp = _run(paths, allow_useless_vouchers=allow_useless)
+
+    assert resp.inputs == {"orders": UNCHANGED, "barcodes": UNCHANGED}
+    assert resp.df_delta.empty
+
+
+def test_incremental_append_delta(paths):
+    paths["orders"].write_text("customer_id,order_id\n1,1\n2,2\n")
+    paths["barcodes"].write_text("barcode,order_id\n1,1\n2,2\n")
+
+    _run(paths, allow_useless_vouchers=False)
+
+    with open(paths["barcodes"], "a") as f:
+        f.write("2,1\n3,1\n")
+
+    resp = _run(paths, allow_useless_vouchers=False)
+
+    assert resp.inputs == {"orders": UNCHANGED, "barcodes": APPENDED}
+    assert resp.affected_orders == 2
+    assert resp.df_delta[["order_id", "barcodes", "op"]].values.tolist() == [
+        [1, [1, 3], "upsert"],
+        [2, [], "delete"],
+    ]
+
+
+def test_incremental_existing_order_id_is_a_full_run(paths):
+    paths["orders"].write_text("customer_id,order_id\n1,1\n")
+    paths["barcodes"].write_text("barcode,order_id\n1,1\n")
+
+    _run(paths)
+
+    with open(paths["orders"], "a") as f:
+        f.write("2,1\n")
+
+    resp = _run(paths, output="snapshot")
+
+    assert resp.inputs == {"orders": APPENDED, "barcodes": UNCHANGED}
+
+    with open(resp.output_filepath) as f:
+        assert f.read() == _full_output(paths, True)
+
+
+def test_incremental_state_is_compact(paths):
+    paths["orders"].write_text("customer_id,order_id\n1,1\n")
+    paths["barcodes"].write_text("barcode,order_id\n1,1\n")
+
+    _run(paths)
+
+    state = IncrementalState(paths["state"])
+    files = [it.name for it in Path(paths["state"]).glob("run.*/*") if it.is_file()]
+
+    assert files == ["state.npz"]
+    assert state.load()["vouchers"].barcodes.tolist() == [1]
+
+
+@pytest.mark.parametrize(
+    "content", [b"", b"PK\x03\x04broken", b"\x80\x04\x95 not a zip"]
+)
+def test_incremental_unreadable_state(paths, content):
+    paths["orders"].write_text("customer_id,order_id\n1,1\n")
+    paths["barcodes"].write_text("barcode,order_id\n1,1\n")
+
+    _run(paths)
+
+    for it in Path(paths["state"]).glob("run.*/state.npz"):
+        it.write_bytes(content)
+
+    assert IncrementalState(paths["state"]).load() is None
+    assert _run(paths).inputs == {"orders": NEW, "barcodes": NEW}
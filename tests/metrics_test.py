@@ -0,0 +1,131 @@
+import json
+import pstats
+import pytest
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.metrics import (
+    CPROFILE,
+    TRACEMALLOC,
+    Metrics,
+    PeakRSS,
+    Span,
+    profile,
+    span,
+)
+
+
+@pytest.fixture
+def metrics():
+    metrics = Metrics(track_memory=False)
+
+    with metrics.span("validate.barcodes", rows_in=5) as it:
+        it.rows_out = 3
+        it.dropped = {"duplicate_barcodes": 2}
+
+    with metrics.span("transform"):
+        with metrics.span("merge") as it:
+            it.rows_out = 7
+
+    return metrics
+
+
+def test_peak_rss():
+    with PeakRSS() as rss:
+        data = bytearray(64 * 1024**2)
+
+    assert rss.peak > len(data)
+
+
+def test_peak_rss_without_proc_and_resource(mocker):
+    # e.g. Windows, neither /proc nor the resource module are there
+    mocker.patch("etl_vouchers.metrics._current_rss", return_value=None)
+    mocker.patch.dict("sys.modules", {"resource": None})
+
+    with PeakRSS() as rss:
+        pass
+
+    assert rss.peak is None
+
+
+def test_span_names(metrics):
+    assert [it.name for it in metrics.spans] == [
+        "validate.barcodes",
+        "transform",
+        "transform.merge",
+    ]
+    assert metrics.get("transform.merge").rows_out == 7
+    assert metrics.get("transform").seconds >= metrics.get("transform.merge").seconds
+    assert metrics.get("unknown") is None
+
+
+def test_span_without_metrics():
+    with span(None, "transform", rows_in=1) as it:
+        it.rows_out = 1
+
+    assert it == Span("transform", rows_in=1, rows_out=1)
+
+
+def test_track_memory():
+    metrics = Metrics(track_memory=True)
+
+    with metrics.span("extract"):
+        pass
+
+    assert metrics.get("extract").peak_rss > 0
+
+
+def test_memory_is_not_tracked_by_default():
+    metrics = Metrics()
+
+    with metrics.span("extract"):
+        pass
+
+    assert metrics.get("extract").peak_rss is None
+
+
+def test_json_lines(metrics, tmp_path):
+    path = metrics.write(str(tmp_path / "metrics.jsonl"))
+
+    with open(path) as f:
+        rows = [json.loads(it) for it in f]
+
+    assert [it["name"] for it in rows] == [it.name for it in metrics.spans]
+    assert rows[0]["dropped"] == {"duplicate_barcodes": 2}
+
+
+def test_prometheus(metrics, tmp_path):
+    with open(metrics.write(str(tmp_path / "metrics.prom"))) as f:
+        lines = f.read().splitlines()
+
+    assert "# TYPE etl_vouchers_stage_seconds gauge" in lines
+    assert 'etl_vouchers_stage_rows_in{stage="validate.barcodes"} 5' in lines
+    assert 'etl_vouchers_stage_rows_out{stage="transform.merge"} 7' in lines
+    assert (
+        'etl_vouchers_stage_rows_dropped{stage="validate.barcodes",rule="duplicate_barcodes"} 2'
+        in lines
+    )
+    assert not any("peak_rss" in it for it in lines)
+
+
+def test_profile_cprofile(tmp_path):
+    path = str(tmp_path / "etl.prof")
+
+    with profile(CPROFILE, path):
+        sorted(range(1000), reverse=True)
+
+    assert pstats.Stats(path).total_calls > 0
+
+
+def test_profile_tracemalloc(tmp_path):
+    path = tmp_path / "etl.tracemalloc"
+
+    with profile(TRACEMALLOC, str(path)):
+        data = [list(range(100)) for _ in range(100)]
+
+    assert len(data) == 100
+    assert path.read_text().startswith("Peak traced memory: ")
+
+
+def test_profile_unknown(tmp_path):
+    with pytest.raises(ETLVouchersException):
+        with profile("perf", str(tmp_path / "out")):
+            pass
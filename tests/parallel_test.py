@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.exceptions import InvalidSourceFile
+from etl_vouchers.parallel import _read_part, parallel_pipeline
+from etl_vouchers.schema import BARCODES, ORDERS
+
+
+@pytest.fixture
+def input_files(tmp_path):
+    rng = np.random.default_rng(2)
+    orders_path = tmp_path / "orders.csv"
+    barcodes_path = tmp_path / "barcodes.csv"
+
+    pd.DataFrame(
+        {"customer_id": rng.integers(0, 80, 600), "order_id": rng.permutation(600)}
+    ).to_csv(orders_path, index=False)
+
+    barcodes = rng.integers(0, 2500, 2000).astype(float)
+    barcodes[rng.random(2000) < 0.02] = np.nan
+    order_ids = rng.integers(0, 700, 2000).astype(float)
+    order_ids[rng.random(2000) < 0.05] = np.nan
+
+    pd.DataFrame({"barcode": barcodes, "order_id": order_ids}).to_csv(
+        barcodes_path, index=False
+    )
+
+    return str(orders_path), str(barcodes_path)
+
+
+@pytest.mark.parametrize("parts", [1, 3, 7])
+def test_read_part(input_files, parts):
+    orders_filepath, _ = input_files
+
+    df = pd.concat(
+        [_read_part(orders_filepath, ORDERS, part, parts) for part in range(parts)],
+        ignore_index=True,
+    )
+
+    assert df.equals(etl.extract(orders_filepath, ORDERS))
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("allow_useless", [True, False])
+def test_parallel_pipeline_matches_pipeline(input_files, workers, allow_useless):
+    expected = etl.pipeline(
+        *input_files,
+        transform_only=True,
+        silent=True,
+        allow_useless_vouchers=allow_useless,
+    )
+    resp = parallel_pipeline(
+        *input_files,
+        transform_only=True,
+        silent=True,
+        allow_useless_vouchers=allow_useless,
+        workers=workers,
+    )
+
+    assert resp.summary == expected.summary
+    assert resp.df_vouchers.equals(expected.df_vouchers)
+    assert resp.df_vouchers.to_csv(index=False) == expected.df_vouchers.to_csv(
+        index=False
+    )
+    assert (
+        resp.metrics.get("validate.barcodes").dropped
+        == expected.metrics.get("validate.barcodes").dropped
+    )
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_parallel_pipeline_columnar_inputs(input_files, tmp_path, fmt):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    paths = []
+
+    for filepath, schema in zip(input_files, (ORDERS, BARCODES)):
+        table = pa.Table.from_pandas(
+            etl.extract(filepath, schema), preserve_index=False
+        )
+        path = tmp_path / f"{schema.name}.{fmt}"
+
+        if fmt == "parquet":
+            pq.write_table(table, path, row_group_size=150)
+        else:
+            feather.write_feather(table, path, chunksize=150)
+
+        paths.append(str(path))
+
+    expected = etl.pipeline(*input_files, transform_only=True, silent=True)
+    resp = parallel_pipeline(*paths, transform_only=True, silent=True, workers=3)
+
+    assert resp.summary == expected.summary
+    assert resp.df_vouchers.equals(expected.df_vouchers)
+
+
+def test_parallel_pipeline_rejects_leading_columns(input_files, tmp_path):
+    orders_path = tmp_path / "extra.csv"
+    pd.read_csv(input_files[0]).assign(x=1)[["x", "customer_id", "order_id"]].to_csv(
+        orders_path, index=False
+    )
+
+    with pytest.raises(InvalidSourceFile):
+        parallel_pipeline(
+            str(orders_path), input_files[1], transform_only=True, silent=True
+        )
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.exceptions import InvalidSourceFile
+from etl_vouchers.metrics import Metrics
+from etl_vouchers.preflight import preflight, preflight_inputs
+from etl_vouchers.schema import BARCODES, ORDERS
+
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+
+    return str(path)
+
+
+def test_preflight(tmp_path):
+    orders = _write(tmp_path, "orders.csv", "customer_id,order_id,extra\n1,2,x\n")
+    barcodes = _write(tmp_path, "barcodes.csv", "barcode,order_id\n1,\n,2\n3,4\n")
+
+    metrics = Metrics()
+    reports = preflight_inputs(orders, barcodes, metrics=metrics)
+
+    assert [it.rows for it in reports] == [1, 3]
+    assert reports[0].columns == ["customer_id", "order_id", "extra"]
+    assert metrics.get("preflight").rows_in == 4
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ("order_id,customer_id\n1,2\n", "has to start with 2 columns"),
+        ("customer_id\n1\n", "found: customer_id"),
+        ("", "Can not read file"),
+        ("customer_id,order_id\n1,2\n3,abc\n", r"non-integer values .* \['abc'\]"),
+        ("customer_id,order_id\n1,2.5\n", "non-integer values"),
+        ("customer_id,order_id\n1,\n", "order_id has missing values"),
+    ],
+)
+def test_preflight_rejects(tmp_path, text, message):
+    with pytest.raises(InvalidSourceFile, match=message):
+        preflight(_write(tmp_path, "orders.csv", text), ORDERS)
+
+
+def test_preflight_sample_rows(tmp_path):
+    orders = _write(tmp_path, "orders.csv", "customer_id,order_id\n1,2\n3,abc\n")
+
+    assert preflight(orders, ORDERS, sample_rows=1).rows == 1
+    assert preflight(orders, ORDERS, sample_rows=0).rows == 0
+
+
+def test_preflight_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "barcodes.parquet")
+    pd.DataFrame({"order_id": [1], "barcode": [2]}).to_parquet(path)
+
+    with pytest.raises(InvalidSourceFile, match="found: order_id, barcode"):
+        preflight(path, BARCODES)
+
+
+def test_pipeline_preflight_fails_before_extract(tmp_path, mocker):
+    orders = _write(tmp_path, "orders.csv", "customer_id,order_id\nabc,1\n")
+    barcodes = _write(tmp_path, "barcodes.csv", "barcode,order_id\n1,1\n")
+    extract = mocker.patch("etl_vouchers.etl.extract")
+
+    with pytest.raises(InvalidSourceFile, match="customer_id"):
+        etl.pipeline(orders, barcodes, transform_only=True, preflight_rows=10)
+
+    extract.assert_not_called()
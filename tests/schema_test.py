@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.schema import (
+    ORDERS,
+    Schema,
+    get_schema,
+    memory_report,
+    narrow_schema,
+    narrowest_dtype,
+    register_schema,
+)
+
+
+def test_with_dtypes():
+    schema = ORDERS.with_dtypes(customer_id="int32")
+
+    assert schema.dtypes == {"customer_id": "int32", "order_id": "int64"}
+    assert ORDERS.dtypes == {"customer_id": "int64", "order_id": "int64"}
+
+
+def test_register_schema():
+    register_schema(Schema("orders", ORDERS.with_dtypes(order_id="int32").columns))
+
+    try:
+        assert get_schema("orders").dtypes["order_id"] == "int32"
+    finally:
+        register_schema(ORDERS)
+
+    with pytest.raises(ETLVouchersException):
+        get_schema("customers")
+
+
+def test_memory_report(tmp_path):
+    filepath = tmp_path / "orders.csv"
+    filepath.write_text("customer_id,barcode\n1,1\n2,\n3,3\n")
+    df = pd.read_csv(filepath, dtype={"customer_id": "int32", "barcode": "Int64"})
+
+    report = memory_report(df, pd.read_csv(filepath)).set_index("column")
+
+    assert report.loc["customer_id", "inferred_dtype"] == "int64"
+    assert report.loc["customer_id", "bytes"] == 12
+    assert report.loc["customer_id", "inferred_bytes"] == 24
+    assert report.loc["barcode", "inferred_dtype"] == "float64"
+    assert report.loc["barcode", "bytes"] == 27
+    assert report.loc["barcode", "inferred_bytes"] == 24
+    assert "saved_bytes" not in report.columns
+    assert report.loc["barcode", "narrowest_dtype"] == "Int8"
+    assert report.loc["barcode", "narrowest_bytes"] == 6
+
+
+def test_narrowest_dtype():
+    assert narrowest_dtype(pd.Series([0, 2**31 - 1])) == "int32"
+    assert narrowest_dtype(pd.Series([-1, 2**31])) == "int64"
+    assert narrowest_dtype(pd.Series([None, 300], dtype="Int64")) == "Int16"
+    assert narrowest_dtype(pd.Series([None], dtype="Int64")) == "Int8"
+    assert narrowest_dtype(pd.Series([0.5])) == "float64"
+
+
+def test_narrow_schema():
+    df = pd.DataFrame({"customer_id": [1, 70_000], "order_id": [1, 2]})
+
+    assert narrow_schema(ORDERS, df).dtypes == {
+        "customer_id": "int32",
+        "order_id": "int8",
+    }
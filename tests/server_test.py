@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+from etl_vouchers.batch import DropPair
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.server import (
+    Dataset,
+    DatasetStore,
+    QueryServer,
+    latest_pair,
+    serve,
+)
+
+ORDERS = "customer_id,order_id\n1,1\n1,2\n2,3\n3,4\n"
+BARCODES = "barcode,order_id\n10,1\n11,1\n12,3\n13,\n14,2\n14,4\n"
+
+
+def _drop(folder, name, content):
+    path = folder / name
+    path.write_text(content)
+    os.utime(path, (0, 0))
+
+    return str(path)
+
+
+@pytest.fixture
+def pair(tmp_path):
+    return DropPair(
+        _drop(tmp_path, "orders.100.csv", ORDERS),
+        _drop(tmp_path, "barcodes.100.csv", BARCODES),
+    )
+
+
+@pytest.fixture
+def server(pair):
+    store = DatasetStore(lambda: pair)
+    store.reload()
+    server = QueryServer(("127.0.0.1", 0), store, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def _get(server, path):
+    try:
+        with urlopen(f"{server.url}{path}") as resp:
+            return resp.status, json.loads(resp.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_dataset(pair):
+    dataset = Dataset.load(pair)
+
+    assert dataset.top_customers(2) == [
+        {"customer_id": 1, "amount_of_tickets": 2},
+        {"customer_id": 2, "amount_of_tickets": 1},
+    ]
+    assert dataset.unused_barcodes() == [13]
+    # duplicated barcodes are not valid
+    assert dataset.order_of(10) == 1
+    assert dataset.order_of(14) is None
+    assert dataset.order_of(13) is None
+    assert dataset.vouchers_of_customer(1) == [
+        {"customer_id": 1, "order_id": 1, "barcodes": [10, 11]}
+    ]
+    assert dataset.vouchers_of_order(3) == [
+        {"customer_id": 2, "order_id": 3, "barcodes": [12]}
+    ]
+    assert dataset.vouchers_of_order(4) == []
+
+
+def test_server(server):
+    assert _get(server, "/health")[1]["status"] == "ok"
+    assert _get(server, "/dataset")[1]["vouchers"] == 2
+    assert _get(server, "/top-customers?top=1") == (
+        200,
+        [{"customer_id": 1, "amount_of_tickets": 2}],
+    )
+    assert _get(server, "/unused-barcodes?limit=5") == (200, [13])
+    assert _get(server, "/barcodes/12") == (200, {"barcode": 12, "order_id": 3})
+    assert _get(server, "/barcodes/99")[0] == 404
+    assert _get(server, "/vouchers?order_id=1")[1][0]["barcodes"] == [10, 11]
+    assert _get(server, "/vouchers?customer_id=x")[0] == 400
+    assert _get(server, "/vouchers")[0] == 400
+    assert _get(server, "/unknown")[0] == 404
+
+
+def test_concurrent_requests(server):
+    results = []
+
+    def request():
+        results.append(_get(server, "/top-customers"))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+
+    for it in threads:
+        it.start()
+
+    for it in threads:
+        it.join()
+
+    assert len(results) == 8
+    assert all(it == results[0] for it in results)
+
+
+def test_reload_newer_drop(tmp_path):
+    _drop(tmp_path, "orders.100.csv", ORDERS)
+    _drop(tmp_path, "barcodes.100.csv", BARCODES)
+    store = DatasetStore(lambda: latest_pair(str(tmp_path)))
+
+    assert store.reload()
+    assert not store.reload()
+    assert store.current.info()["vouchers"] == 2
+
+    _drop(tmp_path, "orders.200.csv", ORDERS + "4,5\n")
+    _drop(tmp_path, "barcodes.200.csv", BARCODES + "15,5\n")
+
+    assert store.reload()
+    assert store.current.pair.orders.endswith("orders.200.csv")
+    assert store.current.info()["vouchers"] == 3
+
+    # an invalid drop is not served, the previous dataset stays
+    _drop(tmp_path, "orders.300.csv", "customer_id,order_id\n1,\n")
+    _drop(tmp_path, "barcodes.300.csv", BARCODES)
+
+    assert not store.reload()
+    assert store.current.pair.orders.endswith("orders.200.csv")
+    assert len(store.failed) == 1
+
+    # a copy, read without waiting for a reload in progress
+    with store._lock:
+        failures = store.failures()
+
+    store.failed.clear()
+    assert len(failures) == 1
+
+
+def test_serve_requires_inputs():
+    with pytest.raises(ETLVouchersException):
+        serve()
+
+
+def test_serve_invalid_files(tmp_path):
+    orders = _drop(tmp_path, "orders.csv", "customer_id,order_id\n1,\n")
+    barcodes = _drop(tmp_path, "barcodes.csv", BARCODES)
+
+    with pytest.raises(ETLVouchersException):
+        serve(orders_filepath=orders, barcodes_filepath=barcodes, port=0)
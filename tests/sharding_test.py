@@ -0,0 +1,135 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.sharding import (
+    RANGE_SHARDING,
+    read_index,
+    shard_of,
+    shards_for_customer,
+    write_shards,
+)
+from etl_vouchers.vouchers import Vouchers
+from etl_vouchers.writer import verify
+
+
+@pytest.fixture
+def vouchers():
+    rng = np.random.default_rng(5)
+    customer_ids = np.sort(rng.integers(0, 40, 300))
+    counts = rng.integers(0, 4, 300)
+
+    return Vouchers(
+        customer_ids=customer_ids,
+        order_ids=np.arange(300),
+        offsets=np.concatenate(([0], np.cumsum(counts))),
+        barcodes=np.arange(counts.sum()),
+    )
+
+
+@pytest.mark.parametrize("sharding", ["hash", "range"])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_write_shards(tmp_path, vouchers, sharding, workers):
+    index_path = write_shards(
+        vouchers, str(tmp_path), 4, sharding=sharding, workers=workers
+    )
+    index = read_index(index_path)
+
+    assert index["rows"] == len(vouchers)
+    assert [it["shard"] for it in index["files"]] == [0, 1, 2, 3]
+
+    frames = []
+
+    for it in index["files"]:
+        assert verify(it["path"])
+
+        df = pd.read_csv(it["path"])
+        assert len(df) == it["rows"]
+
+        if len(df):
+            assert df["customer_id"].is_monotonic_increasing
+            assert df["customer_id"].min() == it["min_customer_id"]
+            assert df["customer_id"].max() == it["max_customer_id"]
+
+        if sharding == "hash":
+            assert (shard_of(df["customer_id"].to_numpy(), 4) == it["shard"]).all()
+
+        frames.append(df)
+
+    df_all = pd.concat(frames).sort_values(["customer_id", "order_id"])
+    expected = vouchers.to_frame()
+    expected["barcodes"] = expected["barcodes"].astype(str)
+
+    assert df_all["order_id"].tolist() == expected["order_id"].tolist()
+    assert df_all["barcodes"].tolist() == expected["barcodes"].tolist()
+
+    # every customer is in exactly one shard
+    customer_id = int(vouchers.customer_ids[0])
+    matches = shards_for_customer(index, customer_id)
+    assert len(matches) == 1
+    assert customer_id in pd.read_csv(matches[0]["path"])["customer_id"].tolist()
+
+
+def test_range_shards_do_not_split_customers(tmp_path, vouchers):
+    index = read_index(write_shards(vouchers, str(tmp_path), 3, RANGE_SHARDING))
+    files = [it for it in index["files"] if it["rows"]]
+
+    for left, right in zip(files[:-1], files[1:]):
+        assert left["max_customer_id"] < right["min_customer_id"]
+
+
+def test_empty_shards(tmp_path, vouchers):
+    index = read_index(write_shards(vouchers.slice(0, 0), str(tmp_path), 2))
+
+    assert index["rows"] == 0
+    assert all(os.path.exists(it["path"]) for it in index["files"])
+
+
+def test_failed_shard_is_not_published(tmp_path, mocker, vouchers):
+    from etl_vouchers import sharding
+
+    load = sharding._load
+    calls = []
+
+    def failing_load(vouchers, *args, **kwargs):
+        calls.append(1)
+
+        if len(calls) == 2:
+            raise OSError("disk full")
+
+        return load(vouchers, *args, **kwargs)
+
+    mocker.patch.object(sharding, "_load", failing_load)
+
+    with pytest.raises(ETLVouchersException, match="disk full"):
+        write_shards(vouchers, str(tmp_path), 3, workers=1)
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_pipeline_shards(tmp_path):
+    resp = etl.pipeline(
+        "datasets/orders.1622544686.csv",
+        "datasets/barcodes.1622544683.csv",
+        str(tmp_path),
+        silent=True,
+        shards=3,
+        sharding="range",
+    )
+    index = read_index(resp.output_filepath)
+
+    assert index["rows"] == resp.summary.vouchers
+    assert len(index["files"]) == 3
+
+    with pytest.raises(ETLVouchersException):
+        etl.pipeline(
+            "datasets/orders.1622544686.csv",
+            "datasets/barcodes.1622544683.csv",
+            str(tmp_path),
+            silent=True,
+            shards=3,
+            chunksize=100,
+        )
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.sketches import (
+    ApproxStatistic,
+    CountMinSketch,
+    HeavyHitters,
+    HyperLogLog,
+    sketch_files,
+)
+from etl_vouchers.statistic import VoucherStatistic
+
+
+@pytest.fixture
+def files(tmp_path):
+    rng = np.random.default_rng(7)
+    # a few heavy customers over a long tail
+    customer_ids = np.concatenate(
+        [np.repeat([11, 22, 33], [400, 300, 200]), rng.integers(100, 5000, 3000)]
+    )
+    rng.shuffle(customer_ids)
+    orders_path = tmp_path / "orders.csv"
+    pd.DataFrame(
+        {"customer_id": customer_ids, "order_id": np.arange(len(customer_ids))}
+    ).to_csv(orders_path, index=False)
+
+    order_ids = rng.integers(0, len(customer_ids), 2000).astype(float)
+    order_ids[:500] = np.nan
+    barcodes_path = tmp_path / "barcodes.csv"
+    pd.DataFrame({"barcode": np.arange(2000), "order_id": order_ids}).to_csv(
+        barcodes_path, index=False
+    )
+
+    return str(orders_path), str(barcodes_path)
+
+
+def test_count_min_never_underestimates():
+    keys = np.arange(1000)
+    counts = np.arange(1000) % 7 + 1
+    sketch = CountMinSketch(width=64, depth=3)
+    sketch.add(keys, counts)
+
+    assert (sketch.estimate(keys) >= counts).all()
+
+
+def test_hyperloglog_error():
+    hll = HyperLogLog(precision=12)
+    hll.add(np.arange(50_000))
+    hll.add(np.arange(25_000))
+
+    assert abs(hll.estimate() - 50_000) / 50_000 < 0.05
+
+    empty = HyperLogLog(precision=12)
+    empty.add(np.arange(10))
+    assert empty.estimate() == 10
+
+
+def test_heavy_hitters_and_merge():
+    left, right = HeavyHitters(capacity=8), HeavyHitters(capacity=8)
+    left.add(np.concatenate([np.repeat(1, 50), np.arange(100, 200)]))
+    right.add(np.concatenate([np.repeat(2, 40), np.repeat(1, 5), np.arange(200, 300)]))
+
+    assert left.merge(right).top(2).to_dict() == {1: 55, 2: 40}
+
+
+def test_merge_requires_same_sizes():
+    with pytest.raises(ETLVouchersException):
+        HyperLogLog(10).merge(HyperLogLog(12))
+
+    with pytest.raises(ETLVouchersException):
+        CountMinSketch(64).merge(CountMinSketch(128))
+
+
+def test_sketch_files(files):
+    statistic = sketch_files([files[0]], [files[1]], chunksize=500)
+    summary = statistic.summary()
+
+    assert summary["orders"] == 3900
+    assert summary["barcodes"] == 2000
+    assert summary["unused_barcodes"] == 500
+    assert summary["unused_barcodes_ratio"] == 0.25
+    assert abs(summary["distinct_orders"] - 3900) / 3900 < 0.05
+    assert abs(summary["distinct_barcodes"] - 2000) / 2000 < 0.05
+
+    expected = VoucherStatistic(*files).top_customers(3)
+    assert statistic.top_customers(3)["customer_id"].tolist() == [11, 22, 33]
+    assert (
+        statistic.top_customers(3)["amount_of_tickets"].to_numpy()
+        >= expected["amount_of_tickets"].to_numpy()
+    ).all()
+
+
+def test_partitions_merge_like_one_file(tmp_path, files):
+    df_orders = pd.read_csv(files[0])
+    paths = []
+
+    for i, df_part in enumerate(np.array_split(df_orders, 3)):
+        paths.append(str(tmp_path / f"orders.{i}.csv"))
+        df_part.to_csv(paths[-1], index=False)
+
+    whole = sketch_files([files[0]])
+    merged = sketch_files(paths[:2]).merge(
+        ApproxStatistic.load(sketch_files(paths[2:]).save(str(tmp_path / "part")))
+    )
+
+    assert merged.summary() == whole.summary()
+    assert merged.top_customers(5).equals(whole.top_customers(5))
+
+
+def test_approx_top_customers(files):
+    df_top = VoucherStatistic(*files).top_customers(2, approx=True)
+
+    assert df_top["customer_id"].tolist() == [11, 22]
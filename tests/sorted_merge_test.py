@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.exceptions import InvalidSourceFile
+from etl_vouchers.sorted_merge import NotSorted, sorted_pipeline
+
+
+@pytest.fixture
+def sorted_files(tmp_path):
+    rng = np.random.default_rng(3)
+    orders_path = tmp_path / "orders.csv"
+    barcodes_path = tmp_path / "barcodes.csv"
+
+    # a few repeated orders, their barcodes are repeated in the voucher
+    order_ids = np.sort(np.concatenate([np.arange(400), np.arange(10)]))
+    pd.DataFrame(
+        {"customer_id": rng.integers(0, 50, len(order_ids)), "order_id": order_ids}
+    ).to_csv(orders_path, index=False)
+
+    barcodes = rng.integers(0, 3000, 1200).astype(float)
+    barcodes[rng.random(1200) < 0.02] = np.nan
+    barcode_order_ids = np.sort(rng.integers(0, 500, 1200)).astype(float)
+    barcode_order_ids[rng.random(1200) < 0.1] = np.nan
+
+    pd.DataFrame({"barcode": barcodes, "order_id": barcode_order_ids}).to_csv(
+        barcodes_path, index=False
+    )
+
+    return str(orders_path), str(barcodes_path)
+
+
+@pytest.mark.parametrize("allow_useless", [True, False])
+@pytest.mark.parametrize("chunksize", [3, 37, None])
+def test_sorted_pipeline_matches_pipeline(sorted_files, allow_useless, chunksize):
+    expected = etl.pipeline(
+        *sorted_files,
+        transform_only=True,
+        silent=True,
+        allow_useless_vouchers=allow_useless,
+    )
+    resp = sorted_pipeline(
+        *sorted_files,
+        transform_only=True,
+        silent=True,
+        allow_useless_vouchers=allow_useless,
+        chunksize=chunksize,
+    )
+
+    assert resp.summary == expected.summary
+    assert resp.df_vouchers.equals(expected.df_vouchers)
+    assert (
+        resp.metrics.get("validate.barcodes").dropped
+        == expected.metrics.get("validate.barcodes").dropped
+    )
+    assert resp.metrics.get("transform.merge") is not None
+
+
+def test_unsorted_barcodes(tmp_path, sorted_files):
+    barcodes_path = tmp_path / "unsorted_barcodes.csv"
+    df_barcodes = pd.read_csv(sorted_files[1])
+    df_barcodes.iloc[::-1].to_csv(barcodes_path, index=False)
+
+    with pytest.raises(NotSorted):
+        sorted_pipeline(
+            sorted_files[0],
+            str(barcodes_path),
+            transform_only=True,
+            silent=True,
+            chunksize=100,
+        )
+
+
+def test_unsorted_orders_are_rejected_first(tmp_path, sorted_files, mocker):
+    orders_path = tmp_path / "unsorted_orders.csv"
+    pd.read_csv(sorted_files[0]).iloc[::-1].to_csv(orders_path, index=False)
+    extract = mocker.patch("etl_vouchers.sorted_merge.SortedBarcodes.extract")
+
+    with pytest.raises(NotSorted):
+        sorted_pipeline(str(orders_path), sorted_files[1], transform_only=True)
+
+    extract.assert_not_called()
+
+
+def test_pipeline_falls_back_to_hash_join(tmp_path, sorted_files):
+    orders_path = tmp_path / "unsorted_orders.csv"
+    df_orders = pd.read_csv(sorted_files[0])
+    df_orders.sample(frac=1, random_state=1).to_csv(orders_path, index=False)
+
+    expected = etl.pipeline(
+        str(orders_path), sorted_files[1], transform_only=True, silent=True
+    )
+    resp = etl.pipeline(
+        str(orders_path),
+        sorted_files[1],
+        transform_only=True,
+        silent=True,
+        sorted_inputs=True,
+    )
+
+    assert resp.df_orders is not None
+    assert resp.df_vouchers.equals(expected.df_vouchers)
+    assert resp.metrics.get("sorted_merge.fallback") is not None
+    assert expected.metrics.get("sorted_merge.fallback") is None
+
+
+def test_fallback_is_reported(tmp_path, sorted_files, capsys):
+    orders_path = tmp_path / "unsorted_orders.csv"
+    pd.read_csv(sorted_files[0]).iloc[::-1].to_csv(orders_path, index=False)
+
+    etl.pipeline(
+        str(orders_path), sorted_files[1], transform_only=True, sorted_inputs=True
+    )
+
+    assert "Sorted Merge - Fallback To Hash Join" in capsys.readouterr().out
+
+
+def test_unbounded_memory_is_reported(sorted_files, capsys):
+    etl.pipeline(*sorted_files, transform_only=True, sorted_inputs=True)
+
+    assert "Sorted Merge - Memory Is Not Bounded" in capsys.readouterr().out
+
+    etl.pipeline(*sorted_files, transform_only=True, silent=True, sorted_inputs=True)
+
+    assert "Sorted Merge" not in capsys.readouterr().out
+
+
+def test_invalid_orders(tmp_path, sorted_files):
+    orders_path = tmp_path / "invalid_orders.csv"
+    orders_path.write_text("customer_id,order_id\n1,1\n,2\n")
+
+    with pytest.raises(InvalidSourceFile):
+        sorted_pipeline(str(orders_path), sorted_files[1], transform_only=True)
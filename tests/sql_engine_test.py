@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.exceptions import ETLVouchersException, InvalidSourceFile
+from etl_vouchers.sql_engine import (
+    DUCKDB_ENGINE,
+    SQLITE_ENGINE,
+    sql_engine,
+    sql_pipeline,
+)
+from etl_vouchers.statistic import VoucherStatistic
+
+
+@pytest.fixture(params=[SQLITE_ENGINE, DUCKDB_ENGINE])
+def engine(request):
+    if request.param == DUCKDB_ENGINE:
+        pytest.importorskip("duckdb")
+
+    return request.param
+
+
+@pytest.fixture
+def input_files(tmp_path):
+    rng = np.random.default_rng(2)
+    orders_path = tmp_path / "orders.csv"
+    barcodes_path = tmp_path / "barcodes.csv"
+
+    # a few repeated orders, their barcodes are repeated in the voucher
+    pd.DataFrame(
+        {
+            "customer_id": rng.integers(0, 60, 500),
+            "order_id": np.concatenate([rng.permutation(490), np.arange(10)]),
+        }
+    ).to_csv(orders_path, index=False)
+
+    barcodes = rng.integers(0, 3000, 1500).astype(float)
+    barcodes[rng.random(1500) < 0.02] = np.nan
+    order_ids = rng.integers(0, 600, 1500).astype(float)
+    order_ids[rng.random(1500) < 0.1] = np.nan
+
+    pd.DataFrame({"barcode": barcodes, "order_id": order_ids}).to_csv(
+        barcodes_path, index=False
+    )
+
+    return str(orders_path), str(barcodes_path)
+
+
+@pytest.mark.parametrize("allow_useless", [True, False])
+def test_sql_pipeline_matches_pipeline(tmp_path, input_files, engine, allow_useless):
+    in_memory = tmp_path / "in_memory"
+    in_database = tmp_path / "in_database"
+    in_memory.mkdir()
+    in_database.mkdir()
+
+    expected = etl.pipeline(
+        *input_files,
+        dest_path=str(in_memory),
+        silent=True,
+        allow_useless_vouchers=allow_useless,
+    )
+    resp = etl.pipeline(
+        *input_files,
+        dest_path=str(in_database),
+        silent=True,
+        allow_useless_vouchers=allow_useless,
+        engine=engine,
+    )
+
+    assert resp.df_vouchers is None
+    assert resp.summary == expected.summary
+    assert (
+        resp.metrics.get("validate.barcodes").dropped
+        == expected.metrics.get("validate.barcodes").dropped
+    )
+
+    with open(resp.output_filepath) as actual, open(expected.output_filepath) as exp:
+        assert actual.read() == exp.read()
+
+
+def test_database_is_reused(tmp_path, input_files, engine):
+    database = str(tmp_path / "vouchers.db")
+
+    first = sql_pipeline(
+        *input_files, transform_only=True, silent=True, engine=engine, database=database
+    )
+    second = sql_pipeline(
+        *input_files, transform_only=True, silent=True, engine=engine, database=database
+    )
+
+    assert first.metrics.get("extract.orders") is not None
+    assert second.metrics.get("extract.orders") is None
+    assert second.metrics.get("cache.database").rows_out == (
+        first.summary.orders + first.summary.barcodes
+    )
+    assert second.summary == first.summary
+
+    with open(input_files[0], "a") as f:
+        f.write("1,10000\n")
+
+    third = sql_pipeline(
+        *input_files, transform_only=True, silent=True, engine=engine, database=database
+    )
+
+    assert third.summary.orders == first.summary.orders + 1
+
+
+def test_statistics(tmp_path, input_files, engine):
+    statistic = VoucherStatistic(*input_files)
+
+    with sql_engine(engine, str(tmp_path / "vouchers.db")) as store:
+        store.load_inputs(*input_files, silent=True)
+
+        assert store.top_customers(5).equals(statistic.top_customers(5))
+        assert store.top_customers(0).empty
+        assert store.unused_barcodes().equals(
+            statistic.unused_barcodes().reset_index(drop=True)
+        )
+
+
+def test_invalid_orders(tmp_path, input_files, engine):
+    orders_path = tmp_path / "invalid_orders.csv"
+    orders_path.write_text("customer_id,order_id\n1,1\n,2\n")
+
+    with pytest.raises(InvalidSourceFile):
+        sql_pipeline(
+            str(orders_path), input_files[1], transform_only=True, engine=engine
+        )
+
+
+def test_unknown_engine(input_files):
+    with pytest.raises(ETLVouchersException):
+        etl.pipeline(*input_files, transform_only=True, engine="spark")
+
+
+def test_statistic_engine(tmp_path, input_files, engine):
+    statistic = VoucherStatistic(*input_files)
+    sql_statistic = VoucherStatistic(*input_files, engine=engine)
+
+    assert sql_statistic.top_customers(5).equals(statistic.top_customers(5))
+    assert sql_statistic.unused_barcodes().equals(
+        statistic.unused_barcodes().reset_index(drop=True)
+    )
+
+    resp = sql_statistic.report(dest_path=str(tmp_path), silent=True)
+
+    assert (
+        resp.pipeline.summary
+        == etl.pipeline(
+            *input_files,
+            transform_only=True,
+            silent=True,
+            allow_useless_vouchers=False,
+        ).summary
+    )
+    assert resp.top_customers.equals(statistic.top_customers(5))
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"cache": etl.InputCache()},
+        {"sorted_inputs": True},
+        {"chunksize": 100},
+        {"workers": 2},
+        {"csv_engine": "pyarrow"},
+    ],
+)
+def test_unsupported_pipeline_options(input_files, options):
+    with pytest.raises(ETLVouchersException):
+        etl.pipeline(*input_files, transform_only=True, engine=SQLITE_ENGINE, **options)
+
+
+def test_unsupported_statistic_options(tmp_path, input_files):
+    statistic = VoucherStatistic(*input_files, engine=SQLITE_ENGINE)
+
+    with pytest.raises(ETLVouchersException):
+        statistic.top_customers(5, approx=True)
+
+    with pytest.raises(ETLVouchersException):
+        statistic.top_customers(5, chunksize=100)
+
+    with pytest.raises(ETLVouchersException):
+        VoucherStatistic(*input_files, index_path=str(tmp_path), engine=SQLITE_ENGINE)
+
+    with pytest.raises(ETLVouchersException):
+        VoucherStatistic(*input_files, engine="spark")
@@ -1,37 +1,122 @@
 import pytest
 import pandas as pd
-from etl_vouchers.statistic import VoucherStatistic
+from etl_vouchers import etl
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.statistic import (
+    VoucherStatistic,
+    count_tickets,
+    count_tickets_streaming,
+    top_k,
+)
 
 
 class TestVoucherStatistic:
     @pytest.fixture(autouse=True)
     def mock_etl(self, mocker):
-        pipeline_response_mock = mocker.MagicMock(
-            df_vouchers=pd.DataFrame(
+        frames = {
+            "orders": pd.DataFrame(
                 {
                     "customer_id": [1, 2, 3, 1, 2, 4, 1, 3, 1],
                     "order_id": [1, 2, 3, 4, 5, 6, 7, 8, 9],
                 }
-            )
-        )
-        mocker.patch(
-            "etl_vouchers.statistic.pipeline", return_value=pipeline_response_mock
-        )
-        mocker.patch(
-            "etl_vouchers.statistic.extract",
-            return_value=pd.DataFrame(
+            ),
+            "barcodes": pd.DataFrame(
                 {"barcode": [1, 2, 3, 4, 5], "order_id": [None, 2, None, 4, None]}
             ),
+        }
+        mocker.patch(
+            "etl_vouchers.etl.extract",
+            side_effect=lambda filepath, *args, **kwargs: frames[filepath],
         )
 
     def test_top_5_customers(self):
         assert (
-            VoucherStatistic("test", "test")
+            VoucherStatistic("orders", "barcodes")
             .top_customers(2)
             .equals(pd.DataFrame({"customer_id": [1, 2], "amount_of_tickets": [4, 2]}))
         )
 
     def test_unused_barcodes(self):
-        assert VoucherStatistic("test", "test").unused_barcodes()[
+        assert VoucherStatistic("orders", "barcodes").unused_barcodes()[
             "barcode"
         ].tolist() == [1, 3, 5]
+
+
+@pytest.mark.parametrize(
+    "k, expected_customers",
+    [
+        (0, []),
+        (1, [5]),
+        (2, [5, 2]),
+        (3, [5, 2, 7]),
+        (4, [5, 2, 7, 9]),
+        (10, [5, 2, 7, 9, 1]),
+    ],
+)
+def test_top_k_ties_are_deterministic(k, expected_customers):
+    tickets = pd.Series([1, 3, 3, 5, 3], index=[1, 9, 7, 5, 2])
+
+    df_top = top_k(tickets, k)
+
+    assert df_top["customer_id"].tolist() == expected_customers
+    assert df_top["amount_of_tickets"].tolist() == tickets[expected_customers].tolist()
+
+
+def test_count_tickets_streaming(tmp_path):
+    orders_path = tmp_path / "orders.csv"
+    df_orders = pd.DataFrame(
+        {"customer_id": [1, 2, 3, 1, 2, 4, 1, 3, 1], "order_id": range(1, 10)}
+    )
+    df_orders.to_csv(orders_path, index=False)
+
+    tickets = count_tickets_streaming(str(orders_path), chunksize=2)
+
+    assert tickets.sort_index().equals(count_tickets(df_orders).sort_index())
+    assert (
+        VoucherStatistic(str(orders_path), "barcodes")
+        .top_customers(2, chunksize=4)
+        .equals(pd.DataFrame({"customer_id": [1, 2], "amount_of_tickets": [4, 2]}))
+    )
+
+
+class TestVoucherStatisticReport:
+    @pytest.fixture
+    def input_files(self, tmp_path):
+        orders_path = tmp_path / "orders.csv"
+        barcodes_path = tmp_path / "barcodes.csv"
+        orders_path.write_text("customer_id,order_id\n1,1\n2,2\n1,3\n3,4\n")
+        barcodes_path.write_text("barcode,order_id\n1,1\n2,1\n3,\n4,3\n5,\n6,4\n")
+
+        return str(orders_path), str(barcodes_path)
+
+    def test_report_extracts_every_file_once(self, mocker, tmp_path, input_files):
+        extract_spy = mocker.spy(etl, "extract")
+
+        resp = VoucherStatistic(*input_files).report(top=2, dest_path=str(tmp_path))
+
+        assert extract_spy.call_count == 2
+        assert resp.pipeline.summary == etl.PipelineSummary(
+            orders=4, barcodes=6, vouchers=3
+        )
+        assert resp.top_customers.equals(
+            pd.DataFrame({"customer_id": [1, 2], "amount_of_tickets": [2, 1]})
+        )
+        assert resp.unused_barcodes["barcode"].tolist() == [3, 5]
+
+    def test_report_subset(self, input_files):
+        resp = VoucherStatistic(*input_files).report(reports=["unused_barcodes"])
+
+        assert resp.pipeline is None
+        assert resp.top_customers is None
+        assert len(resp.unused_barcodes) == 2
+
+    def test_report_unknown(self, input_files):
+        with pytest.raises(ETLVouchersException):
+            VoucherStatistic(*input_files).report(reports=["unknown"])
+
+    def test_unused_barcodes_from_index(self, tmp_path, input_files):
+        statistic = VoucherStatistic(*input_files, index_path=str(tmp_path / "index"))
+
+        assert statistic.unused_barcodes()["barcode"].tolist() == [3, 5]
+        assert (tmp_path / "index" / "meta.json").exists()
+        assert statistic.unused_barcodes()["order_id"].isna().all()
@@ -0,0 +1,186 @@
+import ast
+import numpy as np
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.exceptions import InvalidSourceFile
+from etl_vouchers.formats import read_frame
+from etl_vouchers.streaming import plan_streaming, stream_pipeline
+from etl_vouchers.writer import verify
+
+
+@pytest.fixture
+def input_files(tmp_path):
+    rng = np.random.default_rng(1)
+    orders_path = tmp_path / "orders.csv"
+    barcodes_path = tmp_path / "barcodes.csv"
+
+    pd.DataFrame(
+        {"customer_id": rng.integers(0, 100, 1000), "order_id": rng.permutation(1000)}
+    ).to_csv(orders_path, index=False)
+
+    barcodes = rng.integers(0, 4000, 3000).astype(float)
+    barcodes[rng.random(3000) < 0.01] = np.nan
+    order_ids = rng.integers(0, 1200, 3000).astype(float)
+    order_ids[rng.random(3000) < 0.05] = np.nan
+
+    pd.DataFrame({"barcode": barcodes, "order_id": order_ids}).to_csv(
+        barcodes_path, index=False
+    )
+
+    return str(orders_path), str(barcodes_path)
+
+
+@pytest.mark.parametrize("allow_useless", [True, False])
+def test_stream_pipeline_matches_pipeline(tmp_path, input_files, allow_useless):
+    in_memory = tmp_path / "in_memory"
+    streamed = tmp_path / "streamed"
+    in_memory.mkdir()
+    streamed.mkdir()
+
+    expected = etl.pipeline(
+        *input_files,
+        dest_path=str(in_memory),
+        silent=True,
+        allow_useless_vouchers=allow_useless,
+    )
+    resp = stream_pipeline(
+        *input_files,
+        dest_path=str(streamed),
+        silent=True,
+        allow_useless_vouchers=allow_useless,
+        max_memory=10_000,
+        chunksize=97,
+    )
+
+    assert resp.df_orders is None and resp.df_vouchers is None
+    assert resp.summary == expected.summary
+    assert (
+        resp.metrics.get("spill.barcodes").dropped
+        == expected.metrics.get("validate.barcodes").dropped
+    )
+
+    with open(resp.output_filepath) as actual, open(expected.output_filepath) as exp:
+        assert actual.read() == exp.read()
+
+
+@pytest.mark.parametrize(
+    "output_format, compression", [("csv", "gzip"), ("parquet", None)]
+)
+def test_stream_pipeline_output_formats(
+    tmp_path, input_files, output_format, compression
+):
+    if output_format != "csv":
+        pytest.importorskip("pyarrow")
+
+    expected = etl.pipeline(*input_files, transform_only=True, silent=True)
+    resp = stream_pipeline(
+        *input_files,
+        dest_path=str(tmp_path),
+        silent=True,
+        chunksize=97,
+        output_format=output_format,
+        compression=compression,
+    )
+    df = read_frame(resp.output_filepath)
+
+    if output_format == "csv":
+        df["barcodes"] = df["barcodes"].map(ast.literal_eval)
+
+    assert verify(resp.output_filepath)
+    assert df["order_id"].tolist() == expected.df_vouchers["order_id"].tolist()
+    assert (
+        df["barcodes"].map(list).tolist() == expected.df_vouchers["barcodes"].tolist()
+    )
+
+
+def test_stream_pipeline_invalid_orders(tmp_path, input_files):
+    orders_path = tmp_path / "invalid_orders.csv"
+    pd.DataFrame({"customer_id": [1, None], "order_id": [1, 2]}).to_csv(
+        orders_path, index=False
+    )
+
+    with pytest.raises(InvalidSourceFile):
+        stream_pipeline(
+            str(orders_path),
+            input_files[1],
+            transform_only=True,
+            silent=True,
+            chunksize=1,
+        )
+
+
+@pytest.mark.parametrize(
+    "input_bytes, max_memory, chunksize, expected",
+    [
+        (10**9, None, None, {"chunksize": 1_000_000, "partitions": 1}),
+        (10**9, None, 10, {"chunksize": 10, "partitions": 1}),
+        (10**9, 2**30, None, {"chunksize": 2**21, "partitions": 8}),
+        (10, 2**30, None, {"chunksize": 2**21, "partitions": 1}),
+    ],
+)
+def test_plan_streaming(input_bytes, max_memory, chunksize, expected):
+    assert plan_streaming(input_bytes, max_memory, chunksize) == expected
+
+
+def test_stream_pipeline_repeated_orders(tmp_path):
+    orders_path = tmp_path / "orders.csv"
+    barcodes_path = tmp_path / "barcodes.csv"
+    orders_path.write_text("customer_id,order_id\n1,1\n2,2\n1,1\n")
+    barcodes_path.write_text("barcode,order_id\n22,1\n15,1\n3,2\n28,1\n5,1\n")
+
+    expected = etl.pipeline(
+        str(orders_path), str(barcodes_path), transform_only=True, silent=True
+    )
+    resp = stream_pipeline(
+        str(orders_path),
+        str(barcodes_path),
+        dest_path=str(tmp_path),
+        silent=True,
+        chunksize=2,
+    )
+    df_vouchers = pd.read_csv(
+        resp.output_filepath, converters={"barcodes": ast.literal_eval}
+    )
+
+    assert df_vouchers["barcodes"].tolist() == expected.df_vouchers["barcodes"].tolist()
+    assert df_vouchers["barcodes"].tolist()[0] == [22, 15, 28, 5, 22, 15, 28, 5]
+
+
+def test_stream_pipeline_skewed_customers(tmp_path, mocker):
+    rng = np.random.default_rng(4)
+    orders_path = tmp_path / "orders.csv"
+    barcodes_path = tmp_path / "barcodes.csv"
+    # most of the customers are crowded at the bottom of a wide id range
+    customers = rng.integers(0, 50, 2000)
+    customers[:5] = 10**12
+    customers[5:400] = 7
+    pd.DataFrame({"customer_id": customers, "order_id": rng.permutation(2000)}).to_csv(
+        orders_path, index=False
+    )
+    pd.DataFrame(
+        {"barcode": np.arange(3000), "order_id": rng.integers(0, 2000, 3000)}
+    ).to_csv(barcodes_path, index=False)
+
+    sizes = []
+    aggregate = mocker.patch(
+        "etl_vouchers.streaming._aggregate_barcodes",
+        side_effect=lambda df: sizes.append(len(df)) or etl._aggregate_barcodes(df),
+    )
+    expected = etl.pipeline(
+        str(orders_path), str(barcodes_path), dest_path=str(tmp_path), silent=True
+    )
+    resp = stream_pipeline(
+        str(orders_path),
+        str(barcodes_path),
+        dest_path=str(tmp_path),
+        silent=True,
+        max_memory=100 * 256,
+        chunksize=500,
+    )
+
+    assert aggregate.call_count > 1
+    assert max(sizes) <= 100
+
+    with open(resp.output_filepath) as actual, open(expected.output_filepath) as exp:
+        assert actual.read() == exp.read()
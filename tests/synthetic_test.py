@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.formats import CSV, FEATHER, PARQUET
+from etl_vouchers.schema import BARCODES, ORDERS
+from etl_vouchers.synthetic import DatasetShape, generate_chunk, generate_dataset
+
+
+def _chunk(**kwargs):
+    shape = DatasetShape(orders=20_000, **kwargs)
+
+    return generate_chunk(np.random.default_rng(0), shape, 0, shape.orders, 0)
+
+
+def test_generate_chunk_shape():
+    df_orders, df_barcodes = _chunk(
+        barcodes_per_order=3,
+        unused_rate=0.2,
+        duplicate_rate=0,
+        orders_without_barcodes=0.25,
+    )
+    assigned = df_barcodes["order_id"].dropna()
+
+    assert df_orders["order_id"].is_unique
+    assert assigned.isin(df_orders["order_id"]).all()
+    assert df_barcodes["order_id"].isna().sum() == int(len(assigned) * 0.2)
+    assert df_barcodes["barcode"].is_unique
+    # forced 25% plus the orders poisson gave no barcode to
+    expected = 0.25 + 0.75 * np.exp(-3)
+    assert 1 - assigned.nunique() / len(df_orders) == pytest.approx(expected, abs=0.01)
+
+
+def test_generate_chunk_skew():
+    _, df_flat = _chunk(skew=0)
+    _, df_skewed = _chunk(skew=4)
+
+    flat = df_flat["order_id"].value_counts()
+    skewed = df_skewed["order_id"].value_counts()
+
+    assert skewed.max() > 2 * flat.max()
+    assert skewed.var() > flat.var()
+
+
+def test_generate_chunk_duplicates():
+    _, df_barcodes = _chunk(duplicate_rate=0.05)
+
+    duplicated = df_barcodes["barcode"].duplicated(keep=False).mean()
+
+    assert 0.05 < duplicated < 0.15
+
+
+def test_generate_dataset_chunks(tmp_path):
+    shape = DatasetShape(orders=1000, seed=3)
+
+    orders_path, barcodes_path = generate_dataset(shape, str(tmp_path), chunksize=300)
+
+    df_orders = etl.extract(orders_path)
+    df_barcodes = etl.extract(barcodes_path)
+
+    assert df_orders["order_id"].tolist() == list(range(1000))
+    assert df_barcodes.columns.tolist() == ["barcode", "order_id"]
+    assert df_barcodes["barcode"].duplicated().sum() < len(df_barcodes) * 0.01
+
+
+def test_generate_dataset_seed(tmp_path):
+    first = generate_dataset(DatasetShape(orders=500), str(tmp_path / "a"))
+    second = generate_dataset(DatasetShape(orders=500), str(tmp_path / "b"))
+
+    for left, right in zip(first, second):
+        assert open(left).read() == open(right).read()
+
+
+def test_generate_dataset_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+
+    orders_path, barcodes_path = generate_dataset(
+        DatasetShape(orders=100), str(tmp_path), fmt=PARQUET
+    )
+
+    assert orders_path.endswith(".parquet")
+    assert len(pd.read_parquet(orders_path)) == 100
+    assert len(etl.extract(barcodes_path)) > 0
+
+
+@pytest.mark.parametrize("fmt", [CSV, PARQUET, FEATHER])
+def test_generate_dataset_chunks_per_format(tmp_path, fmt):
+    if fmt != CSV:
+        pytest.importorskip("pyarrow")
+
+    orders_path, barcodes_path = generate_dataset(
+        DatasetShape(orders=1000, seed=3), str(tmp_path / fmt), fmt=fmt, chunksize=300
+    )
+    expected = generate_dataset(
+        DatasetShape(orders=1000, seed=3), str(tmp_path / "expected"), chunksize=300
+    )
+
+    assert etl.extract(orders_path, ORDERS).equals(etl.extract(expected[0], ORDERS))
+    assert etl.extract(barcodes_path, BARCODES).equals(
+        etl.extract(expected[1], BARCODES)
+    )
+
+    if fmt == PARQUET:
+        import pyarrow.parquet as pq
+
+        assert pq.ParquetFile(orders_path).num_row_groups == 4
+
+
+@pytest.mark.parametrize("fmt", [CSV, PARQUET, FEATHER])
+def test_generate_dataset_without_orders(tmp_path, fmt):
+    if fmt != CSV:
+        pytest.importorskip("pyarrow")
+
+    orders_path, barcodes_path = generate_dataset(
+        DatasetShape(orders=0), str(tmp_path), fmt=fmt
+    )
+
+    df_orders = etl.extract(orders_path)
+    df_barcodes = etl.extract(barcodes_path)
+
+    assert df_orders.empty and df_orders.columns.tolist() == ["customer_id", "order_id"]
+    assert df_barcodes.empty and df_barcodes.columns.tolist() == ["barcode", "order_id"]
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# cumulative import time of tasks.py in a fresh interpreter, invoke itself included,
+# pandas alone takes several times longer
+IMPORT_BUDGET_SECONDS = 0.5
+
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "great_expectations"]
+
+
+def _run(code, *flags):
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def test_tasks_do_not_import_heavy_modules():
+    out = _run(
+        "import sys, tasks; "
+        f"print(','.join(it for it in {HEAVY_MODULES} if it in sys.modules))"
+    )
+
+    assert out.stdout.strip() == ""
+
+
+def test_tasks_import_time_budget():
+    out = _run("import tasks", "-X", "importtime")
+    # "import time: self [us] | cumulative | imported package"
+    cumulative = {
+        line.split("|")[2].strip(): int(line.split("|")[1])
+        for line in out.stderr.splitlines()
+        if line.startswith("import time:") and "cumulative" not in line
+    }
+
+    assert cumulative["tasks"] / 1e6 < IMPORT_BUDGET_SECONDS
+
+
+def test_invoke_list():
+    pytest.importorskip("invoke")
+
+    out = _run("from invoke.main import program; program.run(['invoke', '--list'])")
+
+    for name in ("etl", "report", "top-customers", "benchmark"):
+        assert name in out.stdout
@@ -1,5 +1,5 @@
 import pytest
-from etl_vouchers.utils import current_time, sanitize_path
+from etl_vouchers.utils import current_time, parse_size, sanitize_path
 
 
 @pytest.mark.parametrize(
@@ -24,3 +24,22 @@ def test_current_time(mocker, time_resp, expected_response):
 )
 def test_sanitize_time(input_path, expected_path):
     assert sanitize_path(input_path) == expected_path
+
+
+@pytest.mark.parametrize(
+    "size, expected_bytes",
+    [
+        (512, 512),
+        ("512", 512),
+        ("1K", 1024),
+        ("1.5GB", 1536 * 1024**2),
+        ("2mib", 2097152),
+    ],
+)
+def test_parse_size(size, expected_bytes):
+    assert parse_size(size) == expected_bytes
+
+
+def test_parse_size_invalid():
+    with pytest.raises(ValueError):
+        parse_size("a lot")
@@ -1,6 +1,19 @@
 import pandas as pd
 import pytest
-from etl_vouchers.validator import OrdersValidator, BarcodesValidator, is_valid
+from etl_vouchers.expectations import (
+    GREAT_EXPECTATIONS_BACKEND,
+    NATIVE_BACKEND,
+    NativeDataset,
+)
+from etl_vouchers.validator import OrdersValidator, BarcodesValidator, is_valid, sample
+
+
+@pytest.fixture(params=[NATIVE_BACKEND, GREAT_EXPECTATIONS_BACKEND])
+def backend(request):
+    if request.param == GREAT_EXPECTATIONS_BACKEND:
+        pytest.importorskip("great_expectations")
+
+    return request.param
 
 
 @pytest.mark.parametrize(
@@ -51,8 +64,8 @@ class TestOrdersValidator:
             (pd.DataFrame({"customer_id": [1], "order_id": [1]}), True),
         ],
     )
-    def test_has_expected_format(self, input_df, is_valid_response):
-        validator = OrdersValidator(input_df, silent=True)
+    def test_has_expected_format(self, input_df, is_valid_response, backend):
+        validator = OrdersValidator(input_df, silent=True, backend=backend)
 
         assert validator.has_expected_format() == is_valid_response
 
@@ -66,8 +79,8 @@ class TestBarcodesValidator:
             (pd.DataFrame({"barcode": [1], "order_id": [1]}), True),
         ],
     )
-    def test_has_expected_format(self, input_df, is_valid_response):
-        validator = BarcodesValidator(input_df, silent=True)
+    def test_has_expected_format(self, input_df, is_valid_response, backend):
+        validator = BarcodesValidator(input_df, silent=True, backend=backend)
 
         assert validator.has_expected_format() == is_valid_response
 
@@ -78,8 +91,8 @@ class TestBarcodesValidator:
             (pd.DataFrame({"barcode": [1, 2], "order_id": [1, 2]}), True),
         ],
     )
-    def test_no_duplicate_barcodes(self, input_df, is_valid_response):
-        validator = BarcodesValidator(input_df, silent=True)
+    def test_no_duplicate_barcodes(self, input_df, is_valid_response, backend):
+        validator = BarcodesValidator(input_df, silent=True, backend=backend)
 
         assert validator.no_duplicate_barcodes() == is_valid_response
 
@@ -90,7 +103,78 @@ class TestBarcodesValidator:
             (pd.DataFrame({"barcode": [1, 2], "order_id": [1, 2]}), True),
         ],
     )
-    def test_no_orders_without_barcodes(self, input_df, is_valid_response):
-        validator = BarcodesValidator(input_df, silent=True)
+    def test_no_orders_without_barcodes(self, input_df, is_valid_response, backend):
+        validator = BarcodesValidator(input_df, silent=True, backend=backend)
 
         assert validator.no_orders_without_barcodes() == is_valid_response
+
+    def test_dropped(self, backend):
+        validator = BarcodesValidator(
+            pd.DataFrame(
+                {"barcode": [1, 1, 2, None, 3], "order_id": [1, 2, 3, 4, None]}
+            ),
+            silent=True,
+            backend=backend,
+        )
+
+        df = validator()
+
+        assert df["barcode"].tolist() == [2, 3]
+        assert validator.dropped == {
+            "duplicate_barcodes": 2,
+            "orders_without_barcodes": 1,
+        }
+
+    def test_repeated_missing_barcodes_are_not_duplicates(self, backend):
+        validator = BarcodesValidator(
+            pd.DataFrame({"barcode": [None, None, 1, 1], "order_id": [1, 2, 3, 4]}),
+            silent=True,
+            backend=backend,
+        )
+
+        assert validator().empty
+        assert validator.dropped == {
+            "duplicate_barcodes": 2,
+            "orders_without_barcodes": 2,
+        }
+
+    def test_rules_are_evaluated_by_the_backend(self, mocker):
+        dataset = mocker.MagicMock(wraps=NativeDataset(pd.DataFrame()))
+        dataset.expect_column_to_exist.return_value = {"success": True}
+        # the backend finds no duplicates, so none are dropped
+        dataset.expect_column_values_to_be_unique.return_value = {"success": True}
+        dataset.expect_column_values_to_not_be_null.return_value = {"success": False}
+        mocker.patch("etl_vouchers.validator.dataset_for", return_value=dataset)
+
+        validator = BarcodesValidator(
+            pd.DataFrame({"barcode": [1, 1, None], "order_id": [1, 2, 3]}),
+            silent=True,
+            backend=GREAT_EXPECTATIONS_BACKEND,
+        )
+
+        assert validator()["barcode"].tolist() == [1, 1]
+        assert validator.dropped == {"orders_without_barcodes": 1}
+        dataset.expect_column_values_to_be_unique.assert_called_once_with("barcode")
+        dataset.expect_column_values_to_not_be_null.assert_called_once_with("barcode")
+
+    def test_samples_are_bounded(self, capsys):
+        validator = BarcodesValidator(
+            pd.DataFrame(
+                {"barcode": [*range(15), *range(15), None], "order_id": range(31)}
+            )
+        )
+
+        assert validator().empty
+        assert validator.samples == {
+            "duplicate_barcodes": [*range(10), "... and 5 more"],
+            "orders_without_barcodes": [30],
+        }
+        assert "... and 5 more" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize(
+    "values, size, expected",
+    [([], 2, []), ([3, 1, 3], 2, [3, 1]), ([3, 1, 2, 3], 2, [3, 1, "... and 1 more"])],
+)
+def test_sample(values, size, expected):
+    assert sample(pd.Series(values, dtype="Int64"), size) == expected
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.formats import _arrow_table
+from etl_vouchers.vouchers import Vouchers
+
+
+@pytest.fixture
+def df_vouchers():
+    return pd.DataFrame(
+        {
+            "customer_id": [1, 1, 2, 3, 3],
+            "order_id": [1, 2, 3, 4, 5],
+            "barcodes": [[1, 2], [], [3], [4, 5, 6], []],
+        }
+    )
+
+
+def test_from_merged():
+    df_merged = pd.DataFrame(
+        {
+            "customer_id": [2, 1, 1, 1, 2],
+            "order_id": [3, 1, 2, 1, 3],
+            "barcode": pd.array([7, 10, None, 11, 8], dtype="Int64"),
+        }
+    )
+
+    vouchers = Vouchers.from_merged(df_merged)
+
+    assert vouchers.customer_ids.tolist() == [1, 1, 2]
+    assert vouchers.order_ids.tolist() == [1, 2, 3]
+    assert vouchers.offsets.tolist() == [0, 2, 2, 4]
+    assert vouchers.barcodes.tolist() == [10, 11, 7, 8]
+
+
+def test_round_trip(df_vouchers):
+    vouchers = Vouchers.from_frame(df_vouchers)
+
+    assert len(vouchers) == 5
+    assert vouchers.barcode_counts().tolist() == [2, 0, 1, 3, 0]
+    assert vouchers.to_frame().equals(df_vouchers)
+    assert vouchers.nbytes == 8 * (5 + 5 + 6 + 6)
+
+
+def test_slice(df_vouchers):
+    vouchers = Vouchers.from_frame(df_vouchers)
+
+    assert (
+        vouchers.slice(2, 4)
+        .to_frame()
+        .equals(df_vouchers.iloc[2:4].reset_index(drop=True))
+    )
+    assert vouchers.slice(3, 100).offsets.tolist() == [0, 3, 3]
+    assert len(vouchers.slice(0, 0).to_frame()) == 0
+
+    for start, stop in ((10, 20), (len(vouchers), 100), (4, 2)):
+        empty = vouchers.slice(start, stop)
+
+        assert len(empty) == 0
+        assert empty.offsets.tolist() == [0]
+        assert len(empty.barcodes) == 0
+    assert [len(it) for it in vouchers.batches(2)] == [2, 2, 1]
+
+
+def test_to_arrow(df_vouchers):
+    pytest.importorskip("pyarrow")
+
+    vouchers = Vouchers.from_frame(df_vouchers)
+
+    assert vouchers.to_arrow().equals(_arrow_table(df_vouchers), check_metadata=True)
+    assert (
+        vouchers.slice(1, 3)
+        .to_arrow()
+        .equals(_arrow_table(df_vouchers.iloc[1:3]), check_metadata=True)
+    )
+
+
+def test_barcodes_per_customer(df_vouchers):
+    vouchers = Vouchers.from_frame(df_vouchers)
+
+    assert vouchers.barcodes_per_customer().to_dict() == {1: 2, 2: 1, 3: 3}
+    assert vouchers.slice(0, 0).barcodes_per_customer().empty
+
+
+def test_pipeline_vouchers(mocker):
+    df_orders = pd.DataFrame({"customer_id": [1, 1, 2], "order_id": [1, 2, 3]})
+    df_barcodes = pd.DataFrame({"barcode": [1, 2, 3], "order_id": [1, 1, 3]}).astype(
+        "Int64"
+    )
+    mocker.patch(
+        "etl_vouchers.etl.extract",
+        side_effect=lambda filepath, *args, **kwargs: (
+            df_orders if filepath == "orders" else df_barcodes
+        ),
+    )
+
+    resp = etl.pipeline("orders", "barcodes", transform_only=True, silent=True)
+
+    assert resp.vouchers.to_frame().equals(resp.df_vouchers)
+    assert np.array_equal(resp.vouchers.barcodes, [1, 2, 3])
+
+
+def test_take(df_vouchers):
+    vouchers = Vouchers.from_frame(df_vouchers)
+
+    taken = vouchers.take(np.array([3, 0, 1]))
+
+    assert taken.to_frame().equals(df_vouchers.iloc[[3, 0, 1]].reset_index(drop=True))
+    assert len(vouchers.take(np.array([], dtype=np.int64)).barcodes) == 0
+
+
+def test_to_arrow_splits_offsets(df_vouchers):
+    pytest.importorskip("pyarrow")
+
+    vouchers = Vouchers.from_frame(df_vouchers)
+    table = vouchers.to_arrow(max_barcodes=3)
+
+    # offsets of every batch stay within max_barcodes, the table is the same
+    assert [len(it) for it in table.to_batches()] == [3, 2]
+    assert table.equals(_arrow_table(df_vouchers))
+
+    with pytest.raises(ETLVouchersException):
+        vouchers.to_arrow(max_barcodes=2)
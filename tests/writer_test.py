@@ -0,0 +1,141 @@
+import os
+import pandas as pd
+import pytest
+from etl_vouchers import etl
+from etl_vouchers.exceptions import ETLVouchersException
+from etl_vouchers.formats import read_frame
+from etl_vouchers.vouchers import Vouchers
+from etl_vouchers.writer import VouchersWriter, read_manifest, verify
+
+
+@pytest.fixture
+def df_vouchers():
+    return pd.DataFrame(
+        {
+            "customer_id": [1, 1, 2, 3, 3],
+            "order_id": [1, 2, 3, 4, 5],
+            "barcodes": [[1, 2], [], [3], [4, 5, 6], []],
+        }
+    )
+
+
+def _write(df, tmp_path, batch_size=2, **kwargs):
+    with VouchersWriter(str(tmp_path), **kwargs) as writer:
+        for start in range(0, len(df), batch_size):
+            writer.write(df.iloc[start : start + batch_size])
+
+    return writer
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "bz2", "xz", "zip", "zstd"])
+def test_csv(tmp_path, df_vouchers, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+    writer = _write(df_vouchers, tmp_path, compression=compression)
+
+    df = pd.read_csv(writer.output_filepath, compression=compression or "infer")
+
+    assert df.to_csv(index=False) == df_vouchers.to_csv(index=False)
+    assert read_manifest(writer.output_filepath)["rows"] == len(df_vouchers)
+    assert verify(writer.output_filepath)
+
+
+def test_csv_matches_to_csv(tmp_path, df_vouchers):
+    writer = _write(df_vouchers, tmp_path)
+
+    with open(writer.output_filepath) as f:
+        assert f.read() == df_vouchers.to_csv(index=False)
+
+
+@pytest.mark.parametrize(
+    "fmt, compression", [("parquet", None), ("parquet", "zstd"), ("feather", "lz4")]
+)
+def test_arrow(tmp_path, df_vouchers, fmt, compression):
+    pytest.importorskip("pyarrow")
+
+    writer = _write(df_vouchers, tmp_path, fmt=fmt, compression=compression)
+    df = read_frame(writer.output_filepath)
+
+    assert writer.output_filepath.endswith(f".{fmt}")
+    assert df["barcodes"].map(list).tolist() == df_vouchers["barcodes"].tolist()
+    assert df["order_id"].tolist() == df_vouchers["order_id"].tolist()
+    assert verify(writer.output_filepath)
+
+
+def test_empty_output(tmp_path):
+    with VouchersWriter(str(tmp_path)) as writer:
+        pass
+
+    with open(writer.output_filepath) as f:
+        assert f.read() == "customer_id,order_id,barcodes\n"
+
+    assert read_manifest(writer.output_filepath)["rows"] == 0
+
+
+def test_collision_free_names(mocker, tmp_path, df_vouchers):
+    mocker.patch("etl_vouchers.writer.current_time", return_value=1622544686)
+
+    paths = [_write(df_vouchers, tmp_path).output_filepath for _ in range(3)]
+
+    assert [os.path.basename(it) for it in paths] == [
+        "vouchers.1622544686.csv",
+        "vouchers.1622544686.1.csv",
+        "vouchers.1622544686.2.csv",
+    ]
+
+
+def test_abort(tmp_path, df_vouchers):
+    with pytest.raises(RuntimeError):
+        with VouchersWriter(str(tmp_path)) as writer:
+            writer.write(df_vouchers)
+            raise RuntimeError("failed")
+
+    assert writer.output_filepath is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_verify_detects_changes(tmp_path, df_vouchers):
+    writer = _write(df_vouchers, tmp_path)
+
+    with open(writer.output_filepath, "a") as f:
+        f.write("4,6,[]\n")
+
+    assert not verify(writer.output_filepath)
+
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(ETLVouchersException):
+        VouchersWriter(str(tmp_path), compression="rar")
+
+
+def test_load_in_batches(tmp_path, df_vouchers):
+    path = etl._load(df_vouchers, str(tmp_path), batch_size=2)
+
+    with open(path) as f:
+        assert f.read() == df_vouchers.to_csv(index=False)
+
+    assert [it for it in os.listdir(tmp_path) if it.startswith(".")] == []
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet", "feather"])
+def test_write_vouchers(tmp_path, df_vouchers, fmt):
+    if fmt != "csv":
+        pytest.importorskip("pyarrow")
+
+    vouchers = Vouchers.from_frame(df_vouchers)
+    (tmp_path / "frames").mkdir()
+    (tmp_path / "vouchers").mkdir()
+
+    expected = _write(df_vouchers, tmp_path / "frames", fmt=fmt, manifest=False)
+
+    with VouchersWriter(str(tmp_path / "vouchers"), fmt=fmt, manifest=False) as writer:
+        for batch in vouchers.batches(2):
+            writer.write(batch)
+
+    assert writer.rows == len(df_vouchers)
+
+    with open(writer.output_filepath, "rb") as actual, open(
+        expected.output_filepath, "rb"
+    ) as exp:
+        assert actual.read() == exp.read()